@@ -0,0 +1,55 @@
+"""
+    Compares two results of bench/run.py
+
+        python -m bench.compare before.json after.json
+
+    For each scenario and size in both results it shows the best times and the change. It exits
+    with status 1 when any scenario got slower than --threshold, so it can be used in CI
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+
+
+DEFAULT_THRESHOLD = 0.10    # relative change considered a regression
+
+####################################################################################################
+
+def main():
+    options = parse_commandline_args()
+    before = json.loads(Path(options.before).read_text())
+    after = json.loads(Path(options.after).read_text())
+    rows = compare_results(before, after)
+    print("%-26s %8s %11s %11s %9s" % ('scenario', 'files', 'before (s)', 'after (s)', 'change'))
+    regressions = 0
+    for scenario, files, best_before, best_after, change in rows:
+        regression = change > options.threshold
+        regressions += regression
+        print("%-26s %8d %11.4f %11.4f %+8.1f%%%s" % (scenario, files, best_before, best_after,
+                                                    change * 100, '  <- slower' if regression else ''))
+    sys.exit(1 if regressions else 0)
+
+def compare_results(before, after):
+    """ returns the list of tuples (scenario, files, best before, best after, relative change) for
+        each scenario and size present in both results """
+    best_before = {(result['scenario'], result['files']): result['best'] for result in before['results']}
+    rows = list()
+    for result in after['results']:
+        key = (result['scenario'], result['files'])
+        if key in best_before:
+            change = (result['best'] - best_before[key]) / best_before[key] if best_before[key] else 0.0
+            rows.append(key + (best_before[key], result['best'], change))
+    return rows
+
+def parse_commandline_args():
+    parser = argparse.ArgumentParser(description="Compares two results of bench/run.py")
+    parser.add_argument("before", help="JSON results taken as reference")
+    parser.add_argument("after", help="JSON results to compare with the reference")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown considered a regression (default %.2f)" % DEFAULT_THRESHOLD)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
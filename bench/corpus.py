@@ -0,0 +1,196 @@
+#! /usr/bin/env python3
+
+"""
+    This script generates a synthetic Sphinx project to benchmark the rst scripts
+
+    The project is deterministic: the same arguments (including the seed) always generate exactly
+    the same files. Its layout is:
+
+    - index.rst: toctree with the index of every chapter
+    - chapterNNN/index.rst: toctree with the sections of the chapter
+    - chapterNNN/sectionNNNNNN.rst: text with references to assets and other sections
+    - img/NNN/imageNNNNNN.png and code/exampleNNNNNN.py: the assets
+
+    The density of references is the mean number of references of each kind in a section (see
+    DEFAULT_DENSITY). The 'split' density is the fraction of role references whose caption is
+    split across two lines, and the 'absolute' density the fraction of references written relative
+    to the root of the project (e.g. /img/000/image000001.png) instead of relative to the document.
+"""
+import json
+import random
+import shutil
+import posixpath
+import argparse
+from pathlib import Path
+
+
+SECTIONS_PER_CHAPTER = 100
+ASSETS_PER_FOLDER = 500
+CODE_ASSET_RATIO = 5            # one in CODE_ASSET_RATIO assets is code (for literalinclude)
+MANIFEST_NAME = 'corpus.json'   # arguments used to generate the corpus
+CORPUS_VERSION = 2              # to be increased whenever the same arguments generate a different corpus
+
+DEFAULT_DENSITY = {
+    'image': 2.0,
+    'figure': 0.5,
+    'literalinclude': 0.3,
+    'ref': 0.5,
+    'doc': 1.0,
+    'download': 0.5,
+    'split': 0.1,
+    'absolute': 0.2,
+}
+
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+          "incididunt ut labore et dolore magna aliqua").split()
+
+####################################################################################################
+
+def main():
+    options = parse_commandline_args()
+    generate_corpus(options.folder, options.files, options.assets, options.seed,
+                    dict(DEFAULT_DENSITY, **options.density))
+
+def ensure_corpus(folder, files, assets, seed=0, density=None):
+    """ generates the corpus in folder unless it already contains the very same corpus
+        When folder contains a different corpus, it is replaced.
+        It returns the manifest of the corpus (see generate_corpus())
+        It raises ValueError when folder contains anything else """
+    manifest = corpus_manifest(files, assets, seed, density)
+    try:
+        if json.loads((folder / MANIFEST_NAME).read_text()) == manifest:
+            return manifest
+        shutil.rmtree(folder)   # a corpus generated with other arguments
+    except (OSError, ValueError):
+        pass
+    if folder.exists() and any(folder.iterdir()):
+        raise ValueError("%s is not empty and doesn't contain the requested corpus" % folder)
+    return generate_corpus(folder, files, assets, seed, density)
+
+def corpus_manifest(files, assets, seed=0, density=None):
+    """ returns the dict describing the corpus generated with these arguments """
+    return {'version': CORPUS_VERSION, 'files': files, 'assets': assets, 'seed': seed,
+            'density': dict(density or DEFAULT_DENSITY)}
+
+def generate_corpus(folder, files, assets, seed=0, density=None):
+    """ generates in folder (it must not contain a previous corpus) a corpus with files rst files
+        and assets assets, and returns its manifest.
+        - seed: seed of the random generator, so the same arguments give the same corpus
+        - density: dict { kind: mean number of references per section } (see DEFAULT_DENSITY) """
+    manifest = corpus_manifest(files, assets, seed, density)
+    density = manifest['density']
+    rng = random.Random(seed)
+    asset_paths = [asset_path(nr) for nr in range(assets)]
+    images = [path for path in asset_paths if path.endswith('.png')]
+    code = [path for path in asset_paths if path.endswith('.py')]
+    sections = section_paths(files)
+    for path in asset_paths:
+        write(folder / path, "print(%d)\n" % len(path) if path.endswith('.py') else "")
+    chapters = dict()       # { chapter: list of sections }
+    for section in sections:
+        chapters.setdefault(section.split('/')[0], list()).append(section)
+    write(folder / 'index.rst', toctree_document("Index", [chapter + '/index' for chapter in chapters]))
+    for chapter, chapter_sections in chapters.items():
+        write(folder / chapter / 'index.rst',
+              toctree_document(chapter.capitalize(),
+                               [posixpath.basename(section)[:-4] for section in chapter_sections]))
+    targets = {
+        'image': images, 'figure': images, 'download': images, 'literalinclude': code,
+        'ref': [section[:-4] for section in sections], 'doc': [section[:-4] for section in sections],
+    }
+    for section in sections:
+        write(folder / section, section_document(rng, section, targets, density))
+    write(folder / MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    return manifest
+
+def section_paths(files):
+    """ returns the paths of the sections so the corpus has files rst files including the indexes """
+    sections = list()
+    nr = 0
+    while 1 + len(sections) + (len(sections) + SECTIONS_PER_CHAPTER - 1) // SECTIONS_PER_CHAPTER < files:
+        sections.append('chapter%03d/section%06d.rst' % (nr // SECTIONS_PER_CHAPTER, nr))
+        nr += 1
+    return sections
+
+def asset_path(nr):
+    """ returns the path of the asset number nr """
+    folder = nr // ASSETS_PER_FOLDER
+    if nr % CODE_ASSET_RATIO == CODE_ASSET_RATIO - 1:
+        return 'code/%03d/example%06d.py' % (folder, nr)
+    return 'img/%03d/image%06d.png' % (folder, nr)
+
+def toctree_document(title, entries):
+    """ returns the contents of a document with title and a toctree with entries """
+    lines = [title, '=' * len(title), '', '.. toctree::', '   :maxdepth: 1', '']
+    lines.extend('   ' + entry for entry in entries)
+    return '\n'.join(lines) + '\n'
+
+def section_document(rng, section, targets, density):
+    """ returns the contents of a section with references to targets as dense as density """
+    title = posixpath.basename(section)[:-4].capitalize()
+    folder = posixpath.dirname(section)
+    lines = [title, '=' * len(title), '']
+    blocks = list()
+    for kind in ('image', 'figure', 'literalinclude', 'ref', 'doc', 'download'):
+        if targets[kind]:
+            blocks.extend((kind, rng.choice(targets[kind])) for _ in range(occurrences(rng, density[kind])))
+    rng.shuffle(blocks)
+    for kind, target in blocks:
+        if rng.random() < density['absolute']:
+            target = '/' + target
+        else:
+            target = posixpath.relpath(target, folder)
+        lines.append(paragraph(rng))
+        if kind in ('image', 'figure', 'literalinclude'):
+            lines.extend(['', '.. %s:: %s' % (kind, target)])
+            if kind != 'literalinclude':
+                lines.append('   :align: center')
+            lines.append('')
+        else:
+            caption = paragraph(rng, 3)
+            if rng.random() < density['split']:
+                lines.extend(['See :%s:`%s' % (kind, caption), '%s <%s>` too.' % (caption, target), ''])
+            else:
+                lines.extend(['See :%s:`%s <%s>` too.' % (kind, caption, target), ''])
+    lines.append(paragraph(rng))
+    return '\n'.join(lines) + '\n'
+
+def occurrences(rng, mean):
+    """ returns a random number of occurrences whose mean is mean """
+    return int(mean) + (rng.random() < mean - int(mean))
+
+def paragraph(rng, words=12):
+    """ returns a line of random words """
+    return ' '.join(rng.choice(_WORDS) for _ in range(words))
+
+def write(path, contents):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(contents)
+
+def parse_density(text):
+    """ converts 'kind=mean' to the pair (kind, mean) """
+    kind, _, mean = text.partition('=')
+    if kind not in DEFAULT_DENSITY:
+        raise argparse.ArgumentTypeError("unknown kind %r" % kind)
+    return kind, float(mean)
+
+def parse_commandline_args():
+    parser = argparse.ArgumentParser(description="Generates a deterministic synthetic Sphinx project")
+    parser.add_argument("folder", type=Path, help="folder where the project is generated")
+    parser.add_argument("-n", "--files", type=int, default=1000, help="number of rst files (default 1000)")
+    parser.add_argument("-a", "--assets", type=int, default=None,
+                        help="number of assets (default the number of rst files)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the random generator (default 0)")
+    parser.add_argument("-d", "--density", type=parse_density, action='append', default=[],
+                        metavar="KIND=MEAN",
+                        help="mean number of references of KIND per section (kinds: %s)" %
+                             ", ".join(DEFAULT_DENSITY))
+    options = parser.parse_args()
+    options.density = dict(options.density)
+    if options.assets is None:
+        options.assets = options.files
+    return options
+
+
+if __name__ == "__main__":
+    main()
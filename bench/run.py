@@ -0,0 +1,209 @@
+"""
+    Times the public entry points of the rst scripts on synthetic corpora (see bench/corpus.py)
+
+    Run it from the root of the project:
+
+        python -m bench.run --sizes 1000 10000 100000 --output results.json
+
+    Corpora are generated once in --corpus-dir (one subfolder per size) and reused by the next
+    runs. Each scenario is timed --repeat times on each size and the results are written as JSON
+    so they can be compared between commits with bench/compare.py
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import subprocess
+from pathlib import Path
+
+import rstutils
+import rst_check
+import rst_rename
+import rst_ls_unref
+from bench.corpus import ensure_corpus, DEFAULT_DENSITY
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_CORPUS_DIR = Path(__file__).resolve().parent / '.corpus'
+RENAMED_TARGETS = 50        # targets renamed at once by the plan_renames scenario
+
+####################################################################################################
+#   Scenarios
+####################################################################################################
+# Each scenario gets the folder of a corpus, prepares whatever is not to be timed and returns the
+# function to be timed.
+
+def referenced_image(corpus):
+    """ returns the path (relative to corpus) of the first image referenced relative to its document,
+        so the single target scenarios always find references to it whatever the corpus is """
+    for rst in rstutils.get_rst_in_folder(corpus):
+        folder = rst.parent.relative_to(corpus).as_posix()
+        for reference in rstutils.read_references(rst):
+            if reference.kind in ('image', 'figure') and not reference.target.startswith('/'):
+                return Path(rstutils.resolve_reference(reference, '' if folder == '.' else folder)[0])
+    raise ValueError("no image is referenced in %s" % corpus)
+
+def as_written_in(rst, target, corpus):
+    """ returns target (relative to corpus) relative to the folder of rst, as the functions that
+        take the path as written in the document expect it """
+    return Path(os.path.relpath(corpus / target, rst.parent))
+
+def scenario_walk(corpus):
+    return lambda: list(rstutils.get_rst_in_folder(corpus))
+
+def scenario_check_rst_references(corpus):
+    target = referenced_image(corpus)
+    contents = [(rstutils.read_lines(rst), as_written_in(rst, target, corpus))
+                for rst in rstutils.get_rst_in_folder(corpus)]
+    return lambda: [rstutils.check_rst_references(lines, written) for lines, written in contents]
+
+def scenario_seek_references_in_file(corpus):
+    target = referenced_image(corpus)
+    rst_files = [(rst, as_written_in(rst, target, corpus)) for rst in rstutils.get_rst_in_folder(corpus)]
+    return lambda: [rstutils.seek_references_in_file(rst, written) for rst, written in rst_files]
+
+def scenario_graph_build(corpus):
+    return lambda: rstutils.ReferenceGraph.build(corpus)
+
+def scenario_graph_build_jobs(corpus):
+    return lambda: rstutils.ReferenceGraph.build(corpus, jobs=os.cpu_count())
+
+def scenario_graph_build_cached(corpus):
+    with rstutils.ReferenceCache.in_folder(corpus) as cache:
+        rstutils.ReferenceGraph.build(corpus, cache=cache)     # warm up the cache
+
+    def run():
+        with rstutils.ReferenceCache.in_folder(corpus) as cache:
+            rstutils.ReferenceGraph.build(corpus, cache=cache)
+    return run
+
+def scenario_seek_references(corpus):
+    src = corpus / referenced_image(corpus)
+    return lambda: rst_rename.seek_references(src, src.with_name('renamed' + src.suffix), corpus)
+
+def scenario_plan_renames(corpus):
+    targets = sorted((corpus / 'img' / '000').iterdir())[:RENAMED_TARGETS]
+    renames = [(src, src.with_name('renamed' + src.name)) for src in targets]
+    return lambda: rst_rename.plan_renames(renames, corpus)
+
+def scenario_check_unreferenced(corpus):
+    paths = [corpus / 'img', corpus / 'code']
+    return lambda: rst_ls_unref.check_unreferenced(paths, corpus)
+
+def scenario_seek_references_trigrams(corpus):
+    src = corpus / referenced_image(corpus)
+    with rstutils.TrigramIndex.in_folder(corpus) as trigrams:
+        trigrams.update(list(rstutils.get_rst_in_folder(corpus)))     # warm up the index
+
+    def run():
+        with rstutils.TrigramIndex.in_folder(corpus) as trigrams:
+            rst_rename.seek_references(src, src.with_name('renamed' + src.suffix), corpus, trigrams=trigrams)
+    return run
+
+def scenario_find_orphans(corpus):
+    return lambda: rst_ls_unref.find_orphans([], corpus, corpus / 'index.rst')
+
+def scenario_find_broken_references(corpus):
+    return lambda: list(rst_check.find_broken_references(corpus))
+
+SCENARIOS = {
+    'walk': scenario_walk,
+    'check_rst_references': scenario_check_rst_references,
+    'seek_references_in_file': scenario_seek_references_in_file,
+    'graph_build': scenario_graph_build,
+    'graph_build_jobs': scenario_graph_build_jobs,
+    'graph_build_cached': scenario_graph_build_cached,
+    'seek_references': scenario_seek_references,
+    'seek_references_trigrams': scenario_seek_references_trigrams,
+    'plan_renames': scenario_plan_renames,
+    'check_unreferenced': scenario_check_unreferenced,
+    'find_orphans': scenario_find_orphans,
+    'find_broken_references': scenario_find_broken_references,
+}
+
+
+####################################################################################################
+#   Running
+####################################################################################################
+
+def main():
+    options = parse_commandline_args()
+    results = run_benchmarks(options.sizes, options.scenarios, options.repeat, options.corpus_dir,
+                             options.seed)
+    text = json.dumps(results, indent=2) + "\n"
+    if options.output:
+        Path(options.output).write_text(text)
+    else:
+        sys.stdout.write(text)
+
+def run_benchmarks(sizes, scenarios, repeat, corpus_dir, seed=0):
+    """ times every scenario on a corpus of each size and returns the results as a dict """
+    results = list()
+    for size in sizes:
+        corpus = corpus_dir / ('corpus-%d' % size)
+        ensure_corpus(corpus, size, size, seed)
+        for name in scenarios:
+            print("%s on %d files..." % (name, size), file=sys.stderr, flush=True)
+            times = time_scenario(SCENARIOS[name], corpus, repeat)
+            results.append({
+                'scenario': name,
+                'files': size,
+                'best': min(times),
+                'median': statistics.median(times),
+                'times': times,
+            })
+    return {'environment': environment(seed, repeat), 'results': results}
+
+def time_scenario(scenario, corpus, repeat):
+    """ returns the list of seconds taken by each of the repeat runs of scenario on corpus """
+    function = scenario(corpus)
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+def environment(seed, repeat):
+    """ returns a dict describing where and what has been measured """
+    return {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'density': DEFAULT_DENSITY,
+        'repeat': repeat,
+    }
+
+def git_commit():
+    """ returns the commit of the working copy or None when not available """
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent)
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def parse_commandline_args():
+    parser = argparse.ArgumentParser(description="Times the rst scripts on synthetic corpora")
+    parser.add_argument("-n", "--sizes", type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="number of rst files of each corpus (default %s)" %
+                             " ".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("-s", "--scenarios", nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help="scenarios to time (default all)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs of each scenario (default 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the corpora (default 0)")
+    parser.add_argument("--corpus-dir", type=Path, default=DEFAULT_CORPUS_DIR,
+                        help="folder where the corpora are kept (default bench/.corpus)")
+    parser.add_argument("-o", "--output", help="file where the JSON results are written (default stdout)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+
+"""
+    This script lists the broken references of a base rst folder
+
+    It extracts every image, figure, literalinclude, include, toctree, :doc: and :download:
+    reference of the rst files in the base folder and lists those whose target doesn't exist, with
+    the file, line and column where they appear (line and column starting by 1, so editors can jump
+    to them). :ref: references are not checked since their targets are labels.
+
+    The existence of the targets is checked against a snapshot of the tree taken with a single
+    listing of each folder (see rstutils.list_tree()), not with a stat() per reference. Only the
+    targets outside the base folder are looked up with a stat(), once each.
+    It exits with status 1 when any broken reference is found, so it can be run on every commit.
+"""
+import sys
+import argparse
+import pathlib
+
+import rstutils
+
+
+CHECKED_KINDS = frozenset(('image', 'figure', 'literalinclude', 'include', 'toctree', 'doc', 'download'))
+
+####################################################################################################
+
+def main():
+    options = parse_commandline_args()
+    check_options(options)
+    if options['profile']:
+        rstutils.enable_profiling()
+    cache = rstutils.ReferenceCache.in_folder(options['base_folder']) if options['cache'] else None
+    broken = 0
+    try:
+        for rstpath, reference in find_broken_references(options['base_folder'], cache, options['jobs']):
+            if not broken:
+                print("List of broken references:")
+            broken += 1
+            print("\t", "%s:%d:%d: %s %s" % (rstpath.relative_to(options['base_folder']), reference.line + 1,
+                                             reference.col + 1, reference.kind, reference.target))
+        if broken:
+            print("%d broken references" % broken)
+        else:
+            print("All references are valid")
+    finally:
+        if cache:
+            cache.close()
+        profile = rstutils.disable_profiling()
+        if profile:
+            print(profile.report(options['base_folder']), file=sys.stderr)
+    sys.exit(1 if broken else 0)
+
+def find_broken_references(base_folder, cache=None, jobs=None, kinds=CHECKED_KINDS):
+    """ given a base folder containing the rst files, it generates the pairs (rstpath, Reference)
+        of the references of the given kinds whose target doesn't exist, file by file.
+        The rst files are scanned once and the targets are looked up in a snapshot of base_folder
+        (see rstutils.list_tree()), so there is no stat() per reference but one per target outside
+        base_folder (see rstutils.ReferenceGraph.dangling()). Both the snapshot and the
+        rst files come from the same listing of each folder (see rstutils.FsSnapshot)
+        When cache (rstutils.ReferenceCache) is provided, only modified rst files are parsed
+        When jobs is greater than 1, the rst files are parsed by a pool of jobs processes """
+    snapshot = rstutils.FsSnapshot()
+    existing = rstutils.list_tree(base_folder, snapshot=snapshot)
+    graph = rstutils.ReferenceGraph.build(base_folder, cache=cache, jobs=jobs, snapshot=snapshot)
+    return graph.dangling(existing, kinds)
+
+def parse_commandline_args():
+    """ defines the arguments and returns a dict containing the options with
+        the following normalization:
+        * 'base_folder' is converted to pathlib.Path (the current folder when not given)
+        * 'cache', 'jobs' and 'profile' will always appear with the corresponding value
+    """
+    parser = argparse.ArgumentParser(
+        description=("Script that lists the references of the rst files in the --base-dir "
+                     "whose target doesn't exist.")
+    )
+    parser.add_argument("-b", "--base-dir",
+                        required=False,
+                        help="Base directory for the rst project (default the current folder)",
+                        dest='base_folder',
+                        type=str,
+                        default='.',
+                        )
+    parser.add_argument("-c", "--cache",
+                        action="store_true",
+                        help=("keep the references of the rst files in %s at the base directory "
+                              "so next runs only parse the modified files" % rstutils.CACHE_FILENAME),
+                        required=False)
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=1,
+                        help="number of processes to parse the rst files (default 1)",
+                        required=False)
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="print to stderr a report of the work done on each phase of the scan",
+                        required=False)
+    args = parser.parse_args()
+    normalized_args = dict()
+    normalized_args['base_folder'] = pathlib.Path(args.base_folder).resolve()
+    normalized_args['cache'] = args.cache
+    normalized_args['jobs'] = args.jobs
+    normalized_args['profile'] = args.profile
+    return normalized_args
+
+def check_options(options):
+    """ breaks execution if options['base_folder'] is not a folder """
+    if not options['base_folder'].is_dir():
+        print("ERROR: base folder must be an existing folder")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,18 @@
 
     The script gets the list of files to check and returns those of them that have no rst file referencing
     to them.
+
+    With --orphans, it lists instead the documents and files that can't be reached from the root
+    document (index.rst by default) following the references (e.g. toctree, :doc: or include), so
+    the ones referenced only by other orphans are listed too.
+
+    With --format ndjson, it writes a JSON object per listed file instead, folder by folder as soon
+    as each folder is checked, followed by a summary record.
 """
 import sys
 import argparse
 import pathlib
+import itertools
 
 import rstutils
 
@@ -17,41 +25,144 @@ import rstutils
 
 def main():
     options = parse_commandline_args()
-    check_options(options)
-    unreferenced = check_unreferenced(**options)
-    if unreferenced:
-        print("List of unreferenced files:")
-        for path in unreferenced:
-            print("\t", path.relative_to(options['base_folder']))
+    snapshot = rstutils.FsSnapshot()
+    check_options(options, snapshot)
+    if options['profile']:
+        rstutils.enable_profiling()
+    cache = rstutils.ReferenceCache.in_folder(options['base_folder']) if options['cache'] else None
+    trigrams = rstutils.TrigramIndex.in_folder(options['base_folder']) if options['trigrams'] else None
+    try:
+        if options['format'] == 'ndjson':
+            write_ndjson(options, cache, trigrams, snapshot)
+        elif options['orphans']:
+            orphans = find_orphans(options['paths'], options['base_folder'], options['root'], cache,
+                                   options['jobs'], snapshot)
+            if orphans:
+                print("List of orphan files:")
+                for path in orphans:
+                    print("\t", path.relative_to(options['base_folder']))
+            else:
+                print("All files are reachable from %s" % options['root'].relative_to(options['base_folder']))
+        else:
+            any_unreferenced = False
+            for _, unreferenced in iter_unreferenced(options['paths'], options['base_folder'], cache,
+                                                     options['jobs'], trigrams, snapshot):
+                if unreferenced and not any_unreferenced:
+                    print("List of unreferenced files:")
+                    any_unreferenced = True
+                for path in unreferenced:
+                    print("\t", path.relative_to(options['base_folder']))
+                sys.stdout.flush()
+            if not any_unreferenced:
+                print("All files are referenced")
+    finally:
+        if cache:
+            cache.close()
+        if trigrams:
+            trigrams.close()
+        profile = rstutils.disable_profiling()
+        if profile:
+            print(profile.report(options['base_folder']), file=sys.stderr)
+
+def write_ndjson(options, cache=None, trigrams=None, snapshot=None):
+    """ writes on stdout a JSON object per line (NDJSON) for each unreferenced file (or orphan file
+        with options['orphans']) as {"type": "unreferenced" or "orphan", "path": path relative to
+        the base folder}, flushing them folder by folder, and a final summary record
+        {"type": "summary", "unreferenced" or "orphans": number of files listed} """
+    base_folder = options['base_folder']
+    kind = 'orphan' if options['orphans'] else 'unreferenced'
+    if options['orphans']:
+        orphans = find_orphans(options['paths'], base_folder, options['root'], cache, options['jobs'], snapshot)
+        groups = itertools.groupby(orphans, key=lambda path: path.parent)
     else:
-        print("All files are referenced")
+        groups = iter_unreferenced(options['paths'], base_folder, cache, options['jobs'], trigrams, snapshot)
+    listed = 0
+    for _, paths in groups:
+        for path in paths:
+            rstutils.write_record({'type': kind, 'path': path.relative_to(base_folder).as_posix()})
+            listed += 1
+        sys.stdout.flush()
+    rstutils.write_record({'type': 'summary', 'orphans' if options['orphans'] else 'unreferenced': listed})
+    sys.stdout.flush()
 
-def check_unreferenced(paths, base_folder):
+def check_unreferenced(paths, base_folder, cache=None, jobs=None, trigrams=None, snapshot=None):
     """ given a list of paths and a base folder containing the rst files, it
-        returns the list of paths that are referenced by any rst file in the base folder """
-    referenced = list()
+        returns the list of paths that are not referenced by any rst file in the base folder
+        (see iter_unreferenced() for the details) """
+    return [path for _, unreferenced in iter_unreferenced(paths, base_folder, cache, jobs, trigrams, snapshot)
+            for path in unreferenced]
+
+def iter_unreferenced(paths, base_folder, cache=None, jobs=None, trigrams=None, snapshot=None):
+    """ given a list of paths and a base folder containing the rst files, it generates
+        the pairs (folder, unreferenced) for each folder of the checked files (the paths themselves
+        and the files within the paths that are folders), where unreferenced is the list of the
+        checked files in folder that are not referenced by any rst file in the base folder.
+        The references of all the rst files are extracted just once, and then the unreferenced
+        files are the difference between the checked files and the referenced ones, computed
+        and generated folder by folder.
+        When cache (rstutils.ReferenceCache) is provided, only modified rst files are parsed
+        When trigrams (rstutils.TrigramIndex) is provided, only the rst files that may reference
+        the paths are read
+        When jobs is greater than 1, the rst files are parsed by a pool of jobs processes
+        When snapshot (rstutils.FsSnapshot) is provided, the paths are looked up in it. Otherwise
+        a new one is taken, so every folder is listed just once
+        When a rst_serve.py daemon is serving base_folder, it is asked instead
+        When there is a single path to check and no cache, the scan stops at its first reference """
+    if snapshot is None:
+        snapshot = rstutils.FsSnapshot()
     checked_files = list()
-    items = paths[:]
-    while items:
-        item = items.pop()
-        if item .is_symlink():
-            continue            # symlinks are ignored to avoid potential infinite loops
-        if item .is_dir():
-            items.extend(list(item .iterdir()))
-            continue
-        checked_files.append(item)
-        path = item.relative_to(base_folder)
-        for rst in rstutils.get_rst_in_folder(base_folder):
-            if rstutils.seek_references_in_file(rst, path):
-                referenced.append(base_folder / path)
-                break
-    return [path for path in checked_files if path not in referenced]
+    for path in paths:
+        if snapshot.is_dir(path):
+            checked_files.extend(rstutils.walk_files(path, snapshot=snapshot))
+        else:
+            checked_files.append(path)
+    response = rstutils.query_daemon(base_folder, {'op': 'unreferenced',
+                                                   'paths': [str(path) for path in checked_files]})
+    if response is not None:
+        unreferenced = set(map(pathlib.Path, response['unreferenced']))
+    elif len(checked_files) == 1 and cache is None:
+        unreferenced = set(path for path in checked_files
+                           if not rstutils.is_referenced(base_folder, path, trigrams=trigrams))
+    else:
+        graph = rstutils.ReferenceGraph.build(base_folder, cache=cache, jobs=jobs, targets=checked_files,
+                                              trigrams=trigrams, snapshot=snapshot)
+        referenced = graph.referenced()
+        unreferenced = None     # computed folder by folder
+    for folder, files in itertools.groupby(checked_files, key=lambda path: path.parent):
+        if unreferenced is None:
+            yield folder, sorted(set(files) - referenced)
+        else:
+            yield folder, [path for path in files if path in unreferenced]
+
+def find_orphans(paths, base_folder, root, cache=None, jobs=None, snapshot=None):
+    """ given a list of paths, a base folder containing the rst files and the root document, it
+        returns the sorted list of the files that can't be reached from root following the references
+        of the documents. They are:
+        - the rst files in base_folder
+        - the existing files referenced by any of them
+        - the paths and the files within the paths that are folders
+        When cache (rstutils.ReferenceCache) is provided, only modified rst files are parsed
+        When jobs is greater than 1, the rst files are parsed by a pool of jobs processes
+        When snapshot (rstutils.FsSnapshot) is provided, the paths are looked up in it. Otherwise
+        a new one is taken, so every folder is listed just once """
+    if snapshot is None:
+        snapshot = rstutils.FsSnapshot()
+    graph = rstutils.ReferenceGraph.build(base_folder, cache=cache, jobs=jobs, snapshot=snapshot)
+    reachable = graph.reachable([root])
+    candidates = set(graph.documents())
+    candidates.update(target for target in graph.referenced()
+                      if target not in reachable and snapshot.is_file(target))
+    for path in paths:
+        candidates.update(rstutils.walk_files(path, snapshot=snapshot) if snapshot.is_dir(path) else [path])
+    return sorted(candidates - reachable)
 
 def parse_commandline_args():
     """ defines the arguments and returns a dict containing the options with
         the following normalization:
         * 'paths' are converted to pathlib.Path
         * 'base_folder' is also converted if given
+        * 'cache', 'trigrams', 'jobs', 'profile', 'format', 'orphans' and 'root' will always appear
+          with the corresponding value ('root' as it was given)
     """
     parser = argparse.ArgumentParser(
         description=("Script that lists all the resources defined in the "
@@ -61,8 +172,8 @@ def parse_commandline_args():
 
     parser.add_argument("paths",
                         type=str,
-                        nargs='+',
-                        help="files to check")
+                        nargs='*',
+                        help="files to check (optional with --orphans)")
     parser.add_argument("-b", "--base-dir",
                         required=False,
                         help=("Base directory for the rst project. If not specified, then "
@@ -70,9 +181,52 @@ def parse_commandline_args():
                         dest='base_folder',
                         type=str,
                         )
+    parser.add_argument("-o", "--orphans",
+                        action="store_true",
+                        help=("list the documents and files that can't be reached from the root document "
+                              "instead of the unreferenced paths"),
+                        required=False)
+    parser.add_argument("-r", "--root",
+                        default='index',
+                        help="root document (master doc) for --orphans, relative to --base-dir (default index)",
+                        required=False)
+    parser.add_argument("-c", "--cache",
+                        action="store_true",
+                        help=("keep the references of the rst files in %s at the base directory "
+                              "so next runs only parse the modified files" % rstutils.CACHE_FILENAME),
+                        required=False)
+    parser.add_argument("-t", "--trigrams",
+                        action="store_true",
+                        help=("keep a trigram index of the rst files in %s at the base directory "
+                              "so only the files that may reference the paths are read" % rstutils.TRIGRAMS_FILENAME),
+                        required=False)
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=1,
+                        help="number of processes to parse the rst files (default 1)",
+                        required=False)
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="print to stderr a report of the work done on each phase of the scan",
+                        required=False)
+    parser.add_argument("--format",
+                        choices=rstutils.OUTPUT_FORMATS,
+                        default='text',
+                        help=("output format: text, or ndjson to write a JSON object per listed file "
+                              "as soon as its folder is checked and a final summary (default text)"),
+                        required=False)
 
     args = parser.parse_args()
+    if not args.paths and not args.orphans:
+        parser.error("paths are required unless --orphans is given")
     normalized_args = dict()
+    normalized_args['orphans'] = args.orphans
+    normalized_args['root'] = args.root
+    normalized_args['cache'] = args.cache
+    normalized_args['trigrams'] = args.trigrams
+    normalized_args['jobs'] = args.jobs
+    normalized_args['profile'] = args.profile
+    normalized_args['format'] = args.format
     normalized_args['paths'] = list()
     for path in args.paths:
         normalized_args['paths'].append(pathlib.Path(path).resolve())
@@ -80,31 +234,39 @@ def parse_commandline_args():
         normalized_args['base_folder'] = pathlib.Path(args.base_folder).resolve()
     return normalized_args
 
-def check_options(options):
-    """ checks the existence of the paths
+def check_options(options, snapshot=None):
+    """ checks the existence of the paths (looking them up in snapshot when provided)
         it breaks execution if:
         - any of the options['paths'] doesn't exist
         - in case options['base_folder'] is provided, it is not an ancestor of all the paths
+        - with options['orphans'], the root document doesn't exist
         In case base_folder is not provided, it is set to the deepest common path of all the paths
+        (or the current folder when there are no paths)
+        options['root'] is converted to the absolute pathlib.Path of the root document
     """
-    if any(not path.exists() for path in options['paths']):
-        print("ERROR: all the paths must exist")
+    if snapshot is None:
+        snapshot = rstutils.FsSnapshot()
+    out = sys.stderr if options.get('format') == 'ndjson' else sys.stdout    # stdout is kept for the records
+    if any(not snapshot.exists(path) for path in options['paths']):
+        print("ERROR: all the paths must exist", file=out)
         sys.exit(1)
 
-    cdp = rstutils.deepest_common_path(options['paths'])
+    if options['paths']:
+        cdp = rstutils.deepest_common_path(options['paths'], snapshot.is_dir)
+        if 'base_folder' not in options:
+            options['base_folder'] = cdp
+        elif options['base_folder'] not in (cdp / '_').parents:
+            print("ERROR: base folder must contain all the paths", file=out)
+            sys.exit(1)
+    elif 'base_folder' not in options:
+        options['base_folder'] = pathlib.Path.cwd()
 
-    if 'base_folder' not in options:
-        options['base_folder'] = cdp
-        return
-
-    if options['base_folder'] not in (cdp / '_').parents:
-        print("ERROR: base folder must contain all the paths")
+    root = options['base_folder'] / options['root']
+    options['root'] = root if root.suffix == '.rst' else root.with_name(root.name + '.rst')
+    if options['orphans'] and not snapshot.is_file(options['root']):
+        print("ERROR: root document %s doesn't exist" % options['root'], file=out)
         sys.exit(1)
 
 
 if __name__ == "__main__":
     main()
-
-
-
-
@@ -3,20 +3,35 @@
 """
     This script renames rst files including references
 
-    It is git aware in the sense that, if the file to be renamed is in a git repo,
-    it is renamed using git to ease control identification.
+    It is git aware in the sense that, if the file to be renamed is tracked in a git repo,
+    its rename is registered in the index to ease control identification.
 
-    Limitations:
+    When a rst_serve.py daemon is serving the base folder, the references are asked to it instead
+    of scanning the rst files.
+
+    Many files can be renamed at once, with a single scan of the rst files, either with wildcards
+    (e.g. rst_rename.py 'img/*.png' 'images/*.png') or with a --map file containing one
+    rename per line (source and destination separated by a tab).
+
+    The .rst files are looked for recursively from the base folder (skipping folders like _build or .git)
+    and, as Sphinx does, references are relative to the folder of the document (e.g. .. image:: ../img/a.png)
+    unless they start with '/', which makes them relative to the base folder (e.g. .. image:: /img/a.png).
+    Renamed references keep their style, and the relative references of the documents that are moved
+    to another folder are rewritten so they keep pointing to the same files.
+
+    With --emit-patch, nothing is performed: the changes and the renames are written as a unified
+    diff that can be reviewed and then applied with git apply.
 
-    - Current version does not work recursively. If there's a .rst in a subfolder referencing the src file,
-      this script will fail to detect it.
+    With --format ndjson, the changes are written as a JSON object per changed line, file by file as
+    soon as each one is scanned, followed by a record per rename and a summary, instead of being
+    shown highlighted. Since nobody is asked for confirmation, they are only performed with --force.
+    Warnings and errors are written to stderr then, as they are with --emit-patch -, so stdout only
+    has what programs read.
 
-      One of the implications: while it allows referencing with '/' (e.g. .. literalinclude:: /object.java),
-      since it only considers .rst files at base_folder, it is always exactly
-      the same as without (e.g. .. literalinclude:: object.java)
+    Limitations:
 
     - Current version does not allow working git unaware. If the base folder is
-      in a git repository, it will rename using git mv instead of os.mv
+      in a git repository, the renames of tracked files are registered in the index as git mv would do
 
     - Current version does not deal with special splittings that seem to be valid in Sphinx. For example,
         .. image::
@@ -33,8 +48,14 @@
 
 
 import os
+import re
 import sys
+import glob
+import json
+import shutil
 import argparse
+import itertools
+import tempfile
 import subprocess
 from pathlib import Path
 
@@ -47,80 +68,572 @@ _STANDARD_SCAPE = "\033[0m"         # reset to normal color
 
 def main():
     options = parse_commandline_args()
+    recover_interrupted(options['base_folder'], message_stream(options))
     check_options(options)
-    rename(options['src'],
-           options['dst'],
-           options['base_folder'],
-           options['force']
-           )
-
-def rename(src: Path, dst: Path, base_folder: Path, force: bool):
-    changes = seek_references(src, dst, base_folder)
+    if options['profile']:
+        rstutils.enable_profiling()
+    cache = rstutils.ReferenceCache.in_folder(options['base_folder']) if options['cache'] else None
+    trigrams = rstutils.TrigramIndex.in_folder(options['base_folder']) if options['trigrams'] else None
+    try:
+        rename_many(options['renames'],
+                    options['base_folder'],
+                    options['force'],
+                    cache,
+                    options['jobs'],
+                    trigrams,
+                    options['format'],
+                    options.get('emit_patch')
+                    )
+    finally:
+        if cache:
+            cache.close()
+        if trigrams:
+            trigrams.close()
+        profile = rstutils.disable_profiling()
+        if profile:
+            print(profile.report(options['base_folder']), file=sys.stderr)
+
+def rename(src: Path, dst: Path, base_folder: Path, force: bool, cache=None, jobs=None, trigrams=None):
+    rename_many([(src, dst)], base_folder, force, cache, jobs, trigrams)
+
+def rename_many(renames, base_folder: Path, force: bool, cache=None, jobs=None, trigrams=None,
+                output_format='text', patch=None):
+    """ renames all the pairs (src, dst) in renames and their references from a single scan
+        of the rst files in base_folder
+        With output_format 'ndjson' the changes are written as JSON records (see write_changes_ndjson())
+        as soon as each file is planned and, since there is nobody to ask for confirmation, they are
+        only performed when force
+        When patch (path of a file, '-' for stdout) is provided, nothing is performed: the changes
+        and the renames are written there as a patch instead (see write_patch()) """
+    if output_format == 'ndjson' and patch is None:
+        changes = dict()    # kept to be performed once written
+
+        def planned():
+            for path, planned_file in iter_planned_renames(renames, base_folder, cache, jobs, trigrams):
+                if force:
+                    changes[path] = planned_file
+                yield path, planned_file
+
+        files, written = write_changes_ndjson(planned(), renames, base_folder)
+        if force:
+            perform_changes(changes, renames, base_folder, verbose=False)
+        rstutils.write_record({'type': 'summary', 'files': files, 'changes': written,
+                               'renames': len(renames), 'applied': force})
+        sys.stdout.flush()
+        return
+    if patch is not None:
+        planned = iter_planned_renames(renames, base_folder, cache, jobs, trigrams)
+        if patch == '-':
+            write_patch(planned, renames, base_folder, sys.stdout)
+            return
+        with open(patch, 'w', encoding='utf-8', newline='') as out:
+            files = write_patch(planned, renames, base_folder, out)
+        print("Patch for %d files written to %s" % (files, patch))
+        return
+    changes = plan_renames(renames, base_folder, cache, jobs, trigrams)
     if changes:
         show_changes(changes, base_folder)
         confirmed = ask_for_confirmation(force)
         if confirmed:
-            perform_changes(changes)
-            rename_src(src, dst)
+            perform_changes(changes, renames, base_folder)
         else:
             print("No changes performed")
     else:
-        print("No references found. Only the file %s will be renamed" % src.relative_to(base_folder))
+        if len(renames) == 1:
+            print("No references found. Only the file %s will be renamed" % renames[0][0].relative_to(base_folder))
+        else:
+            print("No references found. Only the %d files will be renamed" % len(renames))
         confirmed = ask_for_confirmation(force)
         if confirmed:
-            rename_src(src, dst)
+            perform_changes(dict(), renames, base_folder)
 
 
-def seek_references(src: Path, dst: Path, base_folder: Path):
-    """ composes the changes to be performed on the rst files 
-        The result is a list of dicts with the following keys:
-        - linenr; the line number of the change
-        - src: the original contents of the line
-        - dst: the contents of the line once the replacements on it have took place
-        - repr: the representation of the changes with scape characters to highlight the changes
+def seek_references(src: Path, dst: Path, base_folder: Path, cache=None, jobs=None, trigrams=None):
+    """ composes the changes to be performed on the rst files to rename src as dst
+        (see plan_renames() for the details) """
+    return plan_renames([(src, dst)], base_folder, cache, jobs, trigrams)
+
+def plan_renames(renames, base_folder: Path, cache=None, jobs=None, trigrams=None):
+    """ composes the changes to be performed on the rst files to rename every pair (src, dst)
+        in renames (see iter_planned_renames() for the details).
+        The result is a dict { file: (lines, expanded_changes) } where lines are the contents of the
+        file, read just once, and expanded_changes is a list of Change
+    """
+    return dict(iter_planned_renames(renames, base_folder, cache, jobs, trigrams))
+
+def iter_planned_renames(renames, base_folder: Path, cache=None, jobs=None, trigrams=None):
+    """ generates the changes to be performed on the rst files to rename every pair (src, dst)
+        in renames, as pairs (file, (lines, expanded_changes)), as soon as each file is scanned, so
+        they can be written while the rest are scanned and without keeping all of them.
+        The rst files are scanned just once for all the renames.
+        When src is a folder, every reference to a path within src is renamed to the same path within dst
+        When cache (rstutils.ReferenceCache) is provided, only modified rst files are parsed
+        When trigrams (rstutils.TrigramIndex) is provided, only the rst files that may reference
+        the sources are read
+        When jobs is greater than 1, the rst files are parsed by a pool of jobs processes
+        When a rst_serve.py daemon is serving base_folder, the references are asked to it instead,
+        unless they don't match the current contents of the files. Since every file must match
+        before any change is generated, the files with changes are read in advance then
     """
-    changes = dict()    # { file: list_of_changes }
-    for rst in rstutils.get_rst_in_folder(base_folder):
-        changes_in_file = rstutils.seek_references_in_file(rst, src.relative_to(base_folder))
-        if changes_in_file:
-            with open(rst) as f:
-                lines = f.readlines()
-            changes[rst] = expand_changes_on_contents(lines, changes_in_file,
-                                                      str(src.relative_to(base_folder)),
-                                                      str(dst.relative_to(base_folder)))
-    return changes
-
-def show_changes(changes, base_folder):
-    """ Given a list of changes, it shows them on stdout with paths relative to base_folder """
-    for path, expanded_changes in changes.items():
-        print(path.relative_to(base_folder))
+    edits, contents = daemon_edits(renames, base_folder), dict()
+    if edits is not None:
+        contents = {rst: rstutils.read_lines(rst) for rst in edits}
+        if not all(edits_match(contents[rst], edits[rst]) for rst in edits):
+            edits, contents = None, dict()      # the daemon has not caught up with the last changes yet
+    if edits is not None:
+        planned = sorted(edits.items())
+    else:
+        sources = [src for src, _ in renames]
+        graph = rstutils.ReferenceGraph(base_folder)
+        contents = graph.contents
+
+        def unscanned_sources():    # their relative references must be rewritten if they change folder
+            for src in sources:
+                if src.suffix == '.rst' and not graph.targets_of(src):
+                    graph.update_document(src, rstutils.read_references(src))
+                    yield src
+
+        documents = graph.scan(cache=cache, jobs=jobs, retain=sources, targets=sources, trigrams=trigrams)
+        planned = graph.iter_rename_edits(renames, itertools.chain(documents, unscanned_sources()))
+    for rst, edits_in_file in planned:
+        lines = contents.pop(rst, None)
+        if lines is None:   # not read while building the graph (e.g. cached)
+            lines = rstutils.read_lines(rst)
+        with rstutils.profile_phase('expansion'):
+            expanded_changes = expand_edits_on_contents(lines, edits_in_file)
+        yield rst, (lines, expanded_changes)
+
+def daemon_edits(renames, base_folder):
+    """ asks the rst_serve.py daemon serving base_folder, if any, for the edits to perform on the rst
+        files to rename every pair (src, dst) in renames.
+        It returns a dict { file: list of (linenr, pos, src, dst) } or None when there is no daemon """
+    request = {'op': 'plan_rename', 'renames': [[str(src), str(dst)] for src, dst in renames]}
+    response = rstutils.query_daemon(base_folder, request)
+    if response is None:
+        return None
+    return {Path(rst): [tuple(edit) for edit in edits] for rst, edits in response['edits'].items()}
+
+def edits_match(lines, edits):
+    """ returns True when every edit (linenr, pos, src, dst) finds src at pos of line linenr """
+    for linenr, pos, src, dst in edits:
+        src, _ = remove_rst_extension(src, dst)
+        if linenr >= len(lines) or lines[linenr][pos:pos + len(src)] != src:
+            return False
+    return True
+
+def show_changes(changes, base_folder, out=None):
+    """ Given a list of changes, it shows them on out (stdout by default) with paths relative to
+        base_folder. The highlighted representation of each change is rendered just when written,
+        and the changes of each file are written at once """
+    out = out or sys.stdout
+    for path, (_, expanded_changes) in changes.items():
+        pieces = [str(path.relative_to(base_folder)), "\n"]
         for expanded_change in expanded_changes:
-            print("[%d];\t%s" % (expanded_change['linenr'], expanded_change['src'].strip('\n')))
-            print("\t%s" % (expanded_change['repr'].strip('\n')))
-            print()
-
-def perform_changes(changes):
-    """ Given a list of changes it performs them on the corresponding files """
-    for path, expanded_changes in changes.items():
-        with open(path) as f:
-            lines = f.readlines()
+            pieces.extend(("[%d];\t" % expanded_change.linenr, expanded_change.src.rstrip('\r\n'),
+                           "\n\t", expanded_change.repr.rstrip('\r\n'), "\n\n"))
+        out.write("".join(pieces))
+    out.flush()
+
+def write_changes_ndjson(changes, renames, base_folder, out=None):
+    """ Given the changes as pairs (file, (lines, expanded_changes)), e.g. as generated by
+        iter_planned_renames(), it writes on out (stdout by default) a JSON object per line (NDJSON):
+        - for each change: {"type": "change", "file", "linenr", "src", "dst", "edits"} where edits is
+          the list of {"pos", "src", "dst"} replacements on the line
+        - for each pair (src, dst) in renames: {"type": "rename", "src", "dst"}
+        Paths are relative to base_folder, and the changes are flushed file by file as they come.
+        It returns the pair (files, changes) with the number of files and changes written """
+    out = out or sys.stdout
+    files = written = 0
+    for path, (_, expanded_changes) in changes:
+        relative = path.relative_to(base_folder).as_posix()
         for change in expanded_changes:
-            lines[change['linenr']] = change['dst']
-        with open(path, "w") as f:
-            f.write("".join(lines))
-    print("Renamed references")
+            rstutils.write_record({'type': 'change', 'file': relative, 'linenr': change.linenr,
+                                   'src': change.src.rstrip('\r\n'), 'dst': change.dst.rstrip('\r\n'),
+                                   'edits': [{'pos': pos, 'src': src, 'dst': dst} for pos, src, dst in change.edits]},
+                                  out)
+        files += 1
+        written += len(expanded_changes)
+        out.flush()
+    for src, dst in renames:
+        rstutils.write_record({'type': 'rename', 'src': src.relative_to(base_folder).as_posix(),
+                               'dst': dst.relative_to(base_folder).as_posix()}, out)
+    out.flush()
+    return files, written
 
+def perform_changes(changes, renames, base_folder, verbose=True):
+    """ Given a list of changes it performs them on the corresponding files and then it renames
+        every pair (src, dst) in renames, all of it as a single Transaction.
+        The lines read by seek_references() are reused, so files are not read again
+        When verbose, what has been renamed is shown on stdout """
+    contents = dict()
+    for path, (lines, expanded_changes) in changes.items():
+        for change in expanded_changes:
+            lines[change.linenr] = change.dst
+        contents[path] = "".join(lines)
+    moves = order_moves(renames)
+    repository = GitRepository.containing(base_folder)
+    renamed = [("Folder" if src.is_dir() else "File",
+                " with git" if repository is not None and repository.is_tracked(src) else "")
+               for src, _ in renames] if verbose else ()
+    with rstutils.profile_phase('writing'):
+        Transaction(base_folder).run(contents, moves, repository)
+    if not verbose:
+        return
+    if contents:
+        print("Renamed references")
+    for kind, with_git in renamed:
+        print("%s renamed%s" % (kind, with_git))
 
+def recover_interrupted(base_folder, out=None):
+    """ in case a previous execution was interrupted while performing its changes in base_folder,
+        it rolls them back warning about it on out (stdout by default) """
+    transaction = Transaction(base_folder)
+    if transaction.journal_path.exists():
+        print("WARNING: a previous execution was interrupted. Rolling back its changes", file=out or sys.stdout)
+        transaction.recover()
 
-def rename_src(src, dst):
-    """ performs the renaming depending on whether src is or not in a git repository
-        It assumes src and dst belong to the same git repository """
-    if is_file_in_git(src.parent):
-        git_mv(src, dst)
-        print("File renamed with git")
-    else:
-        src.rename(dst)
-        print("File renamed")
+def message_stream(options):
+    """ returns the stream for the messages to the user: stderr when stdout is kept for the output
+        read by programs (the records with --format ndjson or the patch with --emit-patch -),
+        stdout otherwise """
+    if options.get('format') == 'ndjson' or options.get('emit_patch') == '-':
+        return sys.stderr
+    return sys.stdout
+
+
+####################################################################################################
+# Transactional application of changes
+####################################################################################################
+
+class Transaction:
+    """ Performs the rewriting of many files and the moves of the renamed files as a whole.
+
+        The steps are:
+        1. the new contents are written to temporary files in the folders of the originals
+        2. the temporary files are fsync'ed as a batch and the journal, containing the whole
+           plan, is written to base_folder and fsync'ed
+        3. each original is hard linked to a backup and atomically replaced by its temporary file
+        4. the missing destination folders are created, the files are moved and, when in a git repository, the moves are registered in the index
+        5. the journal is removed (commit point) and then the backups
+
+        If any step fails, the steps already done are rolled back. If the process dies, the
+        journal remains and recover() rolls back the changes on the next execution.
+
+        The journal is a line of JSON with the plan, which includes the (st_dev, st_ino) of what
+        each move moves, followed by a line of JSON appended (and fsync'ed) when all the moves are
+        done and another one when the index is updated. Nothing is written to the journal in the
+        middle of the moves: recover() tells which of them took place by looking for the inodes, so
+        the rollback undoes exactly those, in reverse order, instead of guessing them from the names
+        of the files (which is ambiguous for swaps and chains of moves).
+    """
+
+    JOURNAL_NAME = rstutils.JOURNAL_FILENAME
+
+    def __init__(self, base_folder):
+        self.journal_path = base_folder / self.JOURNAL_NAME
+
+    def run(self, contents, moves, repository=None):
+        """ given contents { path: new contents (str) } and the list of moves (src, dst), it
+            performs all of them or none. When repository (GitRepository) is provided, the
+            moves are registered in its index """
+        plan = {'files': list(),
+                'moves': plan_moves(moves),
+                'folders': [str(folder) for folder in missing_folders(dst.parent for _, dst in moves)],
+                'git': str(repository.toplevel) if repository else None,
+                'index': repository.affected_entries(moves) if repository else None}
+        progress = {'moved': 0, 'index': False}     # moves completed and whether the index may be updated
+        try:
+            for path, text in contents.items():
+                temporary = self._write_temporary(path, text)
+                plan['files'].append((str(path), temporary, '%s.rst_rename-backup' % temporary))
+            for _, temporary, _ in plan['files']:
+                fsync_path(temporary)
+            self._write_journal(plan)
+            for path, temporary, backup in plan['files']:
+                link_or_copy(path, backup)
+                os.replace(temporary, path)
+            for folder in plan['folders']:
+                os.mkdir(folder)
+            for src, dst in moves:
+                src.rename(dst)
+                progress['moved'] += 1
+            fsync_folders(set(Path(path).parent for path, _, _ in plan['files']) |
+                          set(dst.parent for _, dst in moves) |
+                          set(src.parent for src, _ in moves))
+            self._log_progress({'done': 'moves'})
+            if repository:
+                progress['index'] = True    # git may update the index and fail anyway
+                repository.move_index_entries(moves)
+                self._log_progress({'done': 'index'})
+        except BaseException:
+            self._rollback(plan, progress, repository)
+            raise
+        self._clean_up(plan)
+
+    def recover(self):
+        """ rolls back the changes of an interrupted transaction as described in its journal.
+            When every step was done and only the cleaning up was left, it just cleans up """
+        with open(self.journal_path) as f:
+            plan = json.loads(f.readline())
+            done = set(json.loads(line)['done'] for line in f if line.endswith('\n'))    # but a torn last one
+        if 'index' in done or 'moves' in done and not plan.get('git'):
+            self._clean_up(plan)
+            return
+        progress = {'moved': len(plan['moves']) if 'moves' in done else moves_done(plan['moves']),
+                    'index': 'moves' in done}
+        self._rollback(plan, progress, GitRepository(Path(plan['git'])) if plan.get('git') else None)
+
+    def _clean_up(self, plan):
+        """ removes the journal (commit point) and then the backups of the rewritten files """
+        self.journal_path.unlink()
+        for _, _, backup in plan['files']:
+            remove_if_exists(backup)
+
+    def _rollback(self, plan, progress, repository):
+        """ undoes whatever was done from plan. progress tells the steps completed: the moves are
+            undone from the last completed one backwards and, when the index may have been updated,
+            the original entries journaled in the plan are written back (which is harmless when the
+            update didn't take place in the end). The rewritten files are restored from their
+            backups, if any, so it can be performed from any point of run() """
+        if repository and progress['index'] and plan.get('index') is not None:
+            repository.restore_index_entries(plan['index'])
+        for src, dst, _ in reversed(plan['moves'][:progress['moved']]):
+            Path(dst).rename(src)
+        for folder in reversed(plan.get('folders', list())):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass    # not created or not empty
+        for path, temporary, backup in plan['files']:
+            if os.path.exists(backup):
+                os.replace(backup, path)
+            remove_if_exists(temporary)
+        remove_if_exists(self.journal_path)
+
+    def _write_journal(self, plan):
+        """ writes the plan to the journal making sure it is on disk """
+        with open(self.journal_path, 'w') as f:
+            f.write(json.dumps(plan) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        fsync_folders([self.journal_path.parent])
+
+    def _log_progress(self, record):
+        """ appends record (dict) to the journal making sure it is on disk. It is called once per
+            phase, never once per file """
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _write_temporary(path, text):
+        """ writes text to a new temporary file in the folder of path and returns its name """
+        fd, temporary = tempfile.mkstemp(dir=path.parent, prefix='.%s.' % path.name, suffix='.rst_rename')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            shutil.copymode(path, temporary)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return temporary
+
+
+def plan_moves(moves):
+    """ returns the moves (src, dst) as they are journaled: a list of [src, dst, [st_dev, st_ino]]
+        with the inode of what each move moves, following it along the chains of moves """
+    inodes = dict()     # { path: inode it will have once the previous moves are done }
+    planned = list()
+    for src, dst in moves:
+        inode = inodes.pop(src, None)
+        if inode is None:
+            stat = os.lstat(src)
+            inode = [stat.st_dev, stat.st_ino]
+        inodes[dst] = inode
+        planned.append([str(src), str(dst), inode])
+    return planned
+
+def moves_done(planned):
+    """ given the journaled moves (see plan_moves()), it returns how many of them took place.
+        A move is done when its source doesn't hold its inode anymore, and since they are done in
+        order, the first one whose source still holds its inode is the first one not done """
+    for nr, (src, _, inode) in enumerate(planned):
+        try:
+            stat = os.lstat(src)
+        except FileNotFoundError:
+            continue
+        if [stat.st_dev, stat.st_ino] == inode:
+            return nr
+    return len(planned)
+
+def missing_folders(folders):
+    """ returns the sorted list of the folders, and their ancestors, that don't exist (parents first) """
+    missing = set()
+    for folder in folders:
+        while not folder.exists() and folder not in missing:
+            missing.add(folder)
+            folder = folder.parent
+    return sorted(missing, key=lambda folder: len(folder.parts))
+
+def link_or_copy(src, dst):
+    """ makes dst a hard link to src or, when not possible, a copy of it """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def remove_if_exists(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def fsync_path(path):
+    """ makes sure the contents of the file in path are on disk """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def fsync_folders(folders):
+    """ makes sure the entries of the folders are on disk (when the platform allows it) """
+    for folder in folders:
+        try:
+            fsync_path(folder)
+        except OSError:
+            pass    # e.g. platforms that can't open folders
+
+
+####################################################################################################
+# Patch output
+####################################################################################################
+
+PATCH_CONTEXT = 3       # lines of context around the changes of each hunk, as git diff does
+
+def write_patch(planned, renames, base_folder, out):
+    """ writes on out (text stream) a unified diff that 'git apply' accepts with the planned changes
+        (pairs (file, (lines, expanded_changes)) as generated by iter_planned_renames()) and the
+        renames, instead of performing them. Paths are relative to the top level folder of the
+        git repository containing base_folder or to base_folder when it is not in a repository.
+        - each changed file gets a diff with its hunks, with the rename header when it is renamed too
+        - each renamed file without changes gets just the rename header (when a folder is renamed,
+          every file within it does)
+        Each file is written as soon as it is planned, so the contents of just one are kept at a time.
+        It returns the number of files in the patch """
+    repository = GitRepository.containing(base_folder)
+    root = repository.toplevel if repository is not None else base_folder
+    destinations = dict()       # { renamed file: its destination }
+    for src, dst in renames:
+        if src.is_dir():
+            destinations.update((path, dst / path.relative_to(src)) for path in files_within(src))
+        else:
+            destinations[src] = dst
+    files = 0
+    for path, (lines, expanded_changes) in planned:
+        out.write(patch_header(path.relative_to(root), destinations.pop(path, path).relative_to(root)))
+        out.writelines(patch_hunks(lines, expanded_changes))
+        out.flush()
+        files += 1
+    for src in sorted(destinations):
+        out.write(patch_header(src.relative_to(root), destinations[src].relative_to(root), contents=False))
+        files += 1
+    out.flush()
+    return files
+
+def files_within(folder):
+    """ generates the files within folder at any depth as git sees them: the symlinks to folders
+        are files and are not followed (git rejects the renames of the files seen through them) """
+    for parent, folders, files in os.walk(folder):
+        links = [name for name in folders if os.path.islink(os.path.join(parent, name))]
+        for name in sorted(files + links):
+            if not rstutils.is_state_file(name):
+                yield Path(parent, name)
+        folders[:] = sorted(set(folders) - set(links))
+
+def patch_header(src, dst, contents=True):
+    """ returns the header of the diff of the file src (relative path) that is renamed as dst (the
+        same path when it is not renamed). When contents, it includes the --- and +++ lines that
+        must precede the hunks """
+    old, new = quote_patch_path('a/' + src.as_posix()), quote_patch_path('b/' + dst.as_posix())
+    header = ["diff --git %s %s\n" % (old, new)]
+    if src != dst:
+        if not contents:
+            header.append("similarity index 100%\n")
+        header.append("rename from %s\n" % quote_patch_path(src.as_posix()))
+        header.append("rename to %s\n" % quote_patch_path(dst.as_posix()))
+    if contents:
+        header.append("--- %s\n+++ %s\n" % (old, new))
+    return "".join(header)
+
+def patch_hunks(lines, expanded_changes, context=PATCH_CONTEXT):
+    """ given the lines of a file and its changes (list of Change sorted by line), it generates
+        the lines of the hunks of its unified diff. Changes closer than twice context lines
+        share the same hunk """
+    nr = 0
+    while nr < len(expanded_changes):
+        last = nr
+        while (last + 1 < len(expanded_changes) and
+               expanded_changes[last + 1].linenr - expanded_changes[last].linenr <= 2 * context + 1):
+            last += 1
+        start = max(0, expanded_changes[nr].linenr - context)
+        end = min(len(lines), expanded_changes[last].linenr + context + 1)
+        yield "@@ -%d,%d +%d,%d @@\n" % (start + 1, end - start, start + 1, end - start)
+        changed = {change.linenr: change for change in expanded_changes[nr:last + 1]}
+        for linenr in range(start, end):
+            change = changed.get(linenr)
+            if change is None:
+                yield patch_line(' ', lines[linenr])
+            else:
+                yield patch_line('-', change.src)
+                yield patch_line('+', change.dst)
+        nr = last + 1
+
+def patch_line(prefix, line):
+    """ returns line in a hunk prefixed by prefix, marking it when it has no line ending """
+    if line.endswith('\n'):
+        return prefix + line
+    return prefix + line + "\n\\ No newline at end of file\n"
+
+def quote_patch_path(path):
+    """ returns path quoted as git does in patches when it contains special characters """
+    if '"' not in path and '\\' not in path and path.isprintable():
+        return path
+    escaped = path.replace('\\', '\\\\').replace('"', '\\"').replace('\t', '\\t').replace('\n', '\\n')
+    return '"%s"' % escaped
+
+
+####################################################################################################
+# Renaming sources
+####################################################################################################
+
+def order_moves(renames):
+    """ given a list of pairs (src, dst), it returns the list of moves (src, dst) to be performed
+        in order so that no move overwrites a src that has not been moved yet.
+        Cycles are broken by moving one of their files to a temporary name first """
+    pending = dict(renames)     # { src: dst }
+    moves = list()
+    while pending:
+        ready = [src for src, dst in pending.items() if dst not in pending]
+        if not ready:           # the remaining ones are cycles
+            src = next(iter(pending))
+            temporary = temporary_name(src, pending)
+            moves.append((src, temporary))
+            pending[temporary] = pending.pop(src)
+            continue
+        for src in ready:
+            moves.append((src, pending.pop(src)))
+    return moves
+
+def temporary_name(path, taken):
+    """ returns a path in the folder of path that doesn't exist and it is not in taken """
+    nr = 0
+    while True:
+        candidate = path.with_name('.%s.rst_rename%d' % (path.name, nr))
+        if candidate not in taken and not candidate.exists():
+            return candidate
+        nr += 1
 
 
 ####################################################################################################
@@ -130,9 +643,12 @@ def rename_src(src, dst):
 def parse_commandline_args():
     """ defines the arguments and returns a dict containing the options with
         the following normalization:
-        * 'force': will always appear with the corresponding value
-        * 'src', 'dst' and 'base_folder': are converted to Path
-        * 'base_folder' is set to src parent if not explicitly set by user
+        * 'force', 'cache', 'trigrams', 'jobs', 'profile' and 'format': will always appear with the
+          corresponding value
+        * 'renames': list of pairs (src, dst) of Path from src and dst arguments (expanding
+          their wildcards) and from the --map file
+        * 'base_folder': is converted to Path
+        * 'base_folder' is set to the deepest common folder of the sources if not explicitly set by user
     """
     parser = argparse.ArgumentParser(
         description="Script that helps you to rename files and their references in rst folders")
@@ -140,8 +656,48 @@ def parse_commandline_args():
                         action="store_true",
                         help="execute changes without asking",
                         required=False)
-    parser.add_argument("src", help="source file name (must exist)")
-    parser.add_argument("dst", help="destination file name (must not exist)")
+    parser.add_argument("-c", "--cache",
+                        action="store_true",
+                        help=("keep the references of the rst files in %s at the base directory "
+                              "so next runs only parse the modified files" % rstutils.CACHE_FILENAME),
+                        required=False)
+    parser.add_argument("-t", "--trigrams",
+                        action="store_true",
+                        help=("keep a trigram index of the rst files in %s at the base directory "
+                              "so only the files that may reference the sources are read" % rstutils.TRIGRAMS_FILENAME),
+                        required=False)
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        help="number of processes to parse the rst files (default 1)",
+                        required=False)
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="print to stderr a report of the work done on each phase of the scan",
+                        required=False)
+    parser.add_argument("--format",
+                        choices=rstutils.OUTPUT_FORMATS,
+                        default='text',
+                        help=("output format: text, or ndjson to write a JSON object per change and rename "
+                              "and a final summary. With ndjson, changes are only performed with --force "
+                              "(default text)"),
+                        required=False)
+    parser.add_argument("--emit-patch",
+                        metavar="PATCH",
+                        help=("write the changes and renames to the file PATCH ('-' for stdout) as a "
+                              "patch for git apply instead of performing them"),
+                        dest='emit_patch',
+                        required=False)
+    parser.add_argument("-m", "--map",
+                        help=("file with one rename per line: source and destination separated by a tab. "
+                              "Empty lines and lines starting with # are ignored"),
+                        dest='map',
+                        required=False)
+    parser.add_argument("src", nargs='?',
+                        help=("source file or folder name (must exist). "
+                              "It can contain wildcards * and ? (quote them) to rename many files at once"))
+    parser.add_argument("dst", nargs='?',
+                        help=("destination file name (must not exist). "
+                              "When src contains wildcards, dst must contain the same ones in the same order"))
     parser.add_argument("-b", "--base-dir",
                         required=False,
                         help="Base directory for the rst project",
@@ -150,60 +706,146 @@ def parse_commandline_args():
                         )
 
     args = parser.parse_args()
+    if (args.src is None) != (args.dst is None) or (args.src is None and args.map is None):
+        parser.error("both src and dst, or a --map file, are required")
     normalized_args = { k:v for k,v in vars(args).items() if v }
     normalized_args.setdefault('force', False)
-    for tag in ('src', 'dst'):
-        normalized_args[tag] = Path(normalized_args[tag]).resolve()
+    normalized_args.setdefault('cache', False)
+    normalized_args.setdefault('trigrams', False)
+    normalized_args.setdefault('jobs', 1)
+    normalized_args.setdefault('profile', False)
+    renames = list()
+    if args.src is not None:
+        try:
+            renames.extend(expand_wildcards(args.src, args.dst))
+        except ValueError as e:
+            parser.error(str(e))
+    if args.map is not None:
+        renames.extend(read_map(Path(args.map), message_stream(normalized_args)))
+    normalized_args['renames'] = [(Path(src).resolve(), Path(dst).resolve()) for src, dst in renames]
     normalized_args['base_folder'] = (Path(normalized_args['base_folder']).resolve()
                                       if 'base_folder' in normalized_args
-                                      else normalized_args['src'].parent)
+                                      else rstutils.deepest_common_path((src.parent, True) for src, _ in
+                                                                          normalized_args['renames']))
 
     return normalized_args
 
-def check_options(options):
-    """ checks the existence of source and destination files.
-        In case source doesn't exist, or destination does exist
-        it breaks execution
+def expand_wildcards(src, dst):
+    """ given a src and dst patterns, it returns the list of pairs (src, dst) of str where
+        - src are the existing files matching the src pattern
+        - dst are composed replacing the wildcards of the dst pattern by the text matched by
+          the corresponding wildcards in src
+        Wildcards * and ? match within a path component. When src has no wildcards, it
+        returns [(src, dst)]
     """
-    if not options['src'].is_file():
-        print("ERROR: source file must exist")
-        sys.exit(1)
-    if options['dst'].is_file():
-        print("ERROR: destination file must not exist")
+    wildcards = re.compile(r'[*?]')
+    src_wildcards = wildcards.findall(src)
+    if not src_wildcards:
+        return [(src, dst)]
+    if src_wildcards != wildcards.findall(dst):
+        raise ValueError("dst must contain the same wildcards than src in the same order")
+    regex = re.compile(''.join('([^/]*)' if part == '*' else '([^/])' if part == '?' else re.escape(part)
+                               for part in re.split(r'([*?])', src)) + '$')
+    dst_parts = re.split(r'[*?]', dst)
+    renames = list()
+    for path in sorted(glob.glob(src)):
+        match = regex.match(path)
+        if not match:
+            continue    # e.g. matched by glob through a hidden file rule
+        renames.append((path, dst_parts[0] + ''.join(group + part for group, part in zip(match.groups(),
+                                                                                         dst_parts[1:]))))
+    return renames
+
+def read_map(path, out=None):
+    """ given the path of a map file, it returns the list of pairs (src, dst) of str it contains
+        Each line of the map must contain the src and the dst separated by a tab.
+        Empty lines and lines starting by # are ignored
+        When a line is not valid, it breaks execution with an error on out (stdout by default) """
+    renames = list()
+    with open(path) as f:
+        for nr, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 2:
+                print("ERROR: line %d of %s must contain source and destination separated by a tab" % (nr, path),
+                      file=out or sys.stdout)
+                sys.exit(1)
+            renames.append((fields[0], fields[1]))
+    return renames
+
+def check_options(options, snapshot=None):
+    """ checks the existence of source and destination files or folders (looking them up in
+        snapshot when provided, so each folder is listed just once whatever the number of renames)
+        In case any source doesn't exist, or any destination does exist (and it is not renamed too)
+        or a source is within a renamed folder, it breaks execution
+        The errors are written to message_stream(options)
+    """
+    if snapshot is None:
+        snapshot = rstutils.FsSnapshot()
+    out = message_stream(options)
+    renames = options['renames']
+    if not renames:
+        print("ERROR: no files to rename", file=out)
         sys.exit(1)
-    resulting_folders = list()
-    if (options['base_folder'] not in options['src'].parents or
-        options['base_folder'] not in options['dst'].parents):
-        print("ERROR: base folder must contain both source and destination")
+    sources = set(src for src, _ in renames)
+    destinations = set(dst for _, dst in renames)
+    if len(sources) != len(renames) or len(destinations) != len(renames):
+        print("ERROR: each file can be renamed just once and to a different destination", file=out)
         sys.exit(1)
+    for src, dst in renames:
+        if not snapshot.is_file(src) and not snapshot.is_dir(src):
+            print("ERROR: source file must exist (%s)" % src, file=out)
+            sys.exit(1)
+        if any(folder in sources for folder in src.parents) or src in dst.parents:
+            print("ERROR: a folder can't be renamed together with its contents nor within itself (%s)" % src,
+                  file=out)
+            sys.exit(1)
+        if snapshot.exists(dst) and dst not in sources:
+            print("ERROR: destination file must not exist (%s)" % dst, file=out)
+            sys.exit(1)
+        if (options['base_folder'] not in src.parents or
+            options['base_folder'] not in dst.parents):
+            print("ERROR: base folder must contain both source and destination (%s, %s)" % (src, dst), file=out)
+            sys.exit(1)
 
 
 ####################################################################################################
 # renaming suport
 ####################################################################################################
 
-def create_representation(linesrc, linedst, src, dst):
-    """ given the source and the renamed line, and the source and destination names of the file,
-        it composes and returns a new line highlighting the changes """
-
-    src, dst = clean_commonalities(src, dst)
-    linesrclist = list(linesrc)
-    linedstlist = list(linedst)
-    linereprlist = list()
-    srcpos = 0
-    dstpos = 0
-    while srcpos < len(linesrc):
-        if linesrclist[srcpos] == linedstlist[dstpos]:
-            linereprlist.append(linesrclist[srcpos])
-            srcpos += 1
-            dstpos += 1
-            continue
-        linereprlist.append(_HIGHLIGHT_ESCAPE)
-        linereprlist.append(dst)
-        linereprlist.append(_STANDARD_SCAPE)
-        srcpos += len(src)
-        dstpos += len(dst)
-    return "".join(linereprlist)
+class Change:
+    """ A change on a line of a rst file (see expand_edits_on_contents()):
+        - linenr: the line number of the change
+        - src: the original contents of the line (the line of the contents itself, not a copy)
+        - edits: the sorted tuple of replacements (pos, src, dst) on the line
+        The line once replaced (dst) and the representation highlighting the changes (repr) are
+        composed from the offsets of the edits each time they are asked, so nothing else is kept
+        for the changes that are never shown
+    """
+    __slots__ = ('linenr', 'src', 'edits')
+
+    def __init__(self, linenr, src, edits):
+        self.linenr = linenr
+        self.src = src
+        self.edits = edits
+
+    @property
+    def dst(self):
+        """ the contents of the line once the replacements on it have took place """
+        line = self.src
+        for pos, src, dst in reversed(self.edits):  # from right to left so pos remain valid
+            line = replace_edit(line, pos, src, dst)
+        return line
+
+    @property
+    def repr(self):
+        """ the representation of the changes with scape characters to highlight them """
+        return represent_edits(self.src, self.edits)
+
+    def __repr__(self):
+        return "Change(%d, %r, %r)" % (self.linenr, self.src, self.edits)
 
 
 def expand_changes_on_contents(rstcontents, changes, src, dst):
@@ -213,40 +855,54 @@ def expand_changes_on_contents(rstcontents, changes, src, dst):
         - changes: a list of pairs (line, char) representing the points where a replacement must take place
         - src: a Path relative to the base_folder with the reference to the file to replace
         - dst: a Path relative to the base_folder with the reference to the destination file
-        it expads composes a list of expanded changes consisting on a dict with the following keys:
-        - linenr; the line number of the change
-        - src: the original contents of the line
-        - dst: the contents of the line once the replacements on it have took place
-        - repr: the representation of the changes with scape characters to highlight the changes
+        it expads composes a list of expanded changes consisting on a Change for each changed line
     """
-    def replace_change(line, pos, src, dst):
-        """ given the contents of a line, replaces the occurrence in position pos of src by dst.
-            In case src's extension is .rst and it appears without extension at line, the replacement is without
-            extension too """
-        if src.endswith('.rst'):    # it can appear without extension
-            src = src[:-4]
-            dst = dst[:-4]
-        return line[:pos] + dst + line[pos + len(src):]
-
-
-    expanded_changes = list()
-    changed_lines = dict()
-    for linenr, pos in changes:
-        if linenr in changed_lines:
-            expanded_change = changed_lines[linenr]
-            expanded_change['dst'] = replace_change(expanded_change['dst'], pos, src, dst)
-        else:
-            expanded_change = dict()
-            expanded_change['linenr'] = linenr
-            expanded_change['src'] = rstcontents[linenr]
-            expanded_change['dst'] = replace_change(expanded_change['src'], pos, src, dst)
-            changed_lines[linenr] = expanded_change
+    return expand_edits_on_contents(rstcontents, [(linenr, pos, src, dst) for linenr, pos in changes])
+
+
+def expand_edits_on_contents(rstcontents, edits):
+    """ Same as expand_changes_on_contents() but each edit is a tuple (line, char, src, dst) so
+        the replacements of different renames can be combined, even on the same line """
+    edits_by_line = dict()
+    for linenr, pos, src, dst in edits:
+        edits_by_line.setdefault(linenr, set()).add((pos, src, dst))
+
+    return [Change(linenr, rstcontents[linenr], tuple(sorted(edits_by_line[linenr])))
+            for linenr in sorted(edits_by_line)]
+
+
+def replace_edit(line, pos, src, dst):
+    """ given the contents of a line, replaces the occurrence in position pos of src by dst.
+        In case src's extension is .rst and it appears without extension at line, the replacement is without
+        extension too """
+    src, dst = remove_rst_extension(src, dst)
+    return line[:pos] + dst + line[pos + len(src):]
+
+
+def represent_edits(line, edits):
+    """ given the source line and its edits as sorted tuples (char, src, dst), it composes and returns
+        the renamed line highlighting the changes """
+    pieces = list()
+    last_pos = 0
+    for pos, src, dst in edits:
+        src, dst = remove_rst_extension(src, dst)
+        src_difference, dst_difference = clean_commonalities(src, dst)
+        if not src_difference and not dst_difference:
+            continue
+        pos_difference = pos + common_prefix_length(src, dst)
+        pieces.append(line[last_pos:pos_difference])
+        pieces.extend((_HIGHLIGHT_ESCAPE, dst_difference, _STANDARD_SCAPE))
+        last_pos = pos_difference + len(src_difference)
+    pieces.append(line[last_pos:])
+    return "".join(pieces)
 
-    for expanded_change in changed_lines.values():
-        expanded_change['repr'] = create_representation(expanded_change['src'], expanded_change['dst'], src, dst)
-        expanded_changes.append(expanded_change)
 
-    return expanded_changes
+def remove_rst_extension(src, dst):
+    """ rst files can be referenced without extension so, in case src is a rst file, it returns
+        src and dst without extension. Otherwise it returns them as they are """
+    if src.endswith('.rst'):
+        return src[:-4], dst[:-4]
+    return src, dst
 
 ####################################################################################################
 # Other helping functions
@@ -287,6 +943,20 @@ def clean_commonalities(text1, text2):
     return text1[pos_ini:pos_fin1], text2[pos_ini:pos_fin2]
 
 
+def common_prefix_length(text1, text2):
+    """ returns the length of the longest common prefix of both strings, as removed by clean_commonalities()
+
+        >>> common_prefix_length('commonpreffix1', 'commonpreffix2')
+        13
+        >>> common_prefix_length('equal', 'different')
+        0
+    """
+    pos = 0
+    while pos < min(len(text1), len(text2)) and text1[pos] == text2[pos]:
+        pos += 1
+    return pos
+
+
 def ask_for_confirmation(force):
     """ it asks for confirmation of the changes from stdin and returns the answer
         if force, it returns directly True without asking """
@@ -295,52 +965,130 @@ def ask_for_confirmation(force):
     response = input("Type exactly %syes%s if you want to perform these changes. Anything otherwise: " % (_HIGHLIGHT_ESCAPE, _STANDARD_SCAPE))
     return response == 'yes'
 
-def run_easy(cmd, folder=None, timeout=None):
-    """ runs a command and returns the standard output and the standard error.
-        In case a folder is specified, the command is executed in the defined
-        folder and, once done, it returns to the original folder
+####################################################################################################
+# git support
+####################################################################################################
+
+class GitRepository:
+    """ Git repository containing the renamed files.
+
+        git is always run with a list of arguments (no shell) from the top level folder of the
+        repository. The index is read once with a single 'git ls-files' and any number of moves
+        are registered in the index with a single 'git update-index', the same way 'git mv'
+        would do it: the entry of the source is moved to the destination and the changes on the
+        contents of the files are not staged.
     """
-    prev_cwd = Path.cwd()
-    folder = folder if folder else prev_cwd
-    os.chdir(folder)
-    cmd = f'timeout {timeout} {cmd}' if timeout else cmd
-    cmd = 'env LANG=C.UTF-8 ' + cmd   # run it in english to unify output messages
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    stdout, stderr = process.communicate()
-    os.chdir(prev_cwd)
-    err = ""
-    try:
-        out = stdout.decode('utf8')
-        err = stderr.decode('utf8')
-    except UnicodeDecodeError as e:
-        print("run_easy(cmd:%s): it wasn't possible to decode as UTF8 on command output"%cmd)
-        out = stdout.decode("utf8", "replace")
-        err = stderr.decode("utf8", "replace")
-    finally:
-        if process.returncode != 0:
-            if process.returncode == 124:
-                err += 'Process stopped by timeout'
+
+    def __init__(self, toplevel):
+        self.toplevel = toplevel
+        self._entries = None    # { path relative to toplevel: (mode, object) } of the index
+
+    @classmethod
+    def containing(cls, folder):
+        """ returns the repository containing folder or None when it is not in a git repository """
+        try:
+            toplevel = run_git(['rev-parse', '--show-toplevel'], folder)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return cls(Path(os.fsdecode(toplevel.rstrip(b'\n'))))
+
+    def is_tracked(self, path):
+        """ returns True when path, or any file within path when it is a folder, is in the index """
+        relative = self._relative(path)
+        entries = self._index_entries()
+        return relative in entries or any(self._entries_within(relative))
+
+    def affected_entries(self, moves):
+        """ given a list of pairs (src, dst), it returns the dict { path relative to top level:
+            [mode, object] or None when it is not in the index } of every entry that
+            move_index_entries() would change, as str so it can be journaled """
+        entries = dict(self._index_entries())
+        affected = dict()
+        for old, new, _ in self._moved_entries(moves, entries):
+            for path in (old, new):
+                if path not in affected:
+                    entry = self._index_entries().get(path)
+                    affected[path] = [entry[0].decode(), entry[1].decode()] if entry else None
+        return affected
+
+    def restore_index_entries(self, affected):
+        """ writes back to the index the entries returned by affected_entries(), removing the
+            ones that were not in the index """
+        records = list()
+        null = b'0' * max([len(entry[1]) for entry in affected.values() if entry] or [40])
+        for path, entry in affected.items():
+            if entry is None:
+                records.append(b'0 %s\t%s\0' % (null, os.fsencode(path)))     # mode 0 removes it
             else:
-                err += f'\nProcess finished with return code {process.returncode}'
-        process.stdout.close()
-        process.stderr.close()
-    return out, err
-
-
-def is_file_in_git(path):
-    """ returns True when path has a commit in a git repository """
-    cmd = f'git log {path}'
-    out_msg, err_msg = run_easy(cmd, path)
-    return 'fatal:' not in err_msg and out_msg
-
-def git_mv(src, dst):
-    """ renames src to dst """
-    folder = src.parent
-    cmd = f'git mv "{src}" "{dst}"'
-    out_msg, err_msg = run_easy(cmd, folder)
-    print(cmd)
-    if out_msg: print("\t", out_msg)
-    if err_msg: print("\t ", err_msg)
+                records.append(b'%s %s\t%s\0' % (entry[0].encode(), entry[1].encode(), os.fsencode(path)))
+        if records:
+            run_git(['update-index', '-z', '--index-info'], self.toplevel, b''.join(records))
+        self._entries = None    # read again when needed
+
+    def move_index_entries(self, moves):
+        """ given a list of pairs (src, dst), it moves the index entries of the tracked sources to
+            their destinations. When src is a folder, the entries within it are moved too.
+            Untracked sources are ignored. The known entries are updated only once the index is """
+        entries = dict(self._index_entries())
+        records = list()
+        for old, new, (mode, obj) in self._moved_entries(moves, entries):
+            records.append(b'0 %s\t%s\0' % (obj, os.fsencode(old)))
+            records.append(b'%s %s\t%s\0' % (mode, obj, os.fsencode(new)))
+        if records:
+            run_git(['update-index', '-z', '--index-info'], self.toplevel, b''.join(records))
+        self._entries = entries
+
+    def _moved_entries(self, moves, entries):
+        """ generates the triplets (old path, new path, (mode, object)) of the entries moved by each
+            pair (src, dst) of moves in order, updating entries (dict as the index) accordingly """
+        for src, dst in moves:
+            src, dst = self._relative(src), self._relative(dst)
+            if src is None or dst is None:
+                continue
+            pairs = [(src, dst)] if src in entries else [(path, dst + path[len(src):])
+                                                         for path in list(self._entries_within(src, entries))]
+            for old, new in pairs:
+                entry = entries.pop(old)
+                entries[new] = entry
+                yield old, new, entry
+
+    def _index_entries(self):
+        """ returns the entries of the index, reading it the first time """
+        if self._entries is None:
+            self._entries = dict()
+            for record in run_git(['ls-files', '--stage', '-z'], self.toplevel).split(b'\0'):
+                if not record:
+                    continue
+                info, path = record.split(b'\t', 1)
+                mode, obj, stage = info.split(b' ')
+                if stage == b'0':
+                    self._entries[os.fsdecode(path)] = (mode, obj)
+        return self._entries
+
+    def _entries_within(self, folder, entries=None):
+        """ generates the paths of the index entries (or of entries when provided) within folder
+            (relative to top level) """
+        if folder is None:
+            return
+        prefix = folder + '/' if folder != '.' else ''
+        for path in (self._index_entries() if entries is None else entries):
+            if path.startswith(prefix):
+                yield path
+
+    def _relative(self, path):
+        """ returns the path relative to the top level folder as in the index or None when outside """
+        try:
+            return Path(path).relative_to(self.toplevel).as_posix()
+        except ValueError:
+            return None
+
+
+def run_git(args, folder, stdin=None):
+    """ runs git with args from folder, without shell, and returns its standard output (bytes)
+        It raises subprocess.CalledProcessError when git fails """
+    process = subprocess.run(['git'] + args, cwd=folder, input=stdin,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return process.stdout
 
 ####################################################################################################
 
@@ -0,0 +1,473 @@
+#! /usr/bin/env python3
+
+"""
+    This script keeps the references of a base rst folder in memory and answers questions about them
+
+    The reference graph is built once and then kept up to date by watching the base folder: only the
+    rst files that change are parsed again. Changes are notified by inotify where available (Linux)
+    and detected by polling otherwise.
+
+    Questions are answered through a Unix socket (.rstutils.sock in the base folder). Each request
+    is a line with a JSON object and it is answered by a line with a JSON object whose 'ok' tells
+    whether the request succeeded. The available requests are:
+
+    - {"op": "ping"}
+    - {"op": "references", "target": path}: answers "references" as { rstpath: [[line, pos], ...] }
+    - {"op": "unreferenced", "paths": [path, ...]}: answers "unreferenced" with the paths (or files
+      within the folders) not referenced by any rst file
+    - {"op": "plan_rename", "renames": [[src, dst], ...]}: answers "edits" as
+      { rstpath: [[linenr, pos, src, dst], ...] } (see rstutils.ReferenceGraph.rename_edits())
+
+    All the paths are absolute. rst_rename.py and rst_ls_unref.py use the daemon automatically when
+    it is serving their base folder.
+
+    Before answering a question, the daemon applies the changes already notified and not applied
+    yet, so the answer considers every change done before the question was asked. When it can't,
+    the question is not answered and the scripts scan the rst files by themselves.
+"""
+import os
+import sys
+import json
+import time
+import ctypes
+import ctypes.util
+import contextlib
+import select
+import signal
+import struct
+import argparse
+import threading
+import socketserver
+from pathlib import Path
+
+import rstutils
+
+
+DEFAULT_POLL_INTERVAL = 1.0     # seconds between polls when inotify is not available
+
+####################################################################################################
+
+def main():
+    options = parse_commandline_args()
+    check_options(options)
+    watcher = create_watcher(options['base_folder'], options['poll'])  # before building, so no change is missed
+    cache = rstutils.ReferenceCache.in_folder(options['base_folder']) if options['cache'] else None
+    try:
+        index = ReferenceIndex(options['base_folder'], cache, options['jobs'], watcher)
+    finally:
+        if cache:
+            cache.close()
+    serve(index)
+
+def serve(index):
+    """ answers the requests on the socket of index.base_folder while its watcher keeps it up to date.
+        It stops on Ctrl+C or SIGTERM (e.g. stopped by systemd), removing the socket """
+    socket_path = index.base_folder / rstutils.SOCKET_NAME
+    if socket_path.exists():
+        if rstutils.query_daemon(index.base_folder, {'op': 'ping'}) is not None:
+            print("ERROR: there is already a daemon serving %s" % index.base_folder)
+            sys.exit(1)
+        socket_path.unlink()    # left by a daemon that didn't stop cleanly
+    signal.signal(signal.SIGTERM, interrupt)
+    threading.Thread(target=index.watch, daemon=True).start()
+    server = ReferenceServer(socket_path, index)
+    try:
+        print("Serving the references of %s at %s" % (index.base_folder, socket_path), flush=True)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()   # it removes the socket
+        index.watcher.close()
+
+def interrupt(signum, frame):
+    """ handles SIGTERM as Ctrl+C, so the daemon stops cleanly """
+    raise KeyboardInterrupt
+
+
+####################################################################################################
+#   Reference index
+####################################################################################################
+
+class ReferenceIndex:
+    """ rstutils.ReferenceGraph of a base folder that can be updated and queried from many threads
+
+        The changes notified by watcher (InotifyWatcher or PollingWatcher) are applied by watch()
+        and, before answering any question, by catch_up(). Both take the changes from the watcher
+        and apply them while holding the same lock, so no change taken by one of them can be
+        pending when the other one is done.
+    """
+
+    def __init__(self, base_folder, cache=None, jobs=None, watcher=None):
+        self.base_folder = base_folder
+        self.watcher = watcher
+        self.graph = rstutils.ReferenceGraph.build(base_folder, cache=cache, jobs=jobs)
+        self._lock = threading.Lock()       # guards graph
+        self._catching_up = threading.Lock()    # held from taking changes from watcher until applied
+
+    def watch(self):
+        """ applies the changes notified by the watcher as they come, until it is closed """
+        try:
+            while True:
+                self.watcher.wait()
+                self.catch_up()
+        except (OSError, ValueError):
+            pass    # the watcher has been closed
+
+    def catch_up(self):
+        """ applies the changes notified by the watcher that are not applied yet """
+        with self._catching_up:
+            changed = self.watcher.poll(timeout=0)
+            if changed:
+                self.update(changed)
+
+    def update(self, paths):
+        """ parses again the rst files in paths. A path can also be:
+            - a folder: all the rst files within it are parsed again
+            - a path that doesn't exist anymore: the documents in it (or within it) are removed """
+        parsed = dict()     # { rstpath: references or None when removed }
+        if any(path.is_dir() or not path.exists() for path in paths):   # a folder may have changed
+            rstutils.clear_path_caches()
+        for path in paths:
+            if is_pruned(path, self.base_folder):
+                continue
+            if path.is_dir():
+                for rstpath in rstutils.get_rst_in_folder(path):
+                    parsed[rstpath] = read_references(rstpath)
+                parsed.update(dict.fromkeys(self._documents_under(path, parsed), None))
+            elif path.suffix == '.rst' and path.is_file():
+                parsed[path] = read_references(path)
+            else:
+                parsed.update(dict.fromkeys(self._documents_under(path, parsed), None))
+        with self._lock:
+            for rstpath, references in parsed.items():
+                if references is None:
+                    self.graph.remove_document(rstpath)
+                else:
+                    self.graph.update_document(rstpath, references)
+
+    def _documents_under(self, path, excluded):
+        """ returns the documents of the graph that are path or within path and not in excluded """
+        with self._lock:
+            return [document for document in self.graph.documents()
+                    if document not in excluded and (document == path or path in document.parents)]
+
+    def answer(self, request):
+        """ returns the response (dict) to request (dict) as described in the module docstring """
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True}
+        if self.watcher is None:
+            return {'ok': False, 'error': "changes are not watched so the answer could be outdated"}
+        self.catch_up()
+        if op == 'references':
+            with self._lock:
+                references = self.graph.references_to(Path(request['target']))
+            return {'ok': True, 'references': {str(rst): pairs for rst, pairs in references.items()}}
+        if op == 'unreferenced':
+            checked_files = list()
+            for path in map(Path, request['paths']):
+                checked_files.extend(rstutils.walk_files(path) if path.is_dir() else [path])
+            with self._lock:
+                unreferenced = [str(path) for path in checked_files if not self.graph.is_referenced(path)]
+            return {'ok': True, 'unreferenced': unreferenced}
+        if op == 'plan_rename':
+            renames = [(Path(src), Path(dst)) for src, dst in request['renames']]
+            with self._lock:
+                edits = self.graph.rename_edits(renames)
+            return {'ok': True, 'edits': {str(rst): edits_in_file for rst, edits_in_file in edits.items()}}
+        return {'ok': False, 'error': "unknown op %r" % op}
+
+
+def read_references(rstpath):
+    """ returns the references in rstpath or an empty list when it can't be read (e.g. removed) """
+    try:
+        return rstutils.read_references(rstpath)
+    except (OSError, UnicodeDecodeError):
+        return list()
+
+def is_pruned(path, base_folder):
+    """ returns True when path is within a folder that is not explored (see rstutils.PRUNED_FOLDERS) """
+    try:
+        parts = path.relative_to(base_folder).parts
+    except ValueError:
+        return True
+    return any(part in rstutils.PRUNED_FOLDERS for part in parts)
+
+
+####################################################################################################
+#   Socket server
+####################################################################################################
+
+class ReferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Unix socket server answering the requests with a ReferenceIndex """
+    daemon_threads = True
+
+    def __init__(self, socket_path, index):
+        self.socket_path = socket_path
+        self.index = index
+        super().__init__(str(socket_path), RequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ answers each line (JSON request) with a line (JSON response) until the client disconnects """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.index.answer(json.loads(line))
+            except Exception as error:      # any failure is reported to the client
+                response = {'ok': False, 'error': str(error)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+####################################################################################################
+#   Watching changes
+####################################################################################################
+
+def create_watcher(base_folder, interval=None):
+    """ returns an InotifyWatcher of base_folder when available or a PollingWatcher otherwise.
+        When interval (seconds) is provided, the PollingWatcher is used anyway """
+    if interval is None:
+        try:
+            return InotifyWatcher(base_folder)
+        except (OSError, AttributeError):   # not Linux or no more inotify instances available
+            interval = DEFAULT_POLL_INTERVAL
+    return PollingWatcher(base_folder, interval)
+
+
+class PollingWatcher:
+    """ Detects the changes in the rst files of a base folder by comparing their mtime and size """
+
+    def __init__(self, base_folder, interval=DEFAULT_POLL_INTERVAL):
+        self.base_folder = base_folder
+        self.interval = interval
+        self._closed = False
+        self._snapshot = self._take_snapshot()
+
+    def wait(self):
+        """ waits until it is time to poll again. It raises ValueError once closed """
+        time.sleep(self.interval)
+        if self._closed:
+            raise ValueError("the watcher is closed")
+
+    def poll(self, timeout=None):
+        """ returns the set of rst files created, modified or removed since the last poll.
+            It doesn't wait for changes, so timeout is ignored """
+        snapshot = self._take_snapshot()
+        changed = set(path for path in snapshot.keys() | self._snapshot.keys()
+                      if snapshot.get(path) != self._snapshot.get(path))
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        self._closed = True
+
+    def _take_snapshot(self):
+        snapshot = dict()
+        for rstpath in rstutils.get_rst_in_folder(self.base_folder):
+            try:
+                stat = rstpath.stat()
+            except OSError:
+                continue
+            snapshot[rstpath] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+
+class InotifyWatcher:
+    """ Receives from inotify(7) the changes in the rst files and folders of a base folder """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct('iIII')   # struct inotify_event without the name that follows it
+
+    def __init__(self, base_folder, latency=0.05):
+        """ latency: seconds to wait for more events once an event arrives, so a burst of changes
+            (e.g. a checkout) is notified all at once """
+        self.base_folder = base_folder
+        self.latency = latency
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._folders = dict()      # { watch descriptor: folder }
+        for folder in rstutils.walk_folders(base_folder):
+            self._watch(folder)
+        self._wakeup, self._wakeup_writer = os.pipe()   # written by close() to stop waiting
+        self._closed = False
+        self._users = 0     # threads using the descriptors, which can't be closed meanwhile
+        self._condition = threading.Condition()
+
+    def wait(self):
+        """ waits until some change is notified. It raises ValueError once closed """
+        with self._using():
+            select.select([self._fd, self._wakeup], [], [])
+
+    def poll(self, timeout=None):
+        """ waits up to timeout seconds (forever when None) for changes and returns the set of
+            changed paths (possibly empty). They are rst files and folders created, moved or removed.
+            It raises ValueError once closed """
+        changed = set()
+        with self._using():
+            ready, _, _ = select.select([self._fd, self._wakeup], [], [], timeout)
+            while self._fd in ready and self._wakeup not in ready:
+                changed |= self._read_events()
+                ready, _, _ = select.select([self._fd, self._wakeup], [], [], self.latency)
+        return changed
+
+    def close(self):
+        """ wakes up the threads waiting for changes and closes the descriptors once they are done,
+            so a thread never reads from a descriptor reused by someone else """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            os.write(self._wakeup_writer, b'\0')
+            while self._users:
+                self._condition.wait()
+            for fd in (self._fd, self._wakeup, self._wakeup_writer):
+                os.close(fd)
+
+    @contextlib.contextmanager
+    def _using(self):
+        with self._condition:
+            if self._closed:
+                raise ValueError("the watcher is closed")
+            self._users += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._users -= 1
+                self._condition.notify_all()
+
+    def _watch(self, folder):
+        watch_descriptor = self._add_watch(self._fd, os.fsencode(folder), self.MASK)
+        if watch_descriptor >= 0:       # otherwise the folder was removed in the meanwhile
+            self._folders[watch_descriptor] = folder
+
+    def _unwatch(self, folder):
+        for watch_descriptor, watched in list(self._folders.items()):
+            if watched == folder or folder in watched.parents:
+                self._rm_watch(self._fd, watch_descriptor)
+                del self._folders[watch_descriptor]
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0'))
+            offset += self.EVENT.size + length
+            if mask & self.IN_Q_OVERFLOW:   # events were lost: everything must be checked again
+                changed.add(self.base_folder)
+                continue
+            folder = self._folders.get(watch_descriptor)
+            if folder is None or mask & self.IN_IGNORED:
+                continue
+            path = folder / name
+            if mask & self.IN_ISDIR:
+                if name in rstutils.PRUNED_FOLDERS:
+                    continue
+                if mask & (self.IN_MOVED_FROM | self.IN_DELETE):
+                    self._unwatch(path)
+                elif mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    for subfolder in rstutils.walk_folders(path):
+                        self._watch(subfolder)
+                changed.add(path)
+            elif name.endswith('.rst'):
+                changed.add(path)
+        return changed
+
+
+####################################################################################################
+#   Arguments
+####################################################################################################
+
+def parse_commandline_args():
+    """ defines the arguments and returns a dict containing the options with
+        the following normalization:
+        * 'base_folder' is converted to pathlib.Path (current folder when not given)
+        * 'poll', 'cache' and 'jobs' will always appear with the corresponding value
+    """
+    parser = argparse.ArgumentParser(
+        description=("Daemon that keeps the references of the rst files in --base-dir in memory "
+                     "and answers rst_rename.py and rst_ls_unref.py through a Unix socket.")
+    )
+    parser.add_argument("-b", "--base-dir",
+                        required=False,
+                        default='.',
+                        help="Base directory for the rst project (default the current directory)",
+                        dest='base_folder',
+                        type=str,
+                        )
+    parser.add_argument("-p", "--poll",
+                        type=float,
+                        default=None,
+                        metavar='SECONDS',
+                        help="look for changes every SECONDS instead of using inotify",
+                        required=False)
+    parser.add_argument("-c", "--cache",
+                        action="store_true",
+                        help=("use the references kept in %s at the base directory to start "
+                              "faster" % rstutils.CACHE_FILENAME),
+                        required=False)
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=1,
+                        help="number of processes to parse the rst files at start (default 1)",
+                        required=False)
+
+    args = parser.parse_args()
+    return {
+        'base_folder': Path(args.base_folder).resolve(),
+        'poll': args.poll,
+        'cache': args.cache,
+        'jobs': args.jobs,
+    }
+
+def check_options(options):
+    """ it breaks execution if:
+        - options['base_folder'] is not a folder
+        - Unix sockets are not available
+        - options['poll'] is not positive
+    """
+    if not options['base_folder'].is_dir():
+        print("ERROR: base folder must be a folder")
+        sys.exit(1)
+    if not hasattr(socketserver, 'UnixStreamServer'):
+        print("ERROR: Unix sockets are not available in this platform")
+        sys.exit(1)
+    if options['poll'] is not None and options['poll'] <= 0:
+        print("ERROR: poll interval must be positive")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,190 +2,1168 @@
     Utilities for the rst scripts
 """
 
+import array
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
 import pathlib
+import posixpath
 import re
+import socket
+import sqlite3
+import sys
+import threading
+import time
 
 
-def deepest_common_path(paths):
-    """ given a list of absolute pathlib.Path, it returns a pathlib.Path such
+def deepest_common_path(paths, is_dir=None):
+    """ given an iterable of absolute pathlib.Path, it returns a pathlib.Path such
         that it is the deepest common path for all of them.
-        - In case the list is empty, it returns the root path
-        - In case the list contains just one path, it returns the path itself
+        - In case there are no paths, it returns the root path
+        - In case there is just one path, it returns the path itself
           when it is a directory or its parent otherwise
+        is_dir is the function telling whether a path is a directory (pathlib.Path.is_dir by
+        default), e.g. FsSnapshot.is_dir to answer from an already taken snapshot. A path can also
+        be given already classified as a pair (path, is_dir) so it is not asked at all.
+
+        The components of each path are compared with the common prefix found so far in a single
+        pass, and the paths are consumed only until the common prefix is the root
     """
-    if not paths:
-        return pathlib.Path('/')
-    common_paths = set((paths[0] / '_').parents if paths[0].is_dir() else paths[0].parents)
-    for path in paths[1:]:
-        parents = set((path / '_').parents if path.is_dir() else path.parents)
-        common_paths = common_paths.intersection(parents)
-    return max(common_paths)
-
-def get_rst_in_folder(folder):
+    if is_dir is None:
+        is_dir = pathlib.Path.is_dir
+    common = None
+    for path in paths:
+        if isinstance(path, tuple):
+            path, folder = path
+        else:
+            folder = is_dir(path)
+        parts = path.parts if folder else path.parts[:-1]
+        if common is None:
+            common = parts
+        else:
+            length = min(len(common), len(parts))
+            nr = 0
+            while nr < length and common[nr] == parts[nr]:
+                nr += 1
+            common = common[:nr]
+        if len(common) <= 1:
+            break   # nothing deeper than the root is common
+    return pathlib.Path(*common) if common else pathlib.Path('/')
+
+PRUNED_FOLDERS = frozenset(('_build', '.git', '.hg', '.svn', '__pycache__', '.tox', '.venv'))
+
+STATE_FILES = set()     # names of the files these tools keep in the base folder, added where defined
+JOURNAL_FILENAME = '.rst_rename.journal'        # see rst_rename.Transaction
+STATE_FILES.add(JOURNAL_FILENAME)
+_SQLITE_SIDE_SUFFIXES = ('-journal', '-wal', '-shm')
+
+
+def is_state_file(name):
+    """ returns True when name is the name of a file kept by these tools in the base folder (see
+        STATE_FILES), or a side file sqlite keeps next to their databases """
+    for suffix in _SQLITE_SIDE_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name in STATE_FILES
+
+
+def get_rst_in_folder(folder, threads=None, snapshot=None):
     """ given a folder, it
         generates the pathlib.Path of all the rst files in the folder and all subfolders
+        (see walk_files() for the details) """
+    return walk_files(folder, suffix='.rst', threads=threads, snapshot=snapshot)
+
+def walk_files(folder, suffix=None, pruned=PRUNED_FOLDERS, threads=None, snapshot=None):
+    """ given a folder, it generates the pathlib.Path of all the files in the folder and all
+        subfolders, folder by folder (breadth first) and sorted by name within each folder.
+        - suffix: when provided, only the files with this suffix are generated
+        - pruned: names of the subfolders that won't be explored (e.g. '_build' or '.git')
+        - threads: when provided, the folders of each level are listed by this number of threads
+        - snapshot: when provided (FsSnapshot), the folders are listed through it, so the folders
+          already listed are not listed again
+
+        Each folder is listed with a single os.scandir() so the type of the entries comes from
+        the listing itself. Symlinks are followed: cycles are avoided by not exploring twice a
+        folder with the same (st_dev, st_ino). The files kept by these tools (see is_state_file())
+        are never generated, since they are not part of the project
+    """
+    for _, files in _walk(folder, suffix, pruned, threads, snapshot):
+        yield from files
+
+def walk_folders(folder, pruned=PRUNED_FOLDERS, snapshot=None):
+    """ given a folder, it generates the pathlib.Path of the folder itself and all its non pruned
+        subfolders in the same order as walk_files() """
+    for subfolder, _ in _walk(folder, None, pruned, snapshot=snapshot):
+        yield subfolder
+
+def list_tree(folder, pruned=PRUNED_FOLDERS, threads=None, snapshot=None):
+    """ returns the frozenset of the str paths relative to folder (posix style) of every file and
+        subfolder within folder at any depth (see walk_files() for the details).
+        It is a snapshot of the tree taken with a single os.scandir() per folder, so checking the
+        existence of any number of paths within folder costs a lookup instead of a stat() each """
+    prefix = len(str(folder)) + 1
+    listed = set()
+    for subfolder, files in _walk(folder, None, pruned, threads, snapshot):
+        listed.add(str(subfolder)[prefix:])
+        listed.update(str(path)[prefix:] for path in files)
+    listed.discard('')
+    return frozenset(listed)
+
+def _walk(folder, suffix, pruned, threads=None, snapshot=None):
+    """ generates the pairs (folder, files) of folder and its subfolders (see walk_files()) """
+    stat = os.stat(folder)
+    visited = {(stat.st_dev, stat.st_ino)}
+    level = [folder]
+    executor = concurrent.futures.ThreadPoolExecutor(threads) if threads and threads > 1 else None
+    try:
+        while level:
+            listings = (executor.map(_list_folder, level, itertools.repeat(suffix), itertools.repeat(pruned),
+                                     itertools.repeat(snapshot))
+                        if executor else (_list_folder(subfolder, suffix, pruned, snapshot) for subfolder in level))
+            next_level = list()
+            for current, (files, subfolders) in zip(level, listings):
+                yield current, files
+                for key, subfolder in subfolders:
+                    if key not in visited:
+                        visited.add(key)
+                        next_level.append(subfolder)
+            level = next_level
+    finally:
+        if executor:
+            executor.shutdown()
 
-        Note: currently the recursive option is disabled (commented out)
+def _list_folder(folder, suffix, pruned, snapshot=None):
+    """ lists folder (through snapshot when provided) and returns a pair with:
+        - the sorted list of the files in folder (only those with suffix when provided)
+        - the sorted list of pairs ((st_dev, st_ino), subfolder) of the non pruned subfolders
     """
-    for item in folder.iterdir():
-        if item.is_symlink():
-            continue            # symlinks are ignored to avoid potential infinite loops
-        if item.is_dir():
-            continue            # non recursive yet
-        #    for subitem in get_potential_rst(item):
-        #        yield subitem
-        elif item.is_file() and item.suffix == '.rst':
-            yield item
+    files = list()
+    subfolders = list()
+    for entry in (_scan_folder(folder) if snapshot is None else snapshot.entries(folder).values()):
+        try:
+            if entry.is_dir():
+                if entry.name not in pruned:
+                    stat = entry.stat()
+                    subfolders.append(((stat.st_dev, stat.st_ino), folder / entry.name))
+            elif (entry.is_file() and (suffix is None or entry.name.endswith(suffix))
+                  and not is_state_file(entry.name)):
+                files.append(folder / entry.name)
+        except OSError:
+            continue    # e.g. broken symlinks or entries removed while listing
+    files.sort()
+    subfolders.sort(key=lambda item: item[1])
+    return files, subfolders
+
+def _scan_folder(folder):
+    """ returns the list of os.DirEntry of folder, empty when it can't be listed """
+    try:
+        with os.scandir(folder) as entries:
+            return list(entries)
+    except OSError:
+        return list()   # e.g. permission denied
+
+
+####################################################################################################
+#   Filesystem snapshot
+####################################################################################################
+
+class FsSnapshot:
+    """ Snapshot of the filesystem answering from memory the questions about paths (existence,
+        type, stat and contents of folders) for the rest of the run.
+
+        Each folder is listed with a single os.scandir() the first time a path within it is asked
+        and its os.DirEntry are kept: they know their type from the listing itself and they keep
+        their stat() once called, so asking again about any path of a listed folder costs a lookup.
+        Paths must be absolute and normalized (e.g. resolved). Changes on the filesystem after a
+        folder is listed are not seen, so a snapshot is meant to last a single run of a script.
+    """
+
+    def __init__(self):
+        self._entries = dict()      # str folder -> { name: os.DirEntry }
+
+    def entries(self, folder):
+        """ returns the dict { name: os.DirEntry } of folder (empty when it can't be listed),
+            listing it the first time """
+        key = str(folder)
+        entries = self._entries.get(key)
+        if entries is None:
+            entries = self._entries[key] = {entry.name: entry for entry in _scan_folder(key)}
+        return entries
+
+    def entry(self, path):
+        """ returns the os.DirEntry of path or None when it doesn't exist or it is a root """
+        path = pathlib.Path(path)
+        return self.entries(path.parent).get(path.name) if path.name else None
+
+    def exists(self, path):
+        """ returns True when path exists (following symlinks as pathlib.Path.exists()) """
+        entry = self.entry(path)
+        if entry is None:
+            return not pathlib.Path(path).name      # a root always exists
+        return not entry.is_symlink() or self.stat(path) is not None
+
+    def is_dir(self, path):
+        """ returns True when path is a folder (following symlinks as pathlib.Path.is_dir()) """
+        entry = self.entry(path)
+        if entry is None:
+            return not pathlib.Path(path).name
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    def is_file(self, path):
+        """ returns True when path is a file (following symlinks as pathlib.Path.is_file()) """
+        entry = self.entry(path)
+        try:
+            return entry is not None and entry.is_file()
+        except OSError:
+            return False
+
+    def is_symlink(self, path):
+        """ returns True when path is a symlink """
+        entry = self.entry(path)
+        return entry is not None and entry.is_symlink()
+
+    def stat(self, path):
+        """ returns the os.stat_result of path (following symlinks) or None when it doesn't exist """
+        entry = self.entry(path)
+        try:
+            if entry is None:
+                return os.stat(path) if not pathlib.Path(path).name else None
+            return entry.stat()
+        except OSError:
+            return None
+
+    def iterdir(self, folder):
+        """ returns the sorted list of the pathlib.Path within folder """
+        folder = pathlib.Path(folder)
+        return [folder / name for name in sorted(self.entries(folder))]
 
 def seek_references_in_file(rstpath, target):
     """ seeks in the contents of the rstpath for the target (both pathlib.Path)
         It returns a list of pairs (line, pos) of all the references of target in rstpath.  """
-    if not target.stem in rstpath.read_text():  # quick filter
+    data = rstpath.read_bytes()
+    if prefilter_key(target).encode() not in data:    # quick filter
         return []
-    with open(rstpath) as f:
-        lines = f.readlines()
-    return check_rst_references(lines, target)
+    return check_rst_references(split_lines(data), target)
 
-####################################################################################################
-#   Check references
-####################################################################################################
+_INDEX_NAMES = ('index.rst', 'contents.rst')    # usual names of the documents with the toctrees
 
-def look_for_ref(rstcontents, src):
-    """ This method is specialized in references :ref: """
-    return look_for_tag(':ref:', rstcontents, src)
-
-def look_for_doc(rstcontents, src):
-    """ This method is specialized in references :doc: """
-    return look_for_tag(':doc:', rstcontents, src)
-
-def look_for_dowmload(rstcontents, src):
-    """ This method is specialized in references :download: """
-    return look_for_tag(':download:', rstcontents, src, rst_only=False)
-
-def look_for_images(rstcontents, src):
-    """ this method is specialized in references to images """
-    return check_for_image_tag('.. image::', rstcontents, src)
-
-def look_for_figures(rstcontents, src):
-    """ this method is specialized in references to figures """
-    return check_for_image_tag('.. figure::', rstcontents, src)
-
-def look_for_literalinclude(rstcontents, src):
-    """ this method is specialized in references to literalinclude"""
-    return check_for_image_tag('.. literalinclude::', rstcontents, src)
-
-def look_for_toctrees(rstcontents, src):
-    """ This method is specialized in references on toctrees """
-    if src.suffix != '.rst':
-        return list()       # non rst can't be in a toctree
-    target = str(src)
-    target_without_extension = target[:-4]
-    non_space = re.compile(r'\S')
-    tag = '.. toctree::'
-    changes = list()
-    in_toctree = False
-    min_indentation = 0     # minimum indentation for items in toctree
-    for nr, line in enumerate(rstcontents):
-        if not in_toctree:
-            if tag in line:
-                in_toctree = True
-                min_indentation = line.find(tag) + 1 # doctree refs should present at least this indentation
-            continue
-        if not line.strip():    # ignore empty lines
-            continue
-        m = non_space.search(line)
-        if m and m.start() < min_indentation:   # end of this toctree
-            in_toctree = False
+def iter_references(base_folder, target, rst_files=None, trigrams=None):
+    """ generates the references to target (a path absolute or relative to base_folder) in the rst
+        files of base_folder, as they are found, as tuples (rstpath, line, col, kind) where col is
+        the position where the path starts in the line.
+        When target is a folder, the references to any path within it are generated.
+        When rst_files is provided, only these files are considered
+        When trigrams (TrigramIndex) is provided, the files that can't reference target according to
+        the index are not even read. A reference to a path within a folder target doesn't need to
+        contain the name of the folder when the document is within that folder too, so these
+        documents are always read
+
+        It is lazy: files are read only as the references are requested, so the caller can stop at
+        the first one (see is_referenced()). Files more likely to reference target are visited
+        first: those in the folder of target, then the indexes, and then the rest. """
+    target = base_folder / target
+    key = str(target.relative_to(base_folder))
+    is_folder = target.is_dir()
+    retain = {key + '/'} if is_folder else {key}
+    pattern = prefilter_key(target).encode()
+    if rst_files is None:
+        rst_files = get_rst_in_folder(base_folder)
+    if trigrams is not None:
+        rst_files = list(rst_files)
+        candidates = trigrams.candidates(rst_files, [prefilter_key(target)])
+        rst_files = [rstpath for rstpath in rst_files
+                     if rstpath in candidates or is_folder and target in rstpath.parents]
+    rst_files = sorted(rst_files, key=lambda rstpath: (rstpath.parent != target.parent,
+                                                       rstpath.name not in _INDEX_NAMES))
+    for rstpath in rst_files:
+        data = rstpath.read_bytes()
+        if pattern not in data and not (is_folder and target in rstpath.parents):     # quick filter
             continue
-        rest_of_line = line[m.start():].strip()
-        if rest_of_line == target or rest_of_line == target_without_extension:
-            changes.append((nr, m.start()))
+        folder = document_folder(rstpath, base_folder)
+        for reference in extract_references(split_lines(data)):
+            path, col = resolve_reference(reference, folder)
+            if is_retained(path, retain):
+                yield rstpath, reference.line, col, reference.kind
 
-    return changes
+def is_referenced(base_folder, target, rst_files=None, trigrams=None):
+    """ returns True when any rst file in base_folder references target. It stops at the first
+        reference found (see iter_references()) """
+    return next(iter_references(base_folder, target, rst_files, trigrams), None) is not None
 
-def look_for_tag(tag, rstcontents, src, rst_only=True):
-    """ This method is specialized in references with directives like :ref: and :doc:
-        It expects tag to contain ':ref:' or ':doc:'
-        These directives allow the following variants:
-        - :ref:`objectwithoutextension`
-        - :ref:`text for caption <objectwithoutextension>`
-        When object appears within <>, it can appear splitted from the tag line. e.g.
-            :ref:`a ref
-            with
-            a caption <target>`
+def read_lines(rstpath):
+    """ reads rstpath once and returns the list of its lines keeping their original line endings """
+    return split_lines(rstpath.read_bytes())
+
+def split_lines(data):
+    """ decodes the contents of a rst file (bytes) and returns the list of its lines keeping their
+        original line endings, so joining them gives back exactly the same contents """
+    return io.StringIO(data.decode(), newline='').readlines()
+
+def read_references(rstpath):
+    """ returns the list of Reference found in the contents of rstpath (pathlib.Path) """
+    return extract_references(read_lines(rstpath))
+
+def scan_file(rstpath, known_digest=None, retain=None, prefilter=None, base_folder=None):
+    """ reads rstpath once and returns the triplet (digest, references, lines) where:
+        - digest: is the hash of the contents of rstpath
+        - references: the list of Reference in rstpath or None when digest equals known_digest
+        - lines: the lines of rstpath when it references any of the paths in retain (a set of
+          str paths relative to base_folder as returned by resolve_reference(), where paths ending
+          by / stand for any path within that folder). None otherwise
+        When prefilter (MultiMatcher) is provided and none of its patterns appear in rstpath,
+        the file is not parsed and references is an empty list.
     """
-    if rst_only:
-        if src.suffix != '.rst':
-            return list()       # non rst can't be in a toctree
-        target = str(src)[:-4]  # remove extension since rst_only references go without
+    data = rstpath.read_bytes()
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    if digest == known_digest:
+        return digest, None, None
+    if prefilter is not None and not prefilter.occurs_in(data):
+        return digest, [], None
+    lines = split_lines(data)
+    references = extract_references(lines)
+    if retain:
+        folder = document_folder(rstpath, base_folder) if base_folder else ''
+        if not any(is_retained(resolve_reference(reference, folder)[0], retain) for reference in references):
+            lines = None
     else:
-        target = str(src)       # keep the extension when non rst_only
-    changes = list()
-    reference_splitted = False   # initially, the tag is expected
-    for nr, line in enumerate(rstcontents):
-        reference_splitted, positions = check_line_for_tag(tag, reference_splitted, line, target)
-        changes.extend([(nr, pos) for pos in positions])
-    return changes
+        lines = None
+    return digest, references, lines
 
-def check_partial_line_for_tag(tag, line, pos, target):
-    """ given a line and a pos to start checking, it looks for tag from pos in the line.
-        It returns:
-        - if the reference is splitted. i.e. there's a caption and <> part will appear in another line
-        - the position where the target has been found (-1 if not found)
-        - the position where to keep looking for further references
+def is_retained(path, retain):
+    """ returns True when path (str) is in retain or within any folder in retain (ending by /) """
+    return path in retain or any(folder.endswith('/') and path.startswith(folder) for folder in retain)
+
+_BATCH_BYTES = 1 << 20      # approximated amount of rst contents to be scanned by a process at once
+_BATCH_FILES = 64           # maximum number of files to be scanned by a process at once
+
+def scan_files(items, jobs=None, retain=None, prefilter=None, base_folder=None):
+    """ given a list of pairs (rstpath, known_digest), it generates the pairs
+        (rstpath, result of scan_file(rstpath, known_digest, retain, prefilter, base_folder)) in no
+        particular order.
+        When jobs is greater than 1, the files are scanned by a pool of jobs processes.
+        In this case, files are sent to the pool in batches, largest files first, so
+        a huge file doesn't stall the end of the scan.
     """
-    pos_tag = line.find(tag, pos)
-    if pos_tag < 0:
-        return False, -1, len(line)
+    if not jobs or jobs <= 1 or len(items) <= 1:
+        for rstpath, known_digest in items:
+            yield rstpath, scan_file(rstpath, known_digest, retain, prefilter, base_folder)
+        return
+    sized_items = sorted(((rstpath.stat().st_size, rstpath, known_digest) for rstpath, known_digest in items),
+                         key=lambda item: item[0], reverse=True)
+    batches = list()
+    batch = list()
+    batch_bytes = 0
+    for size, rstpath, known_digest in sized_items:
+        if batch and (batch_bytes + size > _BATCH_BYTES or len(batch) >= _BATCH_FILES):
+            batches.append(batch)
+            batch = list()
+            batch_bytes = 0
+        batch.append((rstpath, known_digest))
+        batch_bytes += size
+    batches.append(batch)
+    scan_batch = _scan_batch if _profile is None else _profiled_scan_batch
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(scan_batch, batch, retain, prefilter, base_folder) for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            if _profile is None:
+                yield from future.result()
+            else:
+                scanned, profile = future.result()
+                _profile.merge(profile)
+                yield from scanned
 
-    pos_open_tag = line.find('`', pos_tag)
-    pos_close_tag = line.find('`', pos_open_tag + 1)
-    if pos_close_tag < 0:   # splitted tag
-        return True, -1, len(line)
+def _scan_batch(batch, retain, prefilter, base_folder):
+    """ scans a batch of pairs (rstpath, known_digest) in a worker process """
+    return [(rstpath, scan_file(rstpath, known_digest, retain, prefilter, base_folder))
+            for rstpath, known_digest in batch]
 
-    next_pos = pos_close_tag + 1
-    tag_content = line[pos_open_tag+1: pos_close_tag]
-    if tag_content == target:  # tag`target`
-        return False, pos_open_tag + 1, next_pos
+def _profiled_scan_batch(batch, retain, prefilter, base_folder):
+    """ scans a batch as _scan_batch() while profiling, and returns the results and the Profile """
+    disable_profiling()     # the worker may have inherited the profiling state of its parent
+    enable_profiling()
+    try:
+        return _scan_batch(batch, retain, prefilter, base_folder), _profile
+    finally:
+        disable_profiling()
 
-    if '<' not in tag_content:    # references to another target
-        return False, -1, next_pos
 
-    pos_init_caption = line.find('<', pos_tag + 1)
-    pos_end_caption = line.find('>', pos_init_caption + 1)
-    assert pos_init_caption < pos_end_caption, "malformed rst on line %s" % line
-    caption_content = line[pos_init_caption + 1:pos_end_caption]
-    if caption_content == target:
-        return False, pos_init_caption + 1, next_pos
+####################################################################################################
+#   Multiple target matching
+####################################################################################################
 
-    return False, -1, next_pos
+def prefilter_key(target):
+    """ returns the text that any reference to target (pathlib.Path) must contain: its name, or its
+        stem for rst files since they can be referenced without extension. Every variant of the
+        reference (with or without extension, with or without a leading /) contains it """
+    return target.stem if target.suffix == '.rst' else target.name
 
 
-def check_line_for_tag(tag, reference_splitted, line, target):
-    """ checks for tag in the line
-        It works in two different ways depending on the value of reference_splitted:
-        - False: it expects to find the tag
-        - True: the tag was found in a previous line, so it looks just for the target
-        It will consume the whole line when return
-        It returns:
-        - if the reference is still splitted
-        - a list of positions in the line where src has been found
+class MultiMatcher:
+    """ Aho-Corasick automaton to look for many patterns (str) at once.
+
+        It is built once from all the patterns and then it finds which of them appear in a
+        text (bytes) in a single linear pass, whatever the number of patterns is.
+        With just a few patterns, a plain substring search per pattern is faster, so it is
+        used instead.
     """
-    positions = []
-    next_pos = 0
-    while 0 <= next_pos < len(line):
-        if reference_splitted:
-            reference_splitted, reference_pos, next_pos = check_line_for_caption(line, target)
-        else:
-            reference_splitted, reference_pos, next_pos = check_partial_line_for_tag(tag, line, next_pos, target)
-        if reference_pos >= 0:
-            positions.append(reference_pos)
-    return reference_splitted, positions
 
+    _FEW_PATTERNS = 8
+
+    def __init__(self, patterns):
+        self.patterns = sorted(set(pattern for pattern in patterns if pattern))
+        self._encoded = [pattern.encode() for pattern in self.patterns]
+        self._goto = [dict()]       # state -> { byte: next state }
+        self._outputs = [()]        # state -> indexes of the patterns found when reaching state
+        for index, pattern in enumerate(self._encoded):
+            state = 0
+            for byte in pattern:
+                next_state = self._goto[state].get(byte)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append(dict())
+                    self._outputs.append(())
+                    self._goto[state][byte] = next_state
+                state = next_state
+            self._outputs[state] += (index,)
+        self._fail = [0] * len(self._goto)
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for byte, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and byte not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(byte, 0)
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+    @classmethod
+    def for_targets(cls, targets):
+        """ returns the matcher of the references to any of the targets (pathlib.Path) """
+        return cls(prefilter_key(pathlib.Path(target)) for target in targets)
+
+    def search(self, data):
+        """ returns the set of patterns that appear in data (bytes) """
+        if len(self._encoded) <= self._FEW_PATTERNS:
+            return set(pattern for pattern, encoded in zip(self.patterns, self._encoded) if encoded in data)
+        return set(self.patterns[index] for index in self._run(data, stop_at_first=False))
+
+    def occurs_in(self, data):
+        """ returns True when any of the patterns appears in data (bytes) """
+        if len(self._encoded) <= self._FEW_PATTERNS:
+            return any(encoded in data for encoded in self._encoded)
+        return bool(self._run(data, stop_at_first=True))
+
+    def _run(self, data, stop_at_first):
+        """ runs the automaton on data and returns the set of indexes of the patterns found """
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        found = set()
+        state = 0
+        for byte in data:
+            while state and byte not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(byte, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+                if stop_at_first or len(found) == len(self._encoded):
+                    break
+        return found
+
+
+####################################################################################################
+#   Reference cache
+####################################################################################################
+
+CACHE_FILENAME = '.rstutils-cache.sqlite'
+STATE_FILES.add(CACHE_FILENAME)
+_CACHE_VERSION = '2'    # increase it whenever extract_references() changes its results
+
+
+class ReferenceCache:
+    """ Persistent cache of the references extracted from rst files.
+
+        It is stored as a sqlite database (usually CACHE_FILENAME in the base folder) and
+        it keeps, for each rst file, its references keyed by mtime, size and a hash of its
+        contents:
+        - when mtime and size didn't change, the file is not even read
+        - when they changed but the hash is the same, the file is not parsed again
+        - otherwise, the references are extracted and stored
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = dict()  # { key: (stat, row) } of the files looked up but not stored yet
+        self._connection = sqlite3.connect(str(path))
+        self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS refs '
+                                 '(path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, hash TEXT, refs TEXT)')
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != _CACHE_VERSION:
+            self._connection.execute('DELETE FROM refs')
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (_CACHE_VERSION,))
+
+    @classmethod
+    def in_folder(cls, base_folder):
+        """ returns the cache stored in base_folder """
+        return cls(base_folder / CACHE_FILENAME)
+
+    def read_references(self, rstpath):
+        """ returns the list of Reference in rstpath, parsing it only when it is not cached """
+        references, known_digest = self.lookup(rstpath)
+        if references is None:
+            digest, references, _ = scan_file(rstpath, known_digest)
+            references = self.store(rstpath, digest, references)
+        return references
+
+    def lookup(self, rstpath):
+        """ returns the pair (references, digest) where:
+            - references: the cached list of Reference when mtime and size of rstpath didn't change
+              (None otherwise)
+            - digest: the hash of the cached contents of rstpath (None when not cached)
+            When references is None, the result of scanning rstpath is expected on store()
+        """
+        key = self._key(rstpath)
+        stat = rstpath.stat()
+        row = self._connection.execute('SELECT mtime, size, hash, refs FROM refs WHERE path = ?',
+                                       (key,)).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return self._decode(row[3]), row[2]
+        self._pending[key] = (stat, row)
+        return None, row[2] if row else None
+
+    def store(self, rstpath, digest, references):
+        """ stores the result of scan_file() on rstpath after a lookup() and returns its references.
+            When references is None, the contents didn't change and the cached references are kept """
+        key = self._key(rstpath)
+        stat, row = self._pending.pop(key)
+        if references is None:
+            references = self._decode(row[3])
+        self._connection.execute('INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?)',
+                                 (key, stat.st_mtime_ns, stat.st_size, digest, json.dumps(references)))
+        return references
+
+    def prune(self, rstpaths):
+        """ removes from the cache the entries of the files that are not in rstpaths """
+        keep = set(self._key(rstpath) for rstpath in rstpaths)
+        obsolete = [(key,) for key, in self._connection.execute('SELECT path FROM refs') if key not in keep]
+        self._connection.executemany('DELETE FROM refs WHERE path = ?', obsolete)
+
+    def close(self):
+        """ stores the changes and closes the cache """
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _key(self, rstpath):
+        """ returns the key of rstpath: relative to the folder of the cache when possible """
+        try:
+            return str(rstpath.relative_to(self.path.parent))
+        except ValueError:
+            return str(rstpath)
+
+    @staticmethod
+    def _decode(refs):
+        return [Reference(*reference) for reference in json.loads(refs)]
+
+
+####################################################################################################
+#   Trigram index
+####################################################################################################
+
+TRIGRAMS_FILENAME = '.rstutils-trigrams.sqlite'
+STATE_FILES.add(TRIGRAMS_FILENAME)
+_TRIGRAMS_VERSION = '1'     # increase it whenever trigrams_of() changes its results
+_TRIGRAM = re.compile(rb'(?=(\S{3}))')     # overlapping trigrams without whitespace
+_TRIGRAMS_FLUSH = 1 << 22   # postings kept in memory before they are stored while updating
+
+
+def trigrams_of(data):
+    """ returns the set of trigrams (bytes) in data (bytes). Trigrams with whitespace are skipped
+        since the paths written in references hardly ever contain it """
+    return set(_TRIGRAM.findall(data))
+
+
+class TrigramIndex:
+    """ Persistent index of the trigrams in the contents of rst files.
+
+        It is stored as a sqlite database (usually TRIGRAMS_FILENAME in the base folder) with:
+        - files: for each rst file, its id, its mtime and size when indexed, and its trigrams
+        - postings: for each trigram, the ids of the files containing it (array of uint32)
+
+        A text (e.g. the name of a target) can only be in the files containing all of its trigrams,
+        so the files that may contain it are obtained without opening any file. The index is
+        updated incrementally: only the files whose mtime or size changed are read again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._prefix = os.path.join(str(path.parent), '')    # of the paths within the folder of the index
+        self._paths = dict()    # { file id: key } of the indexed files
+        self._connection = sqlite3.connect(str(path))
+        self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, '
+                                 'mtime INTEGER, size INTEGER, trigrams BLOB)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS postings (trigram BLOB PRIMARY KEY, files BLOB)')
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != _TRIGRAMS_VERSION:
+            self._connection.execute('DELETE FROM files')
+            self._connection.execute('DELETE FROM postings')
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (_TRIGRAMS_VERSION,))
+
+    @classmethod
+    def in_folder(cls, base_folder):
+        """ returns the trigram index stored in base_folder """
+        return cls(base_folder / TRIGRAMS_FILENAME)
+
+    def candidates(self, rst_files, texts):
+        """ returns the set of rst_files that may contain any of texts (list of str).
+            The index is updated with rst_files beforehand (see update())
+            The references to a path within a folder don't always contain the name of the folder
+            (see iter_references()), so the callers can't narrow the documents of a folder target
+            with it """
+        self.update(rst_files)
+        file_ids = set()
+        for text in texts:
+            containing = self._files_containing(text.encode())
+            if containing is None:      # too short to be looked for in the index
+                return set(rst_files)
+            file_ids |= containing
+        keys = set(self._paths[file_id] for file_id in file_ids)
+        return set(rstpath for rstpath in rst_files if self._key(rstpath) in keys)
+
+    def update(self, rst_files):
+        """ indexes the files in rst_files not indexed yet or whose mtime or size changed, and
+            forgets the indexed files that don't exist anymore """
+        indexed = {key: (file_id, mtime, size) for file_id, key, mtime, size
+                   in self._connection.execute('SELECT id, path, mtime, size FROM files')}
+        added = dict()      # { trigram: array of the ids of the files that contain it now }
+        removed = dict()    # { trigram: set of the ids of the files that don't contain it anymore }
+        pending = 0
+        for rstpath in rst_files:
+            key = self._key(rstpath)
+            entry = indexed.pop(key, None)
+            try:
+                stat = rstpath.stat()
+            except OSError:
+                if entry:
+                    indexed[key] = entry    # to be forgotten below
+                continue
+            if entry and entry[1:] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            trigrams = trigrams_of(rstpath.read_bytes())
+            row = (stat.st_mtime_ns, stat.st_size, b''.join(sorted(trigrams)))
+            if entry:
+                file_id = entry[0]
+                previous = self._trigrams_of_file(file_id)
+                self._connection.execute('UPDATE files SET mtime = ?, size = ?, trigrams = ? WHERE id = ?',
+                                         row + (file_id,))
+            else:
+                file_id = self._connection.execute('INSERT INTO files (path, mtime, size, trigrams) '
+                                                   'VALUES (?, ?, ?, ?)', (key,) + row).lastrowid
+                previous = set()
+            for trigram in trigrams - previous:
+                added.setdefault(trigram, array.array('I')).append(file_id)
+            for trigram in previous - trigrams:
+                removed.setdefault(trigram, set()).add(file_id)
+            pending += len(trigrams)
+            if pending > _TRIGRAMS_FLUSH:
+                self._update_postings(added, removed)
+                pending = 0
+        for key, (file_id, _, _) in indexed.items():   # not in rst_files: forgotten if removed
+            if not (self.path.parent / key).exists():
+                for trigram in self._trigrams_of_file(file_id):
+                    removed.setdefault(trigram, set()).add(file_id)
+                self._connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        self._update_postings(added, removed)
+        self._connection.commit()
+        self._paths = {file_id: key for file_id, key in self._connection.execute('SELECT id, path FROM files')}
+
+    def close(self):
+        """ stores the changes and closes the index """
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _files_containing(self, text):
+        """ returns the set of ids of the files containing all the trigrams of text (bytes)
+            or None when text has no trigrams """
+        trigrams = trigrams_of(text)
+        if not trigrams:
+            return None
+        postings = list()
+        for trigram in trigrams:
+            row = self._connection.execute('SELECT files FROM postings WHERE trigram = ?', (trigram,)).fetchone()
+            if row is None:
+                return set()
+            postings.append(row[0])
+        postings.sort(key=len)      # the rarest trigram first
+        file_ids = set(self._decode(postings[0]))
+        for posting in postings[1:]:
+            if not file_ids:
+                break
+            file_ids.intersection_update(self._decode(posting))
+        return file_ids
+
+    def _update_postings(self, added, removed):
+        """ adds and removes (and then clears) the ids of the files to the postings of each trigram """
+        for trigram in added.keys() | removed.keys():
+            row = self._connection.execute('SELECT files FROM postings WHERE trigram = ?', (trigram,)).fetchone()
+            file_ids = self._decode(row[0]) if row else array.array('I')
+            if trigram in removed:
+                file_ids = array.array('I', (file_id for file_id in file_ids if file_id not in removed[trigram]))
+            file_ids.extend(added.get(trigram, ()))
+            if file_ids:
+                self._connection.execute('INSERT OR REPLACE INTO postings VALUES (?, ?)', (trigram, file_ids.tobytes()))
+            elif row:
+                self._connection.execute('DELETE FROM postings WHERE trigram = ?', (trigram,))
+        added.clear()
+        removed.clear()
+
+    def _trigrams_of_file(self, file_id):
+        data, = self._connection.execute('SELECT trigrams FROM files WHERE id = ?', (file_id,)).fetchone()
+        return set(data[pos:pos + 3] for pos in range(0, len(data), 3))
+
+    def _key(self, rstpath):
+        """ returns the key of rstpath: relative to the folder of the index when possible.
+            It is computed on the str of the path since it is done for every file on every query """
+        path = str(rstpath)
+        return path[len(self._prefix):] if path.startswith(self._prefix) else path
+
+    @staticmethod
+    def _decode(files):
+        file_ids = array.array('I')
+        file_ids.frombytes(files)
+        return file_ids
+
+
+####################################################################################################
+#   Reference graph
+####################################################################################################
+
+class ReferenceGraph:
+    """ In memory graph with the references of all the rst files of a project.
+
+        It is built from a single scan of the project and then it answers any question about
+        references with a lookup. Files (documents and targets) are interned as int ids:
+        - forward: { document id: list of (target id, Reference) }
+        - backward: { target id: list of (document id, line, pos) }
+        Paths are kept normalized and relative to base_folder, whatever the way they are written
+        in the references (see resolve_reference()).
+
+        Besides, contents keeps { rstpath: lines } of the documents read while building the graph
+        that reference any retained target, so they don't need to be read again.
+    """
+
+    def __init__(self, base_folder):
+        self.base_folder = base_folder
+        self.forward = dict()
+        self.backward = dict()
+        self.contents = dict()
+        self._paths = list()    # file id -> path relative to base_folder (str)
+        self._ids = dict()      # path relative to base_folder (str) -> file id
+
+    @classmethod
+    def build(cls, base_folder, rst_files=None, cache=None, jobs=None, retain=None, targets=None, trigrams=None,
+              snapshot=None):
+        """ builds the graph of base_folder scanning rst_files once (see scan() for the details) """
+        graph = cls(base_folder)
+        for _ in graph.scan(rst_files, cache, jobs, retain, targets, trigrams, snapshot):
+            pass
+        return graph
+
+    def scan(self, rst_files=None, cache=None, jobs=None, retain=None, targets=None, trigrams=None, snapshot=None):
+        """ adds to the graph the documents in rst_files scanning them once, and generates each
+            rstpath as soon as it is added, so the caller can work on it while the rest are scanned.
+            When rst_files is not provided, the rst files in base_folder are scanned
+            When cache (ReferenceCache) is provided, only the files not in cache are parsed
+            When jobs is greater than 1, files are parsed by a pool of jobs processes.
+            Anyway, documents are added to the graph in the order of rst_files
+            When retain (list of target paths) is provided, the lines of the parsed documents
+            referencing any of them (or any path within them when they are folders) are kept in
+            graph.contents
+            When targets (list of target paths) is provided, documents that can't reference any of
+            them are not parsed, so the graph only answers questions about these targets. Since
+            the cache must keep all the references, targets is ignored when cache is provided.
+            It is ignored as well when any target is a folder, since the documents within it
+            reference its contents without naming it
+            When trigrams (TrigramIndex) is provided along with targets, the documents that can't
+            reference any of them according to the index are not even read
+            When snapshot (FsSnapshot) is provided, the rst files and retained folders are
+            looked up in it """
+        is_dir = snapshot.is_dir if snapshot else pathlib.Path.is_dir
+        if retain:
+            retain = set(key + '/' if is_dir(self.base_folder / key) else key for key in map(self._key, retain))
+        if targets and any(is_dir(self.base_folder / target) for target in targets):
+            targets = None
+        prefilter = MultiMatcher.for_targets(targets) if targets and not cache else None
+        scan_all = rst_files is None
+        rst_files = list(get_rst_in_folder(self.base_folder, snapshot=snapshot) if scan_all else rst_files)
+        candidates = None
+        if trigrams is not None and prefilter is not None:
+            candidates = trigrams.candidates(rst_files, [prefilter_key(target) for target in targets])
+        references = dict()     # { rstpath: references } of the documents not added yet
+        pending = list()
+        for rstpath in rst_files:
+            if candidates is not None and rstpath not in candidates:
+                references[rstpath] = list()
+                continue
+            cached, known_digest = cache.lookup(rstpath) if cache else (None, None)
+            if cached is None:
+                pending.append((rstpath, known_digest))
+            else:
+                references[rstpath] = cached
+        added = 0     # the sentinel at the end adds the documents left when nothing is pending
+        for rstpath, (digest, scanned, lines) in itertools.chain(
+                scan_files(pending, jobs, retain, prefilter, self.base_folder), [(None, (None, None, None))]):
+            if rstpath is not None:
+                references[rstpath] = cache.store(rstpath, digest, scanned) if cache else scanned
+                if lines is not None:
+                    self.contents[rstpath] = lines
+            while added < len(rst_files) and rst_files[added] in references:    # in the order of rst_files
+                self.add_document(rst_files[added], references.pop(rst_files[added]))
+                yield rst_files[added]
+                added += 1
+        if cache and scan_all:
+            cache.prune(rst_files)
+
+    def file_id(self, path):
+        """ returns the id of path (absolute or relative to base_folder) interning it if new """
+        key = self._key(path)
+        file_id = self._ids.get(key)
+        if file_id is None:
+            file_id = len(self._paths)
+            self._paths.append(key)
+            self._ids[key] = file_id
+        return file_id
+
+    def path(self, file_id):
+        """ returns the absolute pathlib.Path corresponding to file_id """
+        return self.base_folder / self._paths[file_id]
+
+    def add_document(self, rstpath, references):
+        """ adds to the graph the references (list of Reference) found in rstpath """
+        document_id = self.file_id(rstpath)
+        folder = posixpath.dirname(self._paths[document_id])
+        edges = list()
+        for reference in references:
+            target, col = resolve_reference(reference, folder)
+            target_id = self.file_id(target)
+            edges.append((target_id, reference))
+            self.backward.setdefault(target_id, list()).append((document_id, reference.line, col))
+        self.forward[document_id] = edges
+
+    def update_document(self, rstpath, references):
+        """ replaces the references of rstpath (already in the graph or not) by references """
+        self.remove_document(rstpath)
+        self.add_document(rstpath, references)
+
+    def remove_document(self, rstpath):
+        """ removes from the graph rstpath and the references found in it, if any """
+        document_id = self._ids.get(self._key(rstpath))
+        edges = self.forward.pop(document_id, None)
+        if not edges:
+            return
+        for target_id in set(target_id for target_id, _ in edges):
+            remaining = [entry for entry in self.backward[target_id] if entry[0] != document_id]
+            if remaining:
+                self.backward[target_id] = remaining
+            else:
+                del self.backward[target_id]
+
+    def documents(self):
+        """ generates the absolute paths of the documents in the graph """
+        for document_id in self.forward:
+            yield self.path(document_id)
+
+    def targets_of(self, rstpath):
+        """ returns the list of absolute paths referenced by rstpath """
+        document_id = self._ids.get(self._key(rstpath))
+        edges = self.forward.get(document_id, list())
+        return [self.path(target_id) for target_id in dict.fromkeys(target_id for target_id, _ in edges)]
+
+    def references_to(self, target):
+        """ returns a dict { rstpath: list of pairs (line, pos) } with the references to target """
+        result = dict()
+        for document_id, line, pos in self.backward.get(self._ids.get(self._key(target)), list()):
+            result.setdefault(self.path(document_id), list()).append((line, pos))
+        return result
+
+    def targets_under(self, folder):
+        """ returns the list of absolute paths of the referenced targets within folder at any depth """
+        prefix = self._key(folder) + '/'
+        return [self.path(target_id) for target_id in self.backward if self._paths[target_id].startswith(prefix)]
+
+    def is_referenced(self, target):
+        """ returns True when at least one document references target """
+        return bool(self.backward.get(self._ids.get(self._key(target))))
+
+    def reachable(self, roots):
+        """ returns the set of absolute paths reachable from the paths in roots following the
+            references of the documents (e.g. toctree, :doc: or include). Roots are included.
+            It visits every document and reference at most once (breadth first) """
+        reached = set(self._ids[key] for key in map(self._key, roots) if key in self._ids)
+        pending = collections.deque(reached)
+        while pending:
+            for target_id, _ in self.forward.get(pending.popleft(), ()):
+                if target_id not in reached:
+                    reached.add(target_id)
+                    pending.append(target_id)
+        return set(map(self.path, reached))
+
+    def dangling(self, existing, kinds=None):
+        """ generates the tuples (rstpath, Reference) of the references to paths that are not in
+            existing (set of normalized str paths relative to base_folder, see list_tree()),
+            document by document in the order they were added to the graph and sorted by position
+            within each document.
+            - kinds: when provided, only the references of these kinds are checked
+            References that can't be checked as paths (see is_checkable()) are ignored, and
+            each target is looked up just once whatever the number of references to it.
+            The targets outside base_folder (e.g. ../src/example.py) can't be in existing, so they
+            are looked up with a stat() """
+        missing = dict()    # target id -> True when the target doesn't exist
+        for document_id, edges in self.forward.items():
+            rstpath = None
+            for target_id, reference in edges:
+                if kinds is not None and reference.kind not in kinds:
+                    continue
+                dangles = missing.get(target_id)
+                if dangles is None:
+                    key = self._paths[target_id]
+                    if key == '..' or key.startswith('../'):
+                        dangles = not os.path.exists(self.path(target_id))
+                    else:
+                        dangles = key not in existing
+                    missing[target_id] = dangles
+                if dangles and is_checkable(reference):
+                    rstpath = rstpath or self.path(document_id)
+                    yield rstpath, reference
+
+    def referenced(self):
+        """ returns the set of absolute paths referenced by at least one document """
+        return set(self.path(target_id) for target_id in self.backward)
+
+    def rename_edits(self, renames):
+        """ given a list of pairs (src, dst) of absolute paths, it returns the edits to perform on
+            the documents to rename each src as dst as a dict { rstpath: list of (linenr, pos, src, dst) }
+            where src is the path as written in the document and dst how the renamed path must be
+            written (see split_reference()).
+            When src is a folder, every reference to a path within src is renamed to the same path
+            within dst. Besides the references to the renamed paths, the relative references of the
+            renamed documents are also rewritten so they keep pointing to the same paths """
+        return dict(self.iter_rename_edits(renames))
+
+    def iter_rename_edits(self, renames, documents=None):
+        """ generates the pairs (rstpath, edits) of rename_edits(), document by document, just for
+            the documents with edits. The edits of a document only depend on its own references, so
+            when documents (iterable of rstpath, e.g. the generator of scan()) is provided, the edits
+            of each one are generated as soon as it comes """
+        rename = self._renaming_function(renames)
+        if documents is None:
+            document_ids = set()
+            for src, _ in renames:
+                for target in (self.targets_under(src) if src.is_dir() else [src]):
+                    document_ids.update(entry[0] for entry in self.backward.get(self._ids.get(self._key(target)), ()))
+            document_ids.update(document_id for document_id in self.forward if rename(self._paths[document_id]))
+            documents = map(self.path, sorted(document_ids))
+        for rstpath in documents:
+            key = self._key(rstpath)
+            folder = posixpath.dirname(key)
+            new_folder = posixpath.dirname(rename(key) or key)
+            edits = list()
+            for target_id, reference in self.forward.get(self._ids.get(key), ()):
+                target = self._paths[target_id]
+                new_target = rename(target) or target
+                written, col, absolute = split_reference(reference)
+                if absolute or folder == new_folder:
+                    if new_target == target:
+                        continue
+                    new_written = new_target if absolute else spell_path(new_target, new_folder)
+                else:
+                    if resolve_reference(reference, new_folder)[0] == new_target:
+                        continue    # e.g. the target is moved along with the document
+                    new_written = spell_path(new_target, new_folder)
+                edits.append((reference.line, col, written, new_written))
+            if edits:
+                yield rstpath, edits
+
+    def _renaming_function(self, renames):
+        """ given a list of pairs (src, dst) of absolute paths, it returns a function that returns
+            the new key of a key when it is renamed (because it is a src or it is within a src
+            folder) or None otherwise """
+        files = dict()
+        folders = list()
+        for src, dst in renames:
+            if src.is_dir():
+                folders.append((self._key(src) + '/', self._key(dst) + '/'))
+            else:
+                files[self._key(src)] = self._key(dst)
+
+        def rename(key):
+            renamed = files.get(key)
+            if renamed is None:
+                for src, dst in folders:
+                    if key.startswith(src):
+                        return dst + key[len(src):]
+            return renamed
+        return rename
+
+    def _key(self, path):
+        """ returns the normalized str path relative to base_folder used as key for path """
+        path = pathlib.Path(path)
+        if path.is_absolute():
+            path = path.relative_to(self.base_folder)
+        return posixpath.normpath(path.as_posix())
+
+
+####################################################################################################
+#   Reference daemon client
+####################################################################################################
+SOCKET_NAME = '.rstutils.sock'
+STATE_FILES.add(SOCKET_NAME)
 
-def check_for_image_tag(tag, rstcontents, src, accept_absolute = True):
-    """ given a image tag (e.g. '.. image::' or '.. figure::' it returns
-        the lines in rstcontents containing a image reference to src.
+def query_daemon(base_folder, request, timeout=5.0):
+    """ sends request (dict) to the rst_serve.py daemon serving base_folder, if any, and returns
+        its answer (dict).
+        It returns None when there is no daemon running for base_folder or it can't answer, so the
+        caller must compute the answer by itself """
+    socket_path = base_folder / SOCKET_NAME
+    if not hasattr(socket, 'AF_UNIX') or not socket_path.exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(str(socket_path))
+            connection.sendall(json.dumps(request).encode() + b'\n')
+            with connection.makefile('rb') as stream:
+                response = json.loads(stream.readline())
+    except (OSError, ValueError):
+        return None     # e.g. stale socket of a stopped daemon
+    if not response.get('ok'):
+        return None
+    return response
+
+
+####################################################################################################
+#   Machine readable output
+####################################################################################################
+
+OUTPUT_FORMATS = ('text', 'ndjson')    # values of the --format option of the scripts
+
+def write_record(record, out=None):
+    """ writes record (dict) on out (stdout by default) as a line of JSON (NDJSON), so the
+        consumers can process each record as soon as it is flushed """
+    (out or sys.stdout).write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+####################################################################################################
+#   Check references
+####################################################################################################
+
+Reference = collections.namedtuple('Reference', ['kind', 'line', 'col', 'target'])
+Reference.__doc__ = """ A reference found in a rst file:
+        - kind: one of the values in REFERENCE_KINDS
+        - line: line number (starting by 0) where the target appears
+        - col: position of the first character of the target within the line
+        - target: the target exactly as it appears in the rst contents
+    """
+
+_DIRECTIVE_TAGS = (('image', '.. image::'),
+                   ('figure', '.. figure::'),
+                   ('literalinclude', '.. literalinclude::'),
+                   ('include', '.. include::'),
+                   )
+_ROLE_TAGS = (('ref', ':ref:'),
+              ('doc', ':doc:'),
+              ('download', ':download:'),
+              )
+_TOCTREE_TAG = '.. toctree::'
+_RST_ONLY_KINDS = ('toctree', 'ref', 'doc')     # references to rst files without extension
+REFERENCE_KINDS = tuple(kind for kind, _ in _DIRECTIVE_TAGS) + ('toctree',) + tuple(kind for kind, _ in _ROLE_TAGS)
+
+
+def extract_references(rstcontents):
+    """ Given rstcontents (the list of lines of a rst file) it returns the list of Reference
+        found on it, sorted by line and column.
+
+        It walks rstcontents just once and it is target agnostic: any number of targets can
+        be answered from the result (see reference_path() and index_references())
+
+        References can be:
+          - after a figure::, image::, literalinclude:: or include::
+          - on a toctree
+          - after a :ref:, :doc: or :download: (including the <> variant that can appear
+            splitted in more than one line)
+    """
+    references = list()
+    reference_splitted = dict.fromkeys((kind for kind, _ in _ROLE_TAGS), False)
+    toctree_indentation = None  # minimum indentation for items in the current toctree if any
+    for nr, line in enumerate(rstcontents):
+        found = list()
+        if toctree_indentation is not None and line.strip():
+            entry = extract_toctree_entry(line, toctree_indentation)
+            if entry is None:
+                toctree_indentation = None  # end of this toctree
+            elif entry[1]:
+                found.append(('toctree',) + entry)
+        if toctree_indentation is None:
+            pos_tag = line.find(_TOCTREE_TAG)
+            if pos_tag >= 0:
+                toctree_indentation = pos_tag + 1   # toctree refs should present at least this indentation
+        for kind, tag in _DIRECTIVE_TAGS:
+            reference = extract_directive_reference(tag, line)
+            if reference:
+                found.append((kind,) + reference)
+        for kind, tag in _ROLE_TAGS:
+            reference_splitted[kind], role_references = extract_role_references(tag,
+                                                                               reference_splitted[kind],
+                                                                               line)
+            found.extend((kind,) + reference for reference in role_references)
+        found.sort(key=lambda item: item[1])
+        references.extend(Reference(kind, nr, col, target) for kind, col, target in found)
+    return references
+
+
+def extract_toctree_entry(line, min_indentation):
+    """ given a non empty line within a toctree, it returns:
+        - None if the line has less indentation than min_indentation (i.e. the toctree is over)
+        - (pos, entry) otherwise, where entry is empty when the line is a toctree option
+    """
+    pos = len(line) - len(line.lstrip())
+    if pos < min_indentation:
+        return None
+    entry = line.strip()
+    if entry.startswith(':'):
+        entry = ''  # toctree options like :maxdepth: are not references
+    return pos, entry
+
+
+def extract_directive_reference(tag, line):
+    """ given a directive tag (e.g. '.. image::' or '.. figure::' it returns
+        the pair (pos, target) with the target of the directive in line, or None
+        if the line doesn't contain such a directive.
 
         Note: As an unconfortable curiosity, the following contents are valid in Sphinx:
             .. figure::
@@ -193,57 +1171,151 @@ def check_for_image_tag(tag, rstcontents, src, accept_absolute = True):
                :align: center
 
         For simplicity, this version of the script doesn't contemplate this case.
-
-        The function returns a list of pairs of change localization
     """
-    target = str(src)
-    changes = []
-    for nr, line in enumerate(rstcontents):
-        if tag not in line:
-            continue
-        pos_tag = line.find(tag)
-        if line[:pos_tag].strip():
-            continue    # it's not a real tag probably within a comment
-        pos_target = line.find(target, pos_tag)
-        if pos_target < 0:
-            continue    # a reference to another figure
-        contents_between_tag_and_target = line[pos_tag + len(tag):pos_target].strip()
-        if contents_between_tag_and_target:
-            if not accept_absolute or contents_between_tag_and_target != '/':
-                continue    # there's something more before the tag.
-        if line[pos_target+len(target):].strip():
-            continue    # there's something more after the tag
-        changes.append((nr, pos_target))
-    return changes
-
-def check_line_for_caption(line, target):
-    """ checks for <target> in line
+    pos_tag = line.find(tag)
+    if pos_tag < 0:
+        return None
+    if line[:pos_tag].strip():
+        return None     # it's not a real tag probably within a comment
+    rest_of_line = line[pos_tag + len(tag):]
+    target = rest_of_line.strip()
+    if not target or target.startswith('<'):
+        return None     # e.g. .. include:: <isonum.txt> from the standard library of docutils
+    return pos_tag + len(tag) + len(rest_of_line) - len(rest_of_line.lstrip()), target
 
-        IMPORTANT: '<' cannot appear within the caption text
 
+def extract_role_references(tag, reference_splitted, line):
+    """ looks for the references of a role like :ref:, :doc: or :download: in line.
+        These roles allow the following variants:
+        - :ref:`objectwithoutextension`
+        - :ref:`text for caption <objectwithoutextension>`
+        When object appears within <>, it can appear splitted from the tag line. e.g.
+            :ref:`a ref
+            with
+            a caption <target>`
+        It works in two different ways depending on the value of reference_splitted:
+        - False: it expects to find the tag
+        - True: the tag was found in a previous line, so it looks just for the <target>
+        IMPORTANT: '<' cannot appear within the caption text
         It returns:
-        - if the reference is still splitted (no reference found)
-        - the position where the target has been found (-1 if not found)
-        - the position where to keep looking for further references
+        - if the reference is still splitted at the end of the line
+        - a list of pairs (pos, target) with the references found in the line
     """
-    pos_init_caption = line.find('<')
-    if pos_init_caption < 0:
-        reference_splitted = True
-        target_pos = -1
-        next_pos = len(line)
-    else:
-        reference_splitted = False
-        pos_end_caption = line.find('>')
-        assert pos_init_caption < pos_end_caption, "malformed rst on line %s" % line
-        reference = line[pos_init_caption + 1: pos_end_caption]
-        if reference == target:
-            target_pos = pos_init_caption + 1
+    references = list()
+    pos = 0
+    while 0 <= pos < len(line):
+        if reference_splitted:
+            pos_open = line.find('<', pos)
+            if pos_open < 0:
+                break
+            reference_splitted = False
+            pos_close = line.find('>', pos_open + 1)
+            if pos_close < 0:
+                break   # malformed rst
+            references.append((pos_open + 1, line[pos_open + 1:pos_close]))
+            pos = pos_close + 2     # counting '>`'
+            continue
+
+        pos_tag = line.find(tag, pos)
+        if pos_tag < 0:
+            break
+        pos_open_tag = line.find('`', pos_tag)
+        if pos_open_tag < 0:
+            break
+        pos_close_tag = line.find('`', pos_open_tag + 1)
+        if pos_close_tag < 0:
+            reference_splitted = True   # the target will appear in a further line
+            break
+        tag_content = line[pos_open_tag + 1:pos_close_tag]
+        pos_open = tag_content.find('<')
+        if pos_open < 0:
+            references.append((pos_open_tag + 1, tag_content))
         else:
-            target_pos = -1
-        next_pos = pos_end_caption + 2 # counting '>`'
-    return reference_splitted, target_pos, next_pos
+            pos_close = tag_content.find('>', pos_open + 1)
+            if pos_close >= 0:
+                references.append((pos_open_tag + pos_open + 2, tag_content[pos_open + 1:pos_close]))
+        pos = pos_close_tag + 1
+    return reference_splitted, references
+
+
+def split_reference(reference):
+    """ given a Reference, it returns the triplet (path, col, absolute) where:
+        - path: is the str of the path as it is written, without the '/' at the beginning that
+          makes it absolute and with the .rst extension on references that go without it
+        - col: the position within the line where the path (as written in the rst) starts
+        - absolute: True when the path is written relative to the source root (i.e. starting
+          with '/') instead of relative to the folder of the document
+    """
+    target, col = reference.target, reference.col
+    absolute = target.startswith('/')
+    if absolute:
+        target, col = target[1:], col + 1
+    if reference.kind in _RST_ONLY_KINDS and not (reference.kind == 'toctree' and target.endswith('.rst')):
+        target += '.rst'
+    return target, col, absolute
+
+
+# The paths written in the documents of a folder are translated to paths relative to the source
+# root (and back) once and kept in bounded caches, so translating them again is mostly a lookup
+_PATH_CACHE_SIZE = 1 << 16  # paths resolved and spelled kept, so the same ones aren't computed again
+
+def resolve_reference(reference, folder=''):
+    """ given a Reference found in a document within folder (str relative to the source root, ''
+        for the root itself), it returns the pair (path, col) where:
+        - path: is the normalized str of the path referenced, relative to the source root
+        - col: the position within the line where the path (as written in the rst) starts
+    """
+    written, col, absolute = split_reference(reference)
+    return _join_path('' if absolute else folder, written), col
+
+@functools.lru_cache(maxsize=_PATH_CACHE_SIZE)
+def _join_path(folder, written):
+    return posixpath.normpath(posixpath.join(folder, written))
+
+@functools.lru_cache(maxsize=_PATH_CACHE_SIZE)
+def spell_path(path, folder):
+    """ returns how path (str relative to the source root) is written in a document within folder
+        (str relative to the source root, '' for the root itself) """
+    return posixpath.relpath(path, folder or '.')
+
+def clear_path_caches():
+    """ forgets the paths resolved and spelled so far (see resolve_reference() and spell_path()),
+        e.g. when the folders of a long running process change """
+    _join_path.cache_clear()
+    spell_path.cache_clear()
+
+def document_folder(rstpath, base_folder):
+    """ returns the str folder of rstpath (absolute) relative to base_folder ('' for base_folder) """
+    folder = rstpath.parent.relative_to(base_folder).as_posix()
+    return '' if folder == '.' else folder
+
+_UNCHECKABLE_TARGET = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*:|.*[*?\[<]')
+_GENERATED_DOCUMENTS = frozenset(('self', 'genindex', 'modindex', 'search'))  # toctree entries Sphinx provides
+
+def is_checkable(reference):
+    """ returns True when the target of reference can be checked as a path. It is not the case of:
+        - urls (e.g. .. image:: https://example.org/logo.png)
+        - glob patterns (e.g. in a toctree with :glob: or .. image:: logo.*)
+        - the 'self' entry, the documents generated by Sphinx (genindex, modindex and search) and
+          the entries with an explicit title of a toctree """
+    if reference.kind == 'toctree' and reference.target in _GENERATED_DOCUMENTS:
+        return False
+    return _UNCHECKABLE_TARGET.match(reference.target) is None
+
+def reference_path(reference):
+    """ given a Reference found in a document at the source root, it returns the pair (path, col)
+        where path is relative to the source root (see resolve_reference()) """
+    return resolve_reference(reference)
 
 
+def index_references(references):
+    """ given a list of Reference, it returns a dict { path: list of pairs (line, pos) }
+        with the positions where each path is referenced """
+    index = dict()
+    for reference in references:
+        path, col = reference_path(reference)
+        index.setdefault(path, list()).append((reference.line, col))
+    return index
 
 
 def check_rst_references(rstcontents, src):
@@ -268,20 +1340,194 @@ def check_rst_references(rstcontents, src):
           - after a :ref: (only for .rst including the <> variant) (without .rst extension)
           - after a :doc: (only for .rst including the <> variant) (without .rst extension)
           - after a literalinclude::
+          - after a include::
           - after a :download: (including the <> variant)
+
+        When more than one target must be checked on the same contents, consider
+        using extract_references() and index_references() instead
+    """
+    return index_references(extract_references(rstcontents)).get(str(src), list())
+
+
+####################################################################################################
+#   Profiling
+####################################################################################################
+# Profiling is enabled by replacing some functions of this module by instrumented versions, so
+# when it is disabled the functions run exactly as they are, without any check or counter.
+
+PROFILE_PHASES = ('enumeration', 'reading', 'prefilter', 'scanning', 'expansion', 'writing')
+PROFILE_COUNTERS = ('files enumerated', 'files read', 'bytes read', 'prefilter hits', 'prefilter misses',
+                    'lines visited')
+
+_profile = None     # Profile collecting the counters while profiling is enabled
+_unprofiled = dict()    # { name: original function } of the functions replaced while profiling
+
+class Profile:
+    """ Counters of the work done while profiling is enabled:
+        - counters: { counter: value } (see PROFILE_COUNTERS)
+        - phases: { phase: seconds } (see PROFILE_PHASES)
+        - scanners: { scanner function name: [calls, seconds] }
+        - slowest: list of (seconds, rstpath) of the slowest files to scan (at most top of them)
     """
-    result = dict()
-    changes = list()    # list of changes
-    for function in (look_for_images,
-                     look_for_figures,
-                     look_for_literalinclude,
-                     look_for_toctrees,
-                     look_for_ref,
-                     look_for_doc,
-                     look_for_dowmload,
-                     ):
-        changes += function(rstcontents, src)
-    return changes
+
+    def __init__(self, top=10):
+        self.top = top
+        self.counters = dict.fromkeys(PROFILE_COUNTERS, 0)
+        self.phases = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.scanners = dict()
+        self.slowest = list()   # min-heap, so the fastest of the slowest files is replaced first
+        self._lock = threading.Lock()
+
+    def count(self, counter, value=1, phase=None, seconds=0.0):
+        """ adds value to counter and seconds to phase, if provided (it can be called from any thread) """
+        with self._lock:
+            self.counters[counter] += value
+            if phase is not None:
+                self.phases[phase] += seconds
+
+    def add_time(self, phase, seconds):
+        """ adds seconds to phase (it can be called from any thread) """
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def add_file(self, rstpath, seconds):
+        """ takes into account that rstpath took seconds to be scanned """
+        entry = (seconds, str(rstpath))
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def merge(self, other):
+        """ adds the counters of other (Profile) to this profile """
+        for counter, value in other.counters.items():
+            self.counters[counter] += value
+        for phase, seconds in other.phases.items():
+            self.phases[phase] += seconds
+        for name, (calls, seconds) in other.scanners.items():
+            totals = self.scanners.setdefault(name, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+        for seconds, rstpath in other.slowest:
+            self.add_file(rstpath, seconds)
+
+    def report(self, base_folder=None):
+        """ returns the text with the report of the counters.
+            When base_folder is provided, the paths are shown relative to it """
+        lines = ["Profile", "  Counters"]
+        lines.extend("    %-20s %12d" % (counter, value) for counter, value in self.counters.items())
+        lines.append("  Phases (seconds)")
+        lines.extend("    %-20s %12.4f" % (phase, seconds) for phase, seconds in self.phases.items())
+        lines.append("  Scanners (calls, seconds)")
+        lines.extend("    %-30s %10d %12.4f" % (name, calls, seconds)
+                     for name, (calls, seconds) in sorted(self.scanners.items()))
+        lines.append("  Slowest files (seconds)")
+        for seconds, rstpath in sorted(self.slowest, reverse=True):
+            if base_folder is not None:
+                rstpath = os.path.relpath(rstpath, base_folder)
+            lines.append("    %12.4f %s" % (seconds, rstpath))
+        return "\n".join(lines)
+
+    def __getstate__(self):     # profiles of worker processes are sent back to be merged
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def enable_profiling(top=10):
+    """ starts profiling and returns the Profile where the counters will be collected.
+        top is the number of slowest files to be kept """
+    global _profile
+    if _profile is None:
+        replacements = {
+            '_list_folder': _profiled_list_folder,
+            'scan_file': _profiled_scan_file,
+            'extract_references': _profiled_extract_references,
+            'extract_toctree_entry': _profiled_scanner(extract_toctree_entry),
+            'extract_directive_reference': _profiled_scanner(extract_directive_reference),
+            'extract_role_references': _profiled_scanner(extract_role_references),
+        }
+        for name, function in replacements.items():
+            _unprofiled[name] = globals()[name]
+            globals()[name] = function
+        _unprofiled['MultiMatcher.occurs_in'] = MultiMatcher.occurs_in
+        MultiMatcher.occurs_in = _profiled_occurs_in
+    _profile = Profile(top)
+    return _profile
+
+def disable_profiling():
+    """ stops profiling and returns the Profile with the collected counters (None if not enabled) """
+    global _profile
+    profile, _profile = _profile, None
+    if profile is not None:
+        MultiMatcher.occurs_in = _unprofiled.pop('MultiMatcher.occurs_in')
+        globals().update(_unprofiled)
+        _unprofiled.clear()
+    return profile
+
+def profile_phase(phase):
+    """ returns a context manager that adds the time spent within it to phase when profiling """
+    if _profile is None:
+        return contextlib.nullcontext()
+    return _timed_phase(_profile, phase)
+
+@contextlib.contextmanager
+def _timed_phase(profile, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_time(phase, time.perf_counter() - start)
+
+def _profiled_list_folder(folder, suffix, pruned, snapshot=None):
+    start = time.perf_counter()
+    files, subfolders = _unprofiled['_list_folder'](folder, suffix, pruned, snapshot)
+    _profile.count('files enumerated', len(files), 'enumeration', time.perf_counter() - start)
+    return files, subfolders
+
+def _profiled_scan_file(rstpath, known_digest=None, retain=None, prefilter=None, base_folder=None):
+    profile = _profile
+    inner = profile.phases['prefilter'] + profile.phases['scanning']
+    start = time.perf_counter()
+    result = _unprofiled['scan_file'](rstpath, known_digest, retain, prefilter, base_folder)
+    seconds = time.perf_counter() - start
+    inner = profile.phases['prefilter'] + profile.phases['scanning'] - inner
+    profile.count('files read', 1, 'reading', seconds - inner)     # the rest of the time is reading
+    profile.count('bytes read', rstpath.stat().st_size)
+    profile.add_file(rstpath, seconds)
+    return result
+
+def _profiled_extract_references(rstcontents):
+    start = time.perf_counter()
+    references = _unprofiled['extract_references'](rstcontents)
+    _profile.count('lines visited', len(rstcontents), 'scanning', time.perf_counter() - start)
+    return references
+
+def _profiled_occurs_in(self, data):
+    start = time.perf_counter()
+    found = _unprofiled['MultiMatcher.occurs_in'](self, data)
+    _profile.count('prefilter hits' if found else 'prefilter misses', 1, 'prefilter', time.perf_counter() - start)
+    return found
+
+def _profiled_scanner(function):
+    """ returns function instrumented to count its calls and the time spent on it """
+    name = function.__name__
+
+    def profiled(*args):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        totals = _profile.scanners.get(name)
+        if totals is None:
+            totals = _profile.scanners[name] = [0, 0.0]
+        totals[0] += 1
+        totals[1] += seconds
+        return result
+    return profiled
 
 
 if __name__ == "__main__":
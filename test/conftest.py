@@ -0,0 +1,17 @@
+"""
+    pytest: fixtures shared by the tests
+"""
+import pytest
+
+####################################################################################################
+
+@pytest.fixture
+def project(tmp_path):
+    """ creates in tmp_path (and returns it) a mini project where index.rst has a toctree with
+        chapter.rst and an image object.png, chapter.rst downloads object.png and references index.rst,
+        and unused.png is not referenced """
+    (tmp_path / 'index.rst').write_text("Index\n\n.. toctree::\n\n   chapter\n\n.. image:: object.png\n")
+    (tmp_path / 'chapter.rst').write_text("Chapter\n\nSee :download:`object.png` and :doc:`index`\n")
+    (tmp_path / 'object.png').write_text("")
+    (tmp_path / 'unused.png').write_text("")
+    return tmp_path
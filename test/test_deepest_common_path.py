@@ -84,3 +84,29 @@ def test_a_bunch_of_dirs_and_files(monkeypatch):
     obtained = deepest_common_path(paths)
     assert expected == obtained
 
+
+def test_classified_paths(monkeypatch):
+    def fail(path):
+        raise AssertionError("is_dir() called on %s" % path)
+
+    paths = [(pathlib.Path('/a/b/c'), True),
+             (pathlib.Path('/a/b/c/d/file1.txt'), False),
+             (pathlib.Path('/a/b/c/file2.txt'), False),
+             ]
+    monkeypatch.setattr(pathlib.Path, 'is_dir', fail)
+    expected = pathlib.Path('/a/b/c')
+    obtained = deepest_common_path(paths)
+    assert expected == obtained
+
+def test_stream_stops_at_the_root():
+    consumed = list()
+
+    def paths():
+        for path in ('/a/file1.txt', '/b/file2.txt', '/c/file3.txt'):
+            consumed.append(path)
+            yield pathlib.Path(path), False
+
+    expected = pathlib.Path('/')
+    obtained = deepest_common_path(paths())
+    assert expected == obtained
+    assert ['/a/file1.txt', '/b/file2.txt'] == consumed
@@ -1,46 +1,9 @@
 """
     pytest: tests the functioning of rst_rename.expand_changes_on_contents()
 """
-from rst_rename import expand_changes_on_contents, create_representation, _HIGHLIGHT_ESCAPE, _STANDARD_SCAPE
-
-####################################################################################################
-
-def test_create_repr_when_basic():
-    srcline = "object.png"
-    dstline = "renamed.png"
-    src = "object.png"
-    dst = "renamed.png"
-    expected = "%srenamed%s.png" % (_HIGHLIGHT_ESCAPE, _STANDARD_SCAPE)
-    obtained = create_representation(srcline, dstline, src, dst)
-    assert expected == obtained
-
-def test_create_repr_when_same_folder():
-    srcline = "_img/object.png"
-    dstline = "_img/renamed.png"
-    src = "_img/object.png"
-    dst = "_img/renamed.png"
-    expected = "_img/%srenamed%s.png" % (_HIGHLIGHT_ESCAPE, _STANDARD_SCAPE)
-    obtained = create_representation(srcline, dstline, src, dst)
-    assert expected == obtained
-
-def test_create_repr_when_different_folder():
-    srcline = "_img/object.png"
-    dstline = "_imgage/renamed.png"
-    src = "_img/object.png"
-    dst = "_imgage/renamed.png"
-    expected = "_img%sage/renamed%s.png" % (_HIGHLIGHT_ESCAPE, _STANDARD_SCAPE)
-    obtained = create_representation(srcline, dstline, src, dst)
-    assert expected == obtained
-
-def test_create_repr_when_different_folder_same_name():
-    srcline = "_img/object.png"
-    dstline = "_imgage/object.png"
-    src = "_img/object.png"
-    dst = "_imgage/object.png"
-    expected = "_img%sage%s/object.png" % (_HIGHLIGHT_ESCAPE, _STANDARD_SCAPE)
-    obtained = create_representation(srcline, dstline, src, dst)
-    assert expected == obtained
-
+import io
+from pathlib import Path
+from rst_rename import expand_changes_on_contents, show_changes, _HIGHLIGHT_ESCAPE, _STANDARD_SCAPE
 
 ####################################################################################################
 
@@ -68,10 +31,10 @@ def test_basic_change():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 def test_basic_change_with_shorter_renamed():
     contents = ["objectwithlongname.png"]
@@ -86,10 +49,10 @@ def test_basic_change_with_shorter_renamed():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 
 def test_download_change():
@@ -105,10 +68,10 @@ def test_download_change():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 def test_rst_with_extension():
     contents = ["   object.rst"]
@@ -123,10 +86,10 @@ def test_rst_with_extension():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 
 def test_rst_without_extension():
@@ -142,10 +105,10 @@ def test_rst_without_extension():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 
 def test_rst_ref_without_caption():
@@ -161,10 +124,10 @@ def test_rst_ref_without_caption():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 
 def test_rst_ref_with_caption():
@@ -180,10 +143,10 @@ def test_rst_ref_with_caption():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 
 def test_basic_change_with_same_path():
@@ -199,10 +162,10 @@ def test_basic_change_with_same_path():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 
 def test_basic_change_with_different_path():
@@ -218,10 +181,10 @@ def test_basic_change_with_different_path():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
 
 
 def test_basic_change_with_different_path_but_same_name():
@@ -237,8 +200,23 @@ def test_basic_change_with_different_path_but_same_name():
     }]
     obtained = expand_changes_on_contents(contents, changes, src, dst)
     assert 1 == len(obtained)
-    assert expected[0]['linenr'] == obtained[0]['linenr']
-    assert expected[0]['src'] == obtained[0]['src']
-    assert expected[0]['dst'] == obtained[0]['dst']
-    assert expected[0]['repr'] == obtained[0]['repr']
-
+    assert expected[0]['linenr'] == obtained[0].linenr
+    assert expected[0]['src'] == obtained[0].src
+    assert expected[0]['dst'] == obtained[0].dst
+    assert expected[0]['repr'] == obtained[0].repr
+
+
+
+def test_changes_keep_the_original_line():
+    contents = ["first object.png\n", "second object.png\n"]
+    obtained = expand_changes_on_contents(contents, [(1, 7)], 'object.png', 'renamed.png')
+    assert contents[1] is obtained[0].src
+    assert "second renamed.png\n" == obtained[0].dst
+
+def test_show_changes():
+    contents = ["first object.png\n"]
+    changes = {Path('/doc/index.rst'): (contents, expand_changes_on_contents(contents, [(0, 6)], 'object.png', 'x.png'))}
+    out = io.StringIO()
+    show_changes(changes, Path('/doc'), out)
+    expected = "index.rst\n[0];\tfirst object.png\n\tfirst %sx%s.png\n\n" % (_HIGHLIGHT_ESCAPE, _STANDARD_SCAPE)
+    assert expected == out.getvalue()
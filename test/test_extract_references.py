@@ -0,0 +1,120 @@
+"""
+    pytest: tests the functioning of rstutils.extract_references()
+"""
+from rstutils import extract_references, index_references, reference_path, resolve_reference, spell_path, Reference
+
+####################################################################################################
+
+def test_when_no_references():
+    contents = ["something that contains objects.png", "but not as a reference"]
+    expected = []
+    obtained = extract_references(contents)
+    assert expected == obtained
+
+def test_all_directives():
+    contents = [".. image:: object.png",
+                "   :align: center",
+                ".. figure:: /_img/figure.png",
+                "",
+                ".. literalinclude:: code/program.java",
+                ".. include:: parts/common.rst",
+                ".. include:: <isonum.txt>",
+                ]
+    expected = [Reference('image', 0, 11, 'object.png'),
+                Reference('figure', 2, 12, '/_img/figure.png'),
+                Reference('literalinclude', 4, 20, 'code/program.java'),
+                Reference('include', 5, 13, 'parts/common.rst'),
+                ]
+    obtained = extract_references(contents)
+    assert expected == obtained
+
+def test_toctree_entries_without_options():
+    contents = ["   .. toctree::  ",
+                "      :maxdepth: 1",
+                "",
+                "      first.rst",
+                "      second",
+                "",
+                "other things",
+                "      third",
+                ]
+    expected = [Reference('toctree', 3, 6, 'first.rst'),
+                Reference('toctree', 4, 6, 'second'),
+                ]
+    obtained = extract_references(contents)
+    assert expected == obtained
+
+def test_consecutive_toctrees():
+    contents = [".. toctree::",
+                "",
+                "   first",
+                ".. toctree::",
+                "",
+                "   second",
+                ]
+    expected = [Reference('toctree', 2, 3, 'first'),
+                Reference('toctree', 5, 3, 'second'),
+                ]
+    obtained = extract_references(contents)
+    assert expected == obtained
+
+def test_roles_sorted_by_position():
+    contents = ["and a :doc:`with caption<object>` and :ref:`label` and :download:`file.tar.gz` that",
+                ]
+    expected = [Reference('doc', 0, 25, 'object'),
+                Reference('ref', 0, 44, 'label'),
+                Reference('download', 0, 66, 'file.tar.gz'),
+                ]
+    obtained = extract_references(contents)
+    assert expected == obtained
+
+def test_roles_with_splitted_caption():
+    contents = ["and a :ref:`with ",
+                "caption ",
+                "<object>` that :doc:`another` and :download:`another",
+                "splitted caption <object.tar.gz>` that",
+                ]
+    expected = [Reference('ref', 2, 1, 'object'),
+                Reference('doc', 2, 21, 'another'),
+                Reference('download', 3, 18, 'object.tar.gz'),
+                ]
+    obtained = extract_references(contents)
+    assert expected == obtained
+
+def test_malformed_caption_is_ignored():
+    contents = ["a :doc:`caption <without end` and :doc:`object`"]
+    expected = [Reference('doc', 0, 40, 'object')]
+    obtained = extract_references(contents)
+    assert expected == obtained
+
+####################################################################################################
+
+def test_reference_path_normalization():
+    assert ('object.png', 12) == reference_path(Reference('image', 0, 11, '/object.png'))
+    assert ('object.rst', 6) == reference_path(Reference('toctree', 0, 6, 'object'))
+    assert ('object.rst', 6) == reference_path(Reference('toctree', 0, 6, 'object.rst'))
+    assert ('object.rst', 6) == reference_path(Reference('doc', 0, 6, 'object'))
+    assert ('object.tar.gz', 6) == reference_path(Reference('download', 0, 6, 'object.tar.gz'))
+
+def test_index_answers_many_targets():
+    contents = [".. image:: object.png",
+                "see :doc:`object` and :doc:`other <another>`",
+                ]
+    expected = {'object.png': [(0, 11)],
+                'object.rst': [(1, 10)],
+                'another.rst': [(1, 35)],
+                }
+    obtained = index_references(extract_references(contents))
+    assert expected == obtained
+
+def test_resolve_reference_from_a_folder():
+    assert ('img/a.png', 11) == resolve_reference(Reference('image', 0, 11, '../img/a.png'), 'chapter')
+    assert ('img/a.png', 12) == resolve_reference(Reference('image', 0, 11, '/img/a.png'), 'chapter')
+    assert ('chapter/img/a.png', 11) == resolve_reference(Reference('image', 0, 11, 'img/a.png'), 'chapter')
+    assert ('intro.rst', 7) == resolve_reference(Reference('doc', 0, 6, '/intro'), 'chapter/sub')
+    assert ('chapter/intro.rst', 6) == resolve_reference(Reference('doc', 0, 6, 'sub/../intro'), 'chapter')
+
+def test_spell_path():
+    assert '../img/a.png' == spell_path('img/a.png', 'chapter')
+    assert 'img/a.png' == spell_path('img/a.png', '')
+    assert 'a.png' == spell_path('chapter/a.png', 'chapter')
@@ -0,0 +1,46 @@
+"""
+    pytest: tests the functioning of rstutils.FsSnapshot
+"""
+import os
+import pathlib
+from rstutils import FsSnapshot, walk_files, deepest_common_path
+
+####################################################################################################
+
+def create_tree(folder):
+    for name in ('index.rst', 'img/a.png', 'img/sub/b.png'):
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    os.symlink(folder / 'img', folder / 'link')
+    os.symlink(folder / 'missing.png', folder / 'broken.png')
+
+
+def test_questions_about_paths(tmp_path):
+    create_tree(tmp_path)
+    snapshot = FsSnapshot()
+    for path in (tmp_path / 'index.rst', tmp_path / 'img', tmp_path / 'link', tmp_path / 'broken.png',
+                 tmp_path / 'img' / 'sub' / 'b.png', tmp_path / 'none.png', tmp_path / 'none' / 'a.png',
+                 pathlib.Path('/')):
+        assert path.exists() == snapshot.exists(path)
+        assert path.is_dir() == snapshot.is_dir(path)
+        assert path.is_file() == snapshot.is_file(path)
+        assert path.is_symlink() == snapshot.is_symlink(path)
+    assert (tmp_path / 'index.rst').stat().st_ino == snapshot.stat(tmp_path / 'index.rst').st_ino
+    assert snapshot.stat(tmp_path / 'broken.png') is None
+    assert sorted((tmp_path / 'img').iterdir()) == snapshot.iterdir(tmp_path / 'img')
+
+def test_folders_are_listed_once(tmp_path):
+    create_tree(tmp_path)
+    snapshot = FsSnapshot()
+    expected = list(walk_files(tmp_path))
+    assert expected == list(walk_files(tmp_path, snapshot=snapshot))
+    (tmp_path / 'img' / 'new.png').write_text("")
+    assert expected == list(walk_files(tmp_path, snapshot=snapshot))
+    assert not snapshot.exists(tmp_path / 'img' / 'new.png')
+
+def test_deepest_common_path_from_snapshot(tmp_path):
+    create_tree(tmp_path)
+    snapshot = FsSnapshot()
+    paths = [tmp_path / 'img' / 'sub', tmp_path / 'img' / 'a.png']
+    assert tmp_path / 'img' == deepest_common_path(paths, snapshot.is_dir)
@@ -0,0 +1,52 @@
+"""
+    pytest: tests the functioning of rstutils.iter_references()
+"""
+import itertools
+
+from rstutils import iter_references, is_referenced
+
+####################################################################################################
+
+def create_project(folder):
+    (folder / 'a.rst').write_text("A\n\n.. image:: img/object.png\n")
+    (folder / 'index.rst').write_text("Index\n\n.. toctree::\n\n   a\n\nSee :download:`img/object.png`\n")
+    (folder / 'img').mkdir()
+    (folder / 'img' / 'object.png').write_text("")
+    (folder / 'img' / 'unused.png').write_text("")
+    (folder / 'img' / 'gallery.rst').write_text("Gallery\n\n.. figure:: /img/object.png\n")
+
+
+def test_references_in_likelihood_order(tmp_path):
+    create_project(tmp_path)
+    expected = [(tmp_path / 'img' / 'gallery.rst', 2, 13, 'figure'),
+                (tmp_path / 'index.rst', 6, 15, 'download'),
+                (tmp_path / 'a.rst', 2, 11, 'image'),
+                ]
+    obtained = list(iter_references(tmp_path, tmp_path / 'img' / 'object.png'))
+    assert expected == obtained
+
+def test_references_to_a_folder(tmp_path):
+    create_project(tmp_path)
+    obtained = list(iter_references(tmp_path, 'img'))
+    assert 3 == len(obtained)
+
+def test_files_are_read_lazily(tmp_path):
+    create_project(tmp_path)
+    references = iter_references(tmp_path, 'img/object.png')
+    assert 1 == len(list(itertools.islice(references, 1)))
+    (tmp_path / 'a.rst').unlink()   # the last file to be visited
+    assert (tmp_path / 'index.rst', 6, 15, 'download') == next(references)
+
+def test_is_referenced(tmp_path):
+    create_project(tmp_path)
+    assert is_referenced(tmp_path, tmp_path / 'img' / 'object.png')
+    assert is_referenced(tmp_path, 'a.rst')
+    assert not is_referenced(tmp_path, 'img/unused.png')
+
+def test_references_to_a_folder_from_within(tmp_path):
+    (tmp_path / 'img').mkdir()
+    (tmp_path / 'img' / 'a.png').write_text("")
+    (tmp_path / 'img' / 'gallery.rst').write_text("Gallery\n\n.. image:: a.png\n")
+    expected = [(tmp_path / 'img' / 'gallery.rst', 2, 11, 'image')]
+    assert expected == list(iter_references(tmp_path, tmp_path / 'img'))
+    assert is_referenced(tmp_path, 'img')
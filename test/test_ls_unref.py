@@ -0,0 +1,71 @@
+"""
+    pytest: tests the functioning of rst_ls_unref
+"""
+import json
+
+import rstutils
+from rst_ls_unref import check_unreferenced, iter_unreferenced, find_orphans, write_ndjson
+
+####################################################################################################
+
+def create_project(folder):
+    (folder / 'chapter').mkdir()
+    (folder / 'img' / 'sub').mkdir(parents=True)
+    (folder / 'index.rst').write_text(".. image:: img/a.png\n")
+    (folder / 'chapter' / 'intro.rst').write_text(".. image:: ../img/sub/c.png\n:download:`/img/b.png`\n")
+    for name in ('a.png', 'b.png', 'x.png', 'sub/c.png', 'sub/y.png', 'sub/z.png'):
+        (folder / 'img' / name).write_text("")
+
+
+def test_unreferenced_by_folder(tmp_path):
+    create_project(tmp_path)
+    expected = [(tmp_path / 'img', [tmp_path / 'img' / 'x.png']),
+                (tmp_path / 'img' / 'sub', [tmp_path / 'img' / 'sub' / 'y.png', tmp_path / 'img' / 'sub' / 'z.png']),
+                ]
+    obtained = list(iter_unreferenced([tmp_path / 'img'], tmp_path))
+    assert expected == obtained
+
+def test_state_files_are_not_unreferenced(tmp_path):
+    create_project(tmp_path)
+    (tmp_path / rstutils.JOURNAL_FILENAME).write_text("")
+    (tmp_path / rstutils.SOCKET_NAME).write_text("")
+    (tmp_path / (rstutils.CACHE_FILENAME + '-journal')).write_text("")
+    with rstutils.ReferenceCache.in_folder(tmp_path) as cache, rstutils.TrigramIndex.in_folder(tmp_path) as trigrams:
+        obtained = list(iter_unreferenced([tmp_path], tmp_path, cache, trigrams=trigrams))
+    assert (tmp_path, [tmp_path / 'index.rst']) == obtained[0]
+
+def test_check_unreferenced(tmp_path):
+    create_project(tmp_path)
+    paths = [tmp_path / 'img' / 'sub' / 'c.png', tmp_path / 'img' / 'sub' / 'y.png', tmp_path / 'img' / 'b.png']
+    assert [tmp_path / 'img' / 'sub' / 'y.png'] == check_unreferenced(paths, tmp_path)
+
+def test_check_unreferenced_single_file(tmp_path):
+    create_project(tmp_path)
+    assert [] == check_unreferenced([tmp_path / 'img' / 'sub' / 'c.png'], tmp_path)
+    assert [tmp_path / 'img' / 'x.png'] == check_unreferenced([tmp_path / 'img' / 'x.png'], tmp_path)
+
+def test_find_orphans(tmp_path):
+    create_project(tmp_path)
+    (tmp_path / 'index.rst').write_text(".. toctree::\n\n   chapter/intro\n\n.. include:: parts/common.rst\n")
+    (tmp_path / 'parts').mkdir()
+    (tmp_path / 'parts' / 'common.rst').write_text(".. image:: ../img/a.png\n")
+    (tmp_path / 'old.rst').write_text(":doc:`older`\n.. image:: img/x.png\n")
+    (tmp_path / 'older.rst').write_text(".. image:: img/sub/c.png\n.. image:: img/missing.png\n")
+    expected = [tmp_path / 'img' / 'sub' / 'y.png',
+                tmp_path / 'img' / 'x.png',
+                tmp_path / 'old.rst',
+                tmp_path / 'older.rst',
+                ]
+    obtained = find_orphans([tmp_path / 'img' / 'sub' / 'y.png'], tmp_path, tmp_path / 'index.rst')
+    assert expected == obtained
+
+def test_unreferenced_as_ndjson(tmp_path, capsys):
+    create_project(tmp_path)
+    options = {'paths': [tmp_path / 'img'], 'base_folder': tmp_path, 'orphans': False, 'jobs': 1}
+    expected = [{'type': 'unreferenced', 'path': 'img/x.png'},
+                {'type': 'unreferenced', 'path': 'img/sub/y.png'},
+                {'type': 'unreferenced', 'path': 'img/sub/z.png'},
+                {'type': 'summary', 'unreferenced': 3},
+                ]
+    write_ndjson(options)
+    assert expected == [json.loads(line) for line in capsys.readouterr().out.splitlines()]
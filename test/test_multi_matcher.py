@@ -0,0 +1,43 @@
+"""
+    pytest: tests the functioning of rstutils.MultiMatcher
+"""
+import pathlib
+from rstutils import MultiMatcher, prefilter_key
+
+####################################################################################################
+
+PATTERNS = ['he', 'she', 'his', 'hers', 'object.png', 'index', 'a', 'b', 'c']
+
+
+def test_prefilter_key():
+    assert 'object.png' == prefilter_key(pathlib.Path('img/object.png'))
+    assert 'chapter' == prefilter_key(pathlib.Path('docs/chapter.rst'))
+
+def test_search_overlapping_patterns():
+    matcher = MultiMatcher(PATTERNS)
+    expected = {'he', 'she', 'hers'}
+    obtained = matcher.search(b'ushers')
+    assert expected == obtained
+
+def test_search_pattern_within_a_longer_one():
+    matcher = MultiMatcher(PATTERNS)
+    expected = {'a', 'b', 'c', 'object.png'}
+    obtained = matcher.search(b'.. image:: /object.png')
+    assert expected == obtained
+
+def test_occurs_in():
+    matcher = MultiMatcher(PATTERNS)
+    assert matcher.occurs_in(b'see the index')
+    assert not matcher.occurs_in(b'nothing to look for')
+
+def test_same_result_with_few_patterns():
+    few = MultiMatcher(['object.png', 'index'])
+    many = MultiMatcher(['object.png', 'index'] + ['pattern%d' % nr for nr in range(20)])
+    for data in (b'', b'.. image:: object.png', b':doc:`index`', b'objectindex'):
+        assert few.search(data) == many.search(data) - set('pattern%d' % nr for nr in range(20))
+
+def test_for_targets():
+    matcher = MultiMatcher.for_targets(['img/object.png', 'chapter.rst'])
+    expected = ['chapter', 'object.png']
+    obtained = matcher.patterns
+    assert expected == obtained
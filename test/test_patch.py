@@ -0,0 +1,91 @@
+"""
+    pytest: tests the patches written by rst_rename instead of performing the renames
+"""
+import io
+import shutil
+import subprocess
+import pytest
+from rst_rename import iter_planned_renames, write_patch, patch_hunks, expand_edits_on_contents
+
+####################################################################################################
+
+def create_project(folder):
+    (folder / 'docs' / 'chapter').mkdir(parents=True)
+    (folder / 'docs' / 'index.rst').write_text("Index\n\n.. toctree::\n\n   chapter/intro\n")
+    (folder / 'docs' / 'chapter' / 'intro.rst').write_text(".. image:: ../a.png\n" + "text\n" * 10 +
+                                                           ":download:`/a.png`")
+    (folder / 'docs' / 'a.png').write_text("a")
+
+
+def test_hunks_share_close_changes():
+    lines = ["line %d\n" % nr for nr in range(20)]
+    changes = expand_edits_on_contents(lines, [(3, 0, 'line', 'LINE'), (9, 0, 'line', 'LINE'),
+                                               (17, 0, 'line', 'LINE')])
+    obtained = list(patch_hunks(lines, changes))
+    assert "@@ -1,13 +1,13 @@\n" == obtained[0]
+    assert ["-line 3\n", "+LINE 3\n"] == obtained[4:6]
+    assert "@@ -15,6 +15,6 @@\n" == obtained[16]
+    assert 24 == len(obtained)
+
+def test_patch_without_repository(tmp_path):
+    create_project(tmp_path)
+    base = tmp_path / 'docs'
+    renames = [(base / 'chapter' / 'intro.rst', base / 'intro.rst'), (base / 'a.png', base / 'img' / 'a.png')]
+    out = io.StringIO()
+    assert 3 == write_patch(iter_planned_renames(renames, base), renames, base, out)
+    expected = ("diff --git a/index.rst b/index.rst\n"
+                "--- a/index.rst\n"
+                "+++ b/index.rst\n"
+                "@@ -2,4 +2,4 @@\n"
+                " \n .. toctree::\n \n"
+                "-   chapter/intro\n"
+                "+   intro\n"
+                "diff --git a/chapter/intro.rst b/intro.rst\n"
+                "rename from chapter/intro.rst\n"
+                "rename to intro.rst\n"
+                "--- a/chapter/intro.rst\n"
+                "+++ b/intro.rst\n"
+                "@@ -1,4 +1,4 @@\n"
+                "-.. image:: ../a.png\n"
+                "+.. image:: img/a.png\n"
+                " text\n text\n text\n"
+                "@@ -9,4 +9,4 @@\n"
+                " text\n text\n text\n"
+                "-:download:`/a.png`\n\\ No newline at end of file\n"
+                "+:download:`/img/a.png`\n\\ No newline at end of file\n"
+                "diff --git a/a.png b/img/a.png\n"
+                "similarity index 100%\n"
+                "rename from a.png\n"
+                "rename to img/a.png\n")
+    assert expected == out.getvalue()
+    assert (base / 'chapter' / 'intro.rst').exists()
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="git is not available")
+def test_patch_applies_in_repository(tmp_path):
+    create_project(tmp_path)
+    for args in (['init', '-q'], ['add', '.']):
+        subprocess.run(['git'] + args, cwd=tmp_path, check=True)
+    base = tmp_path / 'docs'
+    renames = [(base / 'chapter', base / 'parts'), (base / 'a.png', base / 'b.png')]
+    with open(tmp_path / 'out.diff', 'w', newline='') as out:
+        write_patch(iter_planned_renames(renames, base), renames, base, out)
+    assert "diff --git a/docs/index.rst b/docs/index.rst\n" in (tmp_path / 'out.diff').read_text()
+    subprocess.run(['git', 'apply', '--index', 'out.diff'], cwd=tmp_path, check=True)
+    assert "Index\n\n.. toctree::\n\n   parts/intro\n" == (base / 'index.rst').read_text()
+    assert (base / 'parts' / 'intro.rst').read_text().startswith(".. image:: ../b.png\n")
+    assert "a" == (base / 'b.png').read_text()
+    assert not (base / 'a.png').exists()
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="git is not available")
+def test_patch_renames_symlinked_folders_as_files(tmp_path):
+    create_project(tmp_path)
+    (tmp_path / 'docs' / 'chapter' / 'images').symlink_to(tmp_path / 'docs', target_is_directory=True)
+    for args in (['init', '-q'], ['add', '.']):
+        subprocess.run(['git'] + args, cwd=tmp_path, check=True)
+    base = tmp_path / 'docs'
+    renames = [(base / 'chapter', base / 'parts')]
+    with open(tmp_path / 'out.diff', 'w', newline='') as out:
+        assert 3 == write_patch(iter_planned_renames(renames, base), renames, base, out)
+    assert "rename to docs/parts/images\n" in (tmp_path / 'out.diff').read_text()
+    subprocess.run(['git', 'apply', '--index', 'out.diff'], cwd=tmp_path, check=True)
+    assert (base / 'parts' / 'images').is_symlink()
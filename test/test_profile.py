@@ -0,0 +1,59 @@
+"""
+    pytest: tests the profiling counters of rstutils
+"""
+import pytest
+
+import rstutils
+
+####################################################################################################
+
+@pytest.fixture
+def project(project):
+    """ the shared project (see conftest.py) with a document that doesn't reference object.png """
+    (project / 'other.rst').write_text("Other\n")
+    return project
+
+
+def test_disabled_profiling_leaves_functions_untouched(tmp_path):
+    originals = (rstutils.scan_file, rstutils.extract_references, rstutils.MultiMatcher.occurs_in)
+    profile = rstutils.enable_profiling()
+    assert rstutils.scan_file is not originals[0]
+    assert profile is rstutils.disable_profiling()
+    assert originals == (rstutils.scan_file, rstutils.extract_references, rstutils.MultiMatcher.occurs_in)
+    assert rstutils.disable_profiling() is None
+
+def test_counters(project):
+    profile = rstutils.enable_profiling(top=2)
+    try:
+        rstutils.ReferenceGraph.build(project, targets=[project / 'object.png'])
+    finally:
+        rstutils.disable_profiling()
+    size = sum(path.stat().st_size for path in project.glob('*.rst'))
+    assert 3 == profile.counters['files enumerated']
+    assert 3 == profile.counters['files read']
+    assert size == profile.counters['bytes read']
+    assert 2 == profile.counters['prefilter hits']
+    assert 1 == profile.counters['prefilter misses']
+    assert 10 == profile.counters['lines visited']
+    assert 10 * len(rstutils._DIRECTIVE_TAGS) == profile.scanners['extract_directive_reference'][0]
+    assert 2 == len(profile.slowest)
+
+def test_counters_with_jobs(project):
+    profile = rstutils.enable_profiling()
+    try:
+        rstutils.ReferenceGraph.build(project, jobs=2)
+    finally:
+        rstutils.disable_profiling()
+    assert 3 == profile.counters['files read']
+    assert 11 == profile.counters['lines visited']
+    assert 3 == len(profile.slowest)
+
+def test_phase(tmp_path):
+    profile = rstutils.enable_profiling()
+    try:
+        with rstutils.profile_phase('writing'):
+            (tmp_path / 'a.rst').write_text("a")
+    finally:
+        rstutils.disable_profiling()
+    assert profile.phases['writing'] > 0
+    assert "writing" in profile.report(tmp_path)
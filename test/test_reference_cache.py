@@ -0,0 +1,51 @@
+"""
+    pytest: tests the functioning of rstutils.ReferenceCache
+"""
+import os
+import rstutils
+from rstutils import ReferenceCache, Reference
+
+####################################################################################################
+
+def test_references_are_extracted(tmp_path):
+    rstpath = tmp_path / 'index.rst'
+    rstpath.write_text("Index\n\n.. image:: object.png\n")
+    with ReferenceCache.in_folder(tmp_path) as cache:
+        expected = [Reference('image', 2, 11, 'object.png')]
+        obtained = cache.read_references(rstpath)
+    assert expected == obtained
+
+def test_unchanged_files_are_not_parsed_again(tmp_path, monkeypatch):
+    rstpath = tmp_path / 'index.rst'
+    rstpath.write_text("Index\n\n.. image:: object.png\n")
+    with ReferenceCache.in_folder(tmp_path) as cache:
+        cache.read_references(rstpath)
+    monkeypatch.setattr(rstutils, 'extract_references', lambda _: [])
+    with ReferenceCache.in_folder(tmp_path) as cache:
+        expected = [Reference('image', 2, 11, 'object.png')]
+        obtained = cache.read_references(rstpath)
+    assert expected == obtained
+
+def test_touched_files_with_same_contents_are_not_parsed_again(tmp_path, monkeypatch):
+    rstpath = tmp_path / 'index.rst'
+    rstpath.write_text("Index\n\n.. image:: object.png\n")
+    with ReferenceCache.in_folder(tmp_path) as cache:
+        cache.read_references(rstpath)
+    stat = rstpath.stat()
+    os.utime(rstpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    monkeypatch.setattr(rstutils, 'extract_references', lambda _: [])
+    with ReferenceCache.in_folder(tmp_path) as cache:
+        expected = [Reference('image', 2, 11, 'object.png')]
+        obtained = cache.read_references(rstpath)
+    assert expected == obtained
+
+def test_modified_files_are_parsed_again(tmp_path):
+    rstpath = tmp_path / 'index.rst'
+    rstpath.write_text("Index\n\n.. image:: object.png\n")
+    with ReferenceCache.in_folder(tmp_path) as cache:
+        cache.read_references(rstpath)
+    rstpath.write_text("Index\n\n.. figure:: another.png\n\n")
+    with ReferenceCache.in_folder(tmp_path) as cache:
+        expected = [Reference('figure', 2, 12, 'another.png')]
+        obtained = cache.read_references(rstpath)
+    assert expected == obtained
@@ -0,0 +1,101 @@
+"""
+    pytest: tests the functioning of rstutils.ReferenceGraph
+"""
+from rstutils import ReferenceGraph, read_references
+
+####################################################################################################
+
+def test_references_to_a_target(project):
+    graph = ReferenceGraph.build(project)
+    expected = {project / 'index.rst': [(6, 11)],
+                project / 'chapter.rst': [(2, 15)],
+                }
+    obtained = graph.references_to(project / 'object.png')
+    assert expected == obtained
+
+def test_references_to_a_relative_target(project):
+    graph = ReferenceGraph.build(project)
+    expected = {project / 'index.rst': [(4, 3)]}
+    obtained = graph.references_to('chapter.rst')
+    assert expected == obtained
+
+def test_is_referenced(project):
+    graph = ReferenceGraph.build(project)
+    assert graph.is_referenced(project / 'object.png')
+    assert graph.is_referenced(project / 'index.rst')
+    assert not graph.is_referenced(project / 'unused.png')
+    assert not graph.is_referenced(project / 'nonexistent.png')
+
+def test_targets_of_a_document(project):
+    graph = ReferenceGraph.build(project)
+    expected = [project / 'chapter.rst', project / 'object.png']
+    obtained = graph.targets_of(project / 'index.rst')
+    assert expected == obtained
+
+def test_files_are_interned(tmp_path):
+    graph = ReferenceGraph(tmp_path)
+    assert graph.file_id('a.rst') == graph.file_id(tmp_path / 'a.rst')
+    assert graph.file_id('a.rst') != graph.file_id('b.rst')
+    assert tmp_path / 'b.rst' == graph.path(graph.file_id('b.rst'))
+
+def test_same_graph_with_jobs(project):
+    for nr in range(20):
+        (project / ('doc%02d.rst' % nr)).write_text(".. image:: object.png\n" * nr)
+    expected = ReferenceGraph.build(project)
+    obtained = ReferenceGraph.build(project, jobs=3)
+    assert list(expected.documents()) == list(obtained.documents())
+    assert expected.forward == obtained.forward
+    assert expected.backward == obtained.backward
+
+def test_contents_of_documents_referencing_retained_targets(project):
+    graph = ReferenceGraph.build(project, retain=['chapter.rst'])
+    expected = {project / 'index.rst': (project / 'index.rst').read_text().splitlines(keepends=True)}
+    obtained = graph.contents
+    assert expected == obtained
+
+def test_targets_under_a_folder(tmp_path):
+    (tmp_path / 'index.rst').write_text(".. image:: img/a.png\n.. image:: img/sub/b.png\n.. image:: img2/c.png\n")
+    graph = ReferenceGraph.build(tmp_path)
+    expected = [tmp_path / 'img' / 'a.png', tmp_path / 'img' / 'sub' / 'b.png']
+    obtained = graph.targets_under(tmp_path / 'img')
+    assert expected == obtained
+def test_update_document(project):
+    graph = ReferenceGraph.build(project)
+    (project / 'chapter.rst').write_text("Chapter\n\n.. image:: unused.png\n")
+    graph.update_document(project / 'chapter.rst', read_references(project / 'chapter.rst'))
+    assert {project / 'index.rst': [(6, 11)]} == graph.references_to(project / 'object.png')
+    assert graph.is_referenced(project / 'unused.png')
+    assert not graph.is_referenced(project / 'index.rst')
+
+def test_remove_document(project):
+    graph = ReferenceGraph.build(project)
+    graph.remove_document(project / 'index.rst')
+    assert [project / 'chapter.rst'] == list(graph.documents())
+    assert not graph.is_referenced(project / 'chapter.rst')
+    assert {project / 'chapter.rst': [(2, 15)]} == graph.references_to(project / 'object.png')
+
+def test_rename_edits(project):
+    graph = ReferenceGraph.build(project)
+    expected = {project / 'index.rst': [(6, 11, 'object.png', 'img/object.png')],
+                project / 'chapter.rst': [(2, 15, 'object.png', 'img/object.png')],
+                }
+    obtained = graph.rename_edits([(project / 'object.png', project / 'img' / 'object.png')])
+    assert expected == obtained
+
+def test_references_from_nested_documents(tmp_path):
+    (tmp_path / 'chapter').mkdir()
+    (tmp_path / 'chapter' / 'index.rst').write_text(".. image:: ../object.png\n"
+                                                    ".. figure:: /object.png\n"
+                                                    ".. image:: object.png\n"
+                                                    ":doc:`./../intro` and :doc:`/intro`\n")
+    graph = ReferenceGraph.build(tmp_path)
+    assert {tmp_path / 'chapter' / 'index.rst': [(0, 11), (1, 13)]} == graph.references_to(tmp_path / 'object.png')
+    assert graph.is_referenced(tmp_path / 'chapter' / 'object.png')
+    assert {tmp_path / 'chapter' / 'index.rst': [(3, 6), (3, 29)]} == graph.references_to(tmp_path / 'intro.rst')
+
+def test_reachable(project):
+    (project / 'orphan.rst').write_text(".. image:: unused.png\n:doc:`chapter`\n")
+    graph = ReferenceGraph.build(project)
+    expected = {project / 'index.rst', project / 'chapter.rst', project / 'object.png'}
+    assert expected == graph.reachable([project / 'index.rst'])
+    assert expected | {project / 'orphan.rst', project / 'unused.png'} == graph.reachable([project / 'orphan.rst'])
@@ -0,0 +1,158 @@
+"""
+    pytest: tests the functioning of the batch renames of rst_rename
+"""
+import json
+from pathlib import Path
+from rst_rename import (expand_wildcards, read_map, order_moves, expand_edits_on_contents, rename_many,
+                        iter_planned_renames, recover_interrupted, message_stream, Transaction,
+                        _HIGHLIGHT_ESCAPE, _STANDARD_SCAPE)
+
+####################################################################################################
+
+def test_expand_wildcards_without_wildcards():
+    expected = [('img/object.png', 'images/object.png')]
+    obtained = expand_wildcards('img/object.png', 'images/object.png')
+    assert expected == obtained
+
+def test_expand_wildcards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'img').mkdir()
+    for name in ('one.png', 'two.png', 'three.jpg'):
+        (tmp_path / 'img' / name).write_text("")
+    expected = [('img/one.png', 'images/fig_one.png'),
+                ('img/two.png', 'images/fig_two.png'),
+                ]
+    obtained = expand_wildcards('img/*.png', 'images/fig_*.png')
+    assert expected == obtained
+
+def test_read_map(tmp_path):
+    mappath = tmp_path / 'renames.tsv'
+    mappath.write_text("# comment\na.png\tb.png\n\nc/d.rst\te/f.rst\n")
+    expected = [('a.png', 'b.png'), ('c/d.rst', 'e/f.rst')]
+    obtained = read_map(mappath)
+    assert expected == obtained
+
+def test_order_moves_with_chain():
+    renames = [(Path('/a'), Path('/b')), (Path('/b'), Path('/c'))]
+    expected = [(Path('/b'), Path('/c')), (Path('/a'), Path('/b'))]
+    obtained = order_moves(renames)
+    assert expected == obtained
+
+def test_order_moves_with_swap():
+    renames = [(Path('/x/a'), Path('/x/b')), (Path('/x/b'), Path('/x/a'))]
+    obtained = order_moves(renames)
+    assert 3 == len(obtained)
+    temporary = obtained[0][1]
+    assert [(Path('/x/a'), temporary), (Path('/x/b'), Path('/x/a')), (temporary, Path('/x/b'))] == obtained
+
+def test_edits_of_different_renames_on_the_same_line():
+    contents = [":doc:`one` and :download:`longname.png` and :doc:`two`\n"]
+    edits = [(0, 6, 'one.rst', 'first.rst'),
+             (0, 26, 'longname.png', 'x.png'),
+             (0, 50, 'two.rst', 'second.rst')]
+    obtained = expand_edits_on_contents(contents, edits)
+    assert 1 == len(obtained)
+    assert ":doc:`first` and :download:`x.png` and :doc:`second`\n" == obtained[0].dst
+    assert (":doc:`%sfirst%s` and :download:`%sx%s.png` and :doc:`%ssecond%s`\n" %
+            ((_HIGHLIGHT_ESCAPE, _STANDARD_SCAPE) * 3)) == obtained[0].repr
+
+def test_rename_many_swapping_files(tmp_path):
+    (tmp_path / 'index.rst').write_text(".. image:: a.png\n.. image:: b.png\n")
+    (tmp_path / 'a.png').write_text("a")
+    (tmp_path / 'b.png').write_text("b")
+    rename_many([(tmp_path / 'a.png', tmp_path / 'b.png'),
+                 (tmp_path / 'b.png', tmp_path / 'a.png')],
+                tmp_path, force=True)
+    assert ".. image:: b.png\n.. image:: a.png\n" == (tmp_path / 'index.rst').read_text()
+    assert "b" == (tmp_path / 'a.png').read_text()
+    assert "a" == (tmp_path / 'b.png').read_text()
+    assert ['a.png', 'b.png', 'index.rst'] == sorted(path.name for path in tmp_path.iterdir())
+
+def test_rename_many_with_a_folder(tmp_path):
+    (tmp_path / 'img' / 'sub').mkdir(parents=True)
+    (tmp_path / 'index.rst').write_text(".. image:: img/a.png\n:download:`img/sub/b.txt`\n.. image:: img2/a.png\n")
+    (tmp_path / 'img' / 'a.png').write_text("a")
+    (tmp_path / 'img' / 'sub' / 'b.txt').write_text("b")
+    rename_many([(tmp_path / 'img', tmp_path / 'images' / 'new')], tmp_path, force=True)
+    expected = ".. image:: images/new/a.png\n:download:`images/new/sub/b.txt`\n.. image:: img2/a.png\n"
+    assert expected == (tmp_path / 'index.rst').read_text()
+    assert "a" == (tmp_path / 'images' / 'new' / 'a.png').read_text()
+    assert "b" == (tmp_path / 'images' / 'new' / 'sub' / 'b.txt').read_text()
+    assert not (tmp_path / 'img').exists()
+
+def create_nested_project(folder):
+    (folder / 'chapter' / 'img').mkdir(parents=True)
+    (folder / 'img').mkdir()
+    (folder / 'index.rst').write_text(".. toctree::\n\n   chapter/intro\n")
+    (folder / 'chapter' / 'intro.rst').write_text(".. image:: ../img/a.png\n"
+                                                  ".. image:: /img/a.png\n"
+                                                  ".. image:: img/b.png\n"
+                                                  "See :doc:`../index`\n")
+    (folder / 'img' / 'a.png').write_text("a")
+    (folder / 'chapter' / 'img' / 'b.png').write_text("b")
+
+def test_rename_referenced_from_a_nested_document(tmp_path):
+    create_nested_project(tmp_path)
+    rename_many([(tmp_path / 'img' / 'a.png', tmp_path / 'chapter' / 'img' / 'a.png')], tmp_path, force=True)
+    expected = (".. image:: img/a.png\n"
+                ".. image:: /chapter/img/a.png\n"
+                ".. image:: img/b.png\n"
+                "See :doc:`../index`\n")
+    assert expected == (tmp_path / 'chapter' / 'intro.rst').read_text()
+
+def test_rename_a_nested_document_to_another_folder(tmp_path):
+    create_nested_project(tmp_path)
+    (tmp_path / 'part').mkdir()
+    rename_many([(tmp_path / 'chapter' / 'intro.rst', tmp_path / 'part' / 'start.rst')], tmp_path, force=True)
+    assert ".. toctree::\n\n   part/start\n" == (tmp_path / 'index.rst').read_text()
+    expected = (".. image:: ../img/a.png\n"
+                ".. image:: /img/a.png\n"
+                ".. image:: ../chapter/img/b.png\n"
+                "See :doc:`../index`\n")
+    assert expected == (tmp_path / 'part' / 'start.rst').read_text()
+
+def test_rename_a_folder_with_documents(tmp_path):
+    create_nested_project(tmp_path)
+    rename_many([(tmp_path / 'chapter', tmp_path / 'parts' / 'one')], tmp_path, force=True)
+    assert ".. toctree::\n\n   parts/one/intro\n" == (tmp_path / 'index.rst').read_text()
+    expected = (".. image:: ../../img/a.png\n"
+                ".. image:: /img/a.png\n"
+                ".. image:: img/b.png\n"
+                "See :doc:`../../index`\n")
+    assert expected == (tmp_path / 'parts' / 'one' / 'intro.rst').read_text()
+
+def test_rename_many_as_ndjson(tmp_path, capsys):
+    (tmp_path / 'index.rst').write_text("Index\n\n.. image:: a.png\n")
+    (tmp_path / 'a.png').write_text("a")
+    renames = [(tmp_path / 'a.png', tmp_path / 'img' / 'b.png')]
+    expected = [{'type': 'change', 'file': 'index.rst', 'linenr': 2, 'src': '.. image:: a.png',
+                 'dst': '.. image:: img/b.png', 'edits': [{'pos': 11, 'src': 'a.png', 'dst': 'img/b.png'}]},
+                {'type': 'rename', 'src': 'a.png', 'dst': 'img/b.png'},
+                {'type': 'summary', 'files': 1, 'changes': 1, 'renames': 1, 'applied': False},
+                ]
+    rename_many(renames, tmp_path, force=False, output_format='ndjson')
+    assert expected == [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert (tmp_path / 'a.png').exists()
+    rename_many(renames, tmp_path, force=True, output_format='ndjson')
+    expected[-1]['applied'] = True
+    assert expected == [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert ".. image:: img/b.png\n" in (tmp_path / 'index.rst').read_text()
+
+def test_renames_are_planned_file_by_file(tmp_path):
+    for name in ('a.rst', 'b.rst', 'c.rst'):
+        (tmp_path / name).write_text(".. image:: x.png\n")
+    (tmp_path / 'x.png').write_text("")
+    planned = iter_planned_renames([(tmp_path / 'x.png', tmp_path / 'y.png')], tmp_path)
+    path, (_, expanded_changes) = next(planned)
+    assert tmp_path / 'a.rst' == path
+    assert ".. image:: y.png\n" == expanded_changes[0].dst
+    (tmp_path / 'c.rst').write_text("Not referenced anymore\n")     # not scanned yet
+    assert [tmp_path / 'b.rst'] == [path for path, _ in planned]
+
+def test_messages_dont_mix_with_ndjson(tmp_path, capsys):
+    (tmp_path / Transaction.JOURNAL_NAME).write_text(json.dumps({'files': [], 'moves': []}) + "\n")
+    recover_interrupted(tmp_path, message_stream({'format': 'ndjson'}))
+    captured = capsys.readouterr()
+    assert "" == captured.out
+    assert captured.err.startswith("WARNING")
+    assert not (tmp_path / Transaction.JOURNAL_NAME).exists()
@@ -0,0 +1,52 @@
+"""
+    pytest: tests the functioning of rst_check
+"""
+from rstutils import Reference, list_tree
+from rst_check import find_broken_references
+
+####################################################################################################
+
+def create_project(folder):
+    (folder / 'chapter').mkdir()
+    (folder / 'img').mkdir()
+    (folder / 'index.rst').write_text(".. toctree::\n\n   self\n   chapter/intro\n   chapter/missing\n\n"
+                                      ".. image:: img/a.png\n.. image:: https://example.org/logo.png\n")
+    (folder / 'chapter' / 'intro.rst').write_text(".. image:: ../img/a.png\n"
+                                                  ".. figure:: img/a.png\n"
+                                                  ":download:`/img/b.png` :ref:`label`\n"
+                                                  ":doc:`../index` and :doc:`Intro <intro>`\n"
+                                                  ".. include:: parts/common.rst\n")
+    (folder / 'img' / 'a.png').write_text("")
+
+
+def test_list_tree(tmp_path):
+    create_project(tmp_path)
+    expected = {'index.rst', 'chapter', 'chapter/intro.rst', 'img', 'img/a.png'}
+    assert expected == list_tree(tmp_path)
+
+def test_broken_references(tmp_path):
+    create_project(tmp_path)
+    expected = [(tmp_path / 'index.rst', Reference('toctree', 4, 3, 'chapter/missing')),
+                (tmp_path / 'chapter' / 'intro.rst', Reference('figure', 1, 12, 'img/a.png')),
+                (tmp_path / 'chapter' / 'intro.rst', Reference('download', 2, 11, '/img/b.png')),
+                (tmp_path / 'chapter' / 'intro.rst', Reference('include', 4, 13, 'parts/common.rst')),
+                ]
+    obtained = list(find_broken_references(tmp_path))
+    assert expected == obtained
+
+def test_references_outside_the_base_folder(tmp_path):
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'example.py').write_text("print(1)\n")
+    (tmp_path / 'doc').mkdir()
+    (tmp_path / 'doc' / 'index.rst').write_text(".. literalinclude:: ../src/example.py\n"
+                                                ".. literalinclude:: ../src/missing.py\n")
+    expected = [(tmp_path / 'doc' / 'index.rst', Reference('literalinclude', 1, 20, '../src/missing.py'))]
+    assert expected == list(find_broken_references(tmp_path / 'doc'))
+
+def test_generated_documents_are_not_broken(tmp_path):
+    (tmp_path / 'index.rst').write_text(".. toctree::\n\n   genindex\n   modindex\n   search\n")
+    assert [] == list(find_broken_references(tmp_path))
+
+def test_no_broken_references(tmp_path):
+    (tmp_path / 'index.rst').write_text(".. toctree::\n   :glob:\n\n   chapter/*\n\n:ref:`label`\n")
+    assert [] == list(find_broken_references(tmp_path))
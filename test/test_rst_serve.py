@@ -0,0 +1,147 @@
+"""
+    pytest: tests the functioning of the rst_serve.py daemon and its use from the other scripts
+"""
+import sys
+import signal
+import threading
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import rstutils
+import rst_serve
+from rst_ls_unref import check_unreferenced
+from rst_rename import plan_renames
+
+####################################################################################################
+
+@pytest.fixture
+def daemon(project):
+    """ serves the references of the shared project (see conftest.py) while the test runs """
+    index = rst_serve.ReferenceIndex(project, watcher=rst_serve.create_watcher(project))
+    server = rst_serve.ReferenceServer(project / rstutils.SOCKET_NAME, index)
+    watching = threading.Thread(target=index.watch, daemon=True)
+    watching.start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield index
+    server.shutdown()
+    server.server_close()
+    index.watcher.close()
+    thread.join()
+    watching.join()
+
+
+def test_no_daemon(tmp_path):
+    assert rstutils.query_daemon(tmp_path, {'op': 'ping'}) is None
+
+def test_stale_socket(tmp_path):
+    (tmp_path / rstutils.SOCKET_NAME).write_text("")
+    assert rstutils.query_daemon(tmp_path, {'op': 'ping'}) is None
+
+def test_references(tmp_path, daemon):
+    response = rstutils.query_daemon(tmp_path, {'op': 'references', 'target': str(tmp_path / 'object.png')})
+    expected = {str(tmp_path / 'index.rst'): [[6, 11]], str(tmp_path / 'chapter.rst'): [[2, 15]]}
+    assert expected == response['references']
+
+def test_unknown_op(tmp_path, daemon):
+    assert rstutils.query_daemon(tmp_path, {'op': 'unknown'}) is None
+
+def test_unreferenced_from_the_daemon(tmp_path, daemon):
+    (tmp_path / 'late.png').write_text("")
+    daemon.graph.add_document(tmp_path / 'late.rst', [])     # only known by the daemon
+    expected = [tmp_path / 'late.png', tmp_path / 'unused.png']
+    assert expected == check_unreferenced([tmp_path / 'late.png', tmp_path / 'unused.png'], tmp_path)
+
+def test_plan_rename_from_the_daemon(tmp_path, daemon):
+    changes = plan_renames([(tmp_path / 'object.png', tmp_path / 'image.png')], tmp_path)
+    assert [tmp_path / 'chapter.rst', tmp_path / 'index.rst'] == list(changes)
+    _, expanded_changes = changes[tmp_path / 'index.rst']
+    assert ".. image:: image.png\n" == expanded_changes[0].dst
+
+def test_plan_rename_with_outdated_daemon(tmp_path, daemon):
+    (tmp_path / 'index.rst').write_text("Index\n\n.. image:: object.png\n")     # not updated yet
+    changes = plan_renames([(tmp_path / 'object.png', tmp_path / 'image.png')], tmp_path)
+    _, expanded_changes = changes[tmp_path / 'index.rst']
+    assert 2 == expanded_changes[0].linenr
+
+def test_new_file_before_the_watcher_applies_it(tmp_path, daemon):
+    (tmp_path / 'other.png').write_text("")
+    (tmp_path / 'new.rst').write_text(".. image:: object.png\n.. image:: other.png\n")
+    changes = plan_renames([(tmp_path / 'object.png', tmp_path / 'image.png')], tmp_path)
+    assert [tmp_path / 'chapter.rst', tmp_path / 'index.rst', tmp_path / 'new.rst'] == list(changes)
+    assert [tmp_path / 'unused.png'] == check_unreferenced([tmp_path / 'other.png', tmp_path / 'unused.png'],
+                                                           tmp_path)
+
+def test_unwatched_index_doesnt_answer(project):
+    index = rst_serve.ReferenceIndex(project)
+    assert not index.answer({'op': 'references', 'target': str(project / 'object.png')})['ok']
+
+def test_update_index(tmp_path, daemon):
+    (tmp_path / 'chapter.rst').unlink()
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'new.rst').write_text(".. image:: /unused.png\n")
+    daemon.update([tmp_path / 'chapter.rst', tmp_path / 'sub'])
+    assert [tmp_path / 'index.rst', tmp_path / 'sub' / 'new.rst'] == list(daemon.graph.documents())
+    assert daemon.graph.is_referenced(tmp_path / 'unused.png')
+    assert {tmp_path / 'index.rst': [(6, 11)]} == daemon.graph.references_to(tmp_path / 'object.png')
+
+def test_update_index_forgets_the_paths_on_folder_changes(tmp_path, daemon):
+    rstutils.spell_path('img/a.png', 'chapter')
+    daemon.update([tmp_path / 'chapter.rst'])
+    assert rstutils.spell_path.cache_info().currsize
+    (tmp_path / 'sub').mkdir()
+    daemon.update([tmp_path / 'sub'])
+    assert 0 == rstutils.spell_path.cache_info().currsize
+
+def test_polling_watcher(project):
+    watcher = rst_serve.PollingWatcher(project)
+    (project / 'chapter.rst').unlink()
+    (project / 'new.rst').write_text("New\n")
+    (project / 'new.png').write_text("")
+    assert {project / 'chapter.rst', project / 'new.rst'} == watcher.poll()
+    assert set() == watcher.poll()
+
+def test_inotify_watcher(project):
+    try:
+        watcher = rst_serve.InotifyWatcher(project)
+    except (OSError, AttributeError):
+        pytest.skip("inotify is not available")
+    try:
+        (project / 'chapter.rst').write_text("Modified\n")
+        (project / 'sub').mkdir()
+        (project / 'new.png').write_text("")
+        assert {project / 'chapter.rst', project / 'sub'} == watcher.poll(timeout=1)
+        (project / 'sub' / 'new.rst').write_text("New\n")
+        assert {project / 'sub' / 'new.rst'} == watcher.poll(timeout=1)
+    finally:
+        watcher.close()
+
+def test_closing_the_inotify_watcher_stops_waiting(tmp_path):
+    try:
+        watcher = rst_serve.InotifyWatcher(tmp_path)
+    except (OSError, AttributeError):
+        pytest.skip("inotify is not available")
+    index = rst_serve.ReferenceIndex(tmp_path, watcher=watcher)
+    watching = threading.Thread(target=index.watch, daemon=True)
+    watching.start()
+    watcher.close()
+    watching.join(timeout=5)
+    assert not watching.is_alive()
+    with pytest.raises(ValueError):
+        watcher.poll(timeout=0)
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGTERM'), reason="SIGTERM is not available")
+def test_terminated_daemon_removes_its_socket(project):
+    daemon = subprocess.Popen([sys.executable, str(Path(rst_serve.__file__)), '-b', str(project)],
+                              stdout=subprocess.PIPE)
+    try:
+        assert daemon.stdout.readline().startswith(b"Serving")
+        assert rstutils.query_daemon(project, {'op': 'ping'})['ok']
+        daemon.terminate()
+        assert 0 == daemon.wait(timeout=10)
+    finally:
+        daemon.kill()
+        daemon.stdout.close()
+    assert not (project / rstutils.SOCKET_NAME).exists()
@@ -0,0 +1,226 @@
+"""
+    pytest: tests the functioning of rst_rename.Transaction
+"""
+import json
+import shutil
+import subprocess
+import pytest
+from rst_rename import Transaction, GitRepository, plan_moves
+
+####################################################################################################
+
+def create_files(folder):
+    (folder / 'index.rst').write_text(".. image:: a.png\n")
+    (folder / 'other.rst').write_text(":download:`a.png`\n")
+    (folder / 'a.png').write_text("a")
+
+
+def test_everything_is_performed(tmp_path):
+    create_files(tmp_path)
+    contents = {tmp_path / 'index.rst': ".. image:: b.png\n",
+                tmp_path / 'other.rst': ":download:`b.png`\n"}
+    Transaction(tmp_path).run(contents, [(tmp_path / 'a.png', tmp_path / 'b.png')])
+    assert ".. image:: b.png\n" == (tmp_path / 'index.rst').read_text()
+    assert ":download:`b.png`\n" == (tmp_path / 'other.rst').read_text()
+    assert "a" == (tmp_path / 'b.png').read_text()
+    assert ['b.png', 'index.rst', 'other.rst'] == sorted(path.name for path in tmp_path.iterdir())
+
+def test_contents_are_written_as_utf8(tmp_path):
+    (tmp_path / 'index.rst').write_bytes("Índex\n".encode())
+    Transaction(tmp_path).run({tmp_path / 'index.rst': "Índex\n\n.. image:: café.png\n"}, list())
+    assert "Índex\n\n.. image:: café.png\n".encode() == (tmp_path / 'index.rst').read_bytes()
+
+class FailingRepository:
+    """ repository that fails the first time the moves are registered """
+    toplevel = '/'
+
+    def __init__(self):
+        self.calls = list()
+
+    def affected_entries(self, moves):
+        return {'a.png': ['100644', 'a' * 40], 'b.png': None}
+
+    def restore_index_entries(self, affected):
+        self.calls.append(affected)
+
+    def move_index_entries(self, moves):
+        self.calls.append(moves)
+        raise OSError("simulated failure")
+
+
+def test_nothing_is_performed_when_registering_moves_fails(tmp_path):
+    create_files(tmp_path)
+    repository = FailingRepository()
+    contents = {tmp_path / 'index.rst': ".. image:: b.png\n",
+                tmp_path / 'other.rst': ":download:`b.png`\n"}
+    with pytest.raises(OSError):
+        Transaction(tmp_path).run(contents, [(tmp_path / 'a.png', tmp_path / 'b.png')], repository)
+    assert {'a.png': ['100644', 'a' * 40], 'b.png': None} == repository.calls[1]
+    assert ".. image:: a.png\n" == (tmp_path / 'index.rst').read_text()
+    assert ":download:`a.png`\n" == (tmp_path / 'other.rst').read_text()
+    assert ['a.png', 'index.rst', 'other.rst'] == sorted(path.name for path in tmp_path.iterdir())
+
+def test_recover_after_an_interruption(tmp_path):
+    create_files(tmp_path)
+    backup = tmp_path / '.index.rst.tmp.rst_rename-backup'
+    backup.write_text(".. image:: a.png\n")
+    plan = {'files': [(str(tmp_path / 'index.rst'), str(tmp_path / '.index.rst.tmp'), str(backup)),
+                      (str(tmp_path / 'other.rst'), str(tmp_path / '.other.rst.tmp'),
+                       str(tmp_path / '.other.rst.tmp.rst_rename-backup'))],
+            'moves': plan_moves([(tmp_path / 'a.png', tmp_path / 'b.png')])}
+    (tmp_path / Transaction.JOURNAL_NAME).write_text(json.dumps(plan) + "\n")
+    (tmp_path / 'index.rst').write_text(".. image:: b.png\n")
+    (tmp_path / 'a.png').rename(tmp_path / 'b.png')
+    Transaction(tmp_path).recover()
+    assert ".. image:: a.png\n" == (tmp_path / 'index.rst').read_text()
+    assert ['a.png', 'index.rst', 'other.rst'] == sorted(path.name for path in tmp_path.iterdir())
+
+def create_swap(folder):
+    (folder / 'doc.rst').write_text(".. image:: a.png\n.. image:: b.png\n")
+    (folder / 'a.png').write_text("A")
+    (folder / 'b.png').write_text("B")
+    temporary = folder / '.a.png.rst_rename0'
+    return [(folder / 'a.png', temporary), (folder / 'b.png', folder / 'a.png'), (temporary, folder / 'b.png')]
+
+def test_swap_is_not_performed_when_writing_fails(tmp_path, monkeypatch):
+    moves = create_swap(tmp_path)
+
+    def failing_write(path, text):
+        raise OSError("simulated failure")
+
+    monkeypatch.setattr(Transaction, '_write_temporary', staticmethod(failing_write))
+    with pytest.raises(OSError):
+        Transaction(tmp_path).run({tmp_path / 'doc.rst': ".. image:: b.png\n.. image:: a.png\n"}, moves)
+    assert "A" == (tmp_path / 'a.png').read_text()
+    assert "B" == (tmp_path / 'b.png').read_text()
+    assert ".. image:: a.png\n.. image:: b.png\n" == (tmp_path / 'doc.rst').read_text()
+
+def test_swap_is_undone_when_it_fails_halfway(tmp_path, monkeypatch):
+    moves = create_swap(tmp_path)
+    original_rename = type(tmp_path).rename
+
+    def failing_rename(path, target):
+        if path.name == 'b.png' and target.name == 'a.png':
+            raise OSError("simulated failure")
+        return original_rename(path, target)
+
+    monkeypatch.setattr(type(tmp_path), 'rename', failing_rename)
+    with pytest.raises(OSError):
+        Transaction(tmp_path).run({tmp_path / 'doc.rst': ".. image:: b.png\n.. image:: a.png\n"}, moves)
+    assert "A" == (tmp_path / 'a.png').read_text()
+    assert "B" == (tmp_path / 'b.png').read_text()
+    assert ['a.png', 'b.png', 'doc.rst'] == sorted(path.name for path in tmp_path.iterdir())
+
+def test_recover_a_swap_interrupted_before_moving(tmp_path):
+    moves = create_swap(tmp_path)
+    plan = {'files': list(), 'moves': plan_moves(moves)}
+    (tmp_path / Transaction.JOURNAL_NAME).write_text(json.dumps(plan) + "\n")
+    Transaction(tmp_path).recover()
+    assert "A" == (tmp_path / 'a.png').read_text()
+    assert "B" == (tmp_path / 'b.png').read_text()
+
+def test_recover_a_swap_interrupted_while_moving(tmp_path):
+    moves = create_swap(tmp_path)
+    plan = {'files': list(), 'moves': plan_moves(moves)}
+    (tmp_path / Transaction.JOURNAL_NAME).write_text(json.dumps(plan) + "\n")
+    for src, dst in moves[:2]:
+        src.rename(dst)
+    Transaction(tmp_path).recover()
+    assert "A" == (tmp_path / 'a.png').read_text()
+    assert "B" == (tmp_path / 'b.png').read_text()
+    assert ['a.png', 'b.png', 'doc.rst'] == sorted(path.name for path in tmp_path.iterdir())
+
+def test_recover_once_every_step_is_done(tmp_path):
+    moves = create_swap(tmp_path)
+    plan = {'files': list(), 'moves': plan_moves(moves), 'git': None}
+    for src, dst in moves:
+        src.rename(dst)
+    (tmp_path / Transaction.JOURNAL_NAME).write_text(json.dumps(plan) + "\n" + json.dumps({'done': 'moves'}) + "\n")
+    Transaction(tmp_path).recover()
+    assert "B" == (tmp_path / 'a.png').read_text()
+    assert "A" == (tmp_path / 'b.png').read_text()
+    assert ['a.png', 'b.png', 'doc.rst'] == sorted(path.name for path in tmp_path.iterdir())
+
+def test_journal_is_written_once_per_phase(tmp_path, monkeypatch):
+    moves = list()
+    for nr in range(20):
+        (tmp_path / ('%02d.png' % nr)).write_text("")
+        moves.append((tmp_path / ('%02d.png' % nr), tmp_path / ('%02d.jpg' % nr)))
+    records = list()
+    monkeypatch.setattr(Transaction, '_log_progress', lambda transaction, record: records.append(record))
+    Transaction(tmp_path).run(dict(), moves)
+    assert [{'done': 'moves'}] == records
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="git is not available")
+def test_moves_are_registered_in_git(tmp_path):
+    create_files(tmp_path)
+    for args in (['init', '-q'], ['add', '.']):
+        subprocess.run(['git'] + args, cwd=tmp_path, check=True)
+    repository = GitRepository.containing(tmp_path)
+    assert repository.is_tracked(tmp_path / 'a.png')
+    Transaction(tmp_path).run(dict(), [(tmp_path / 'a.png', tmp_path / 'b.png')], repository)
+    status = subprocess.run(['git', 'status', '--porcelain'], cwd=tmp_path, check=True,
+                            stdout=subprocess.PIPE).stdout.decode()
+    assert 'A  b.png' in status
+    assert 'a.png' not in status
+
+def git(folder, *args):
+    return subprocess.run(['git'] + list(args), cwd=folder, check=True, stdout=subprocess.PIPE).stdout.decode()
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="git is not available")
+def test_index_is_untouched_when_nothing_was_moved(tmp_path, monkeypatch):
+    (tmp_path / 'doc.rst').write_text(".. image:: a.png\n")
+    (tmp_path / 'a.png').write_text("A")
+    (tmp_path / 'b.png').write_text("B")
+    git(tmp_path, 'init', '-q')
+    git(tmp_path, 'add', '.')
+    index = git(tmp_path, 'ls-files', '--stage')
+
+    def failing_write(path, text):
+        raise OSError("simulated failure")
+
+    monkeypatch.setattr(Transaction, '_write_temporary', staticmethod(failing_write))
+    moves = [(tmp_path / 'b.png', tmp_path / 'c.png'), (tmp_path / 'a.png', tmp_path / 'b.png')]
+    with pytest.raises(OSError):
+        Transaction(tmp_path).run({tmp_path / 'doc.rst': ".. image:: b.png\n"}, moves, GitRepository.containing(tmp_path))
+    assert index == git(tmp_path, 'ls-files', '--stage')
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="git is not available")
+def test_index_is_restored_when_registering_a_swap_fails(tmp_path, monkeypatch):
+    moves = create_swap(tmp_path)
+    git(tmp_path, 'init', '-q')
+    git(tmp_path, 'add', '.')
+    index = git(tmp_path, 'ls-files', '--stage')
+    original_move = GitRepository.move_index_entries
+
+    def failing_move(repository, moves):
+        original_move(repository, moves)
+        raise OSError("simulated failure")
+
+    monkeypatch.setattr(GitRepository, 'move_index_entries', failing_move)
+    with pytest.raises(OSError):
+        Transaction(tmp_path).run(dict(), moves, GitRepository.containing(tmp_path))
+    assert index == git(tmp_path, 'ls-files', '--stage')
+    assert "A" == (tmp_path / 'a.png').read_text()
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="git is not available")
+def test_recover_after_dying_while_registering_a_swap(tmp_path, monkeypatch):
+    moves = create_swap(tmp_path)
+    git(tmp_path, 'init', '-q')
+    git(tmp_path, 'add', '.')
+    index = git(tmp_path, 'ls-files', '--stage')
+    original_move = GitRepository.move_index_entries
+
+    def dying_move(repository, moves):
+        original_move(repository, moves)
+        raise SystemExit("simulated death")
+
+    monkeypatch.setattr(GitRepository, 'move_index_entries', dying_move)
+    monkeypatch.setattr(Transaction, '_rollback', lambda *args: None)    # the process is gone
+    with pytest.raises(SystemExit):
+        Transaction(tmp_path).run(dict(), moves, GitRepository.containing(tmp_path))
+    monkeypatch.undo()
+    Transaction(tmp_path).recover()
+    assert index == git(tmp_path, 'ls-files', '--stage')
+    assert "A" == (tmp_path / 'a.png').read_text()
+    assert "B" == (tmp_path / 'b.png').read_text()
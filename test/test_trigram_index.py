@@ -0,0 +1,63 @@
+"""
+    pytest: tests the functioning of rstutils.TrigramIndex
+"""
+import os
+
+from rstutils import TrigramIndex, ReferenceGraph, trigrams_of, iter_references
+
+####################################################################################################
+
+def create_project(folder):
+    (folder / 'a.rst').write_text(".. image:: object.png\n")
+    (folder / 'b.rst').write_text("See :download:`other.png`\n")
+    (folder / 'c.rst').write_text("Nothing to see here..\n")
+    return sorted(folder.glob('*.rst'))
+
+
+def test_trigrams_of():
+    assert {b'abc', b'bcd', b'x.p'} == trigrams_of(b"abcd x.p  y")
+
+def test_candidates(tmp_path):
+    rst_files = create_project(tmp_path)
+    with TrigramIndex.in_folder(tmp_path) as index:
+        assert {tmp_path / 'a.rst'} == index.candidates(rst_files, ['object.png'])
+        assert {tmp_path / 'a.rst', tmp_path / 'b.rst'} == index.candidates(rst_files, ['object.png', 'other'])
+        assert set() == index.candidates(rst_files, ['unused.png'])
+        assert set(rst_files) == index.candidates(rst_files, ['ab'])    # too short
+
+def test_incremental_update(tmp_path):
+    rst_files = create_project(tmp_path)
+    with TrigramIndex.in_folder(tmp_path) as index:
+        index.update(rst_files)
+    (tmp_path / 'c.rst').write_text(".. figure:: object.png\n")
+    os.utime(tmp_path / 'c.rst', ns=(1, 1))     # no matter the resolution of mtime
+    (tmp_path / 'a.rst').unlink()
+    rst_files = sorted(tmp_path.glob('*.rst'))
+    with TrigramIndex.in_folder(tmp_path) as index:     # reopened from disk
+        assert {tmp_path / 'c.rst'} == index.candidates(rst_files, ['object.png'])
+        assert [(2,)] == list(index._connection.execute('SELECT COUNT(*) FROM files'))
+
+def test_graph_with_trigrams_only_reads_candidates(tmp_path):
+    create_project(tmp_path)
+    with TrigramIndex.in_folder(tmp_path) as index:
+        index.update(sorted(tmp_path.glob('*.rst')))
+        stat = (tmp_path / 'c.rst').stat()
+        (tmp_path / 'c.rst').write_text(".. image:: object.png\n")   # unnoticed by the index
+        os.utime(tmp_path / 'c.rst', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        graph = ReferenceGraph.build(tmp_path, targets=[tmp_path / 'object.png'], trigrams=index)
+    assert {tmp_path / 'a.rst': [(0, 11)]} == graph.references_to(tmp_path / 'object.png')
+
+def test_iter_references_with_trigrams(tmp_path):
+    create_project(tmp_path)
+    with TrigramIndex.in_folder(tmp_path) as index:
+        obtained = list(iter_references(tmp_path, 'other.png', trigrams=index))
+    assert [(tmp_path / 'b.rst', 0, 15, 'download')] == obtained
+
+def test_references_to_a_folder_with_trigrams(tmp_path):
+    (tmp_path / 'img').mkdir()
+    (tmp_path / 'img' / 'gallery.rst').write_text(".. image:: a.png\n")
+    with TrigramIndex.in_folder(tmp_path) as index:
+        obtained = list(iter_references(tmp_path, 'img', trigrams=index))
+        graph = ReferenceGraph.build(tmp_path, targets=[tmp_path / 'img'], trigrams=index)
+    assert [(tmp_path / 'img' / 'gallery.rst', 0, 11, 'image')] == obtained
+    assert graph.is_referenced(tmp_path / 'img' / 'a.png')
@@ -0,0 +1,60 @@
+"""
+    pytest: tests the functioning of rstutils.walk_files() and rstutils.get_rst_in_folder()
+"""
+import os
+from rstutils import walk_files, get_rst_in_folder
+
+####################################################################################################
+
+def create_tree(folder):
+    for name in ('index.rst', 'object.png', 'a/one.rst', 'a/b/two.rst', 'a/b/two.png',
+                 'c/three.rst', '_build/built.rst', '.git/HEAD'):
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+
+
+def test_rst_in_subfolders(tmp_path):
+    create_tree(tmp_path)
+    expected = [tmp_path / 'index.rst',
+                tmp_path / 'a/one.rst',
+                tmp_path / 'c/three.rst',
+                tmp_path / 'a/b/two.rst',
+                ]
+    obtained = list(get_rst_in_folder(tmp_path))
+    assert expected == obtained
+
+def test_all_files(tmp_path):
+    create_tree(tmp_path)
+    expected = [tmp_path / 'index.rst',
+                tmp_path / 'object.png',
+                tmp_path / 'a/one.rst',
+                tmp_path / 'c/three.rst',
+                tmp_path / 'a/b/two.png',
+                tmp_path / 'a/b/two.rst',
+                ]
+    obtained = list(walk_files(tmp_path))
+    assert expected == obtained
+
+def test_symlinks_are_followed_without_cycles(tmp_path):
+    create_tree(tmp_path)
+    os.symlink(tmp_path, tmp_path / 'a' / 'loop')
+    os.symlink(tmp_path / 'a' / 'b', tmp_path / 'linked')
+    obtained = list(get_rst_in_folder(tmp_path))
+    assert len(obtained) == len(set(obtained))
+    assert set(path.name for path in obtained) == {'index.rst', 'one.rst', 'two.rst', 'three.rst'}
+
+def test_symlinked_folder_outside_is_followed(tmp_path):
+    (tmp_path / 'outside').mkdir()
+    (tmp_path / 'outside' / 'other.rst').write_text("")
+    (tmp_path / 'project').mkdir()
+    os.symlink(tmp_path / 'outside', tmp_path / 'project' / 'linked')
+    expected = [tmp_path / 'project' / 'linked' / 'other.rst']
+    obtained = list(get_rst_in_folder(tmp_path / 'project'))
+    assert expected == obtained
+
+def test_same_result_with_threads(tmp_path):
+    create_tree(tmp_path)
+    expected = list(walk_files(tmp_path))
+    obtained = list(walk_files(tmp_path, threads=4))
+    assert expected == obtained